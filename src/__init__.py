@@ -349,7 +349,7 @@ _lazy_import('thread', [
 _lazy_import('timer', [
     'Timer', 'WeakTimer', 'OneShotTimer', 'WeakOneShotTimer', 'AtTimer',
     'OneShotAtTimer', 'timed', 'POLICY_ONCE', 'POLICY_MANY', 'POLICY_RESTART',
-    'delay'
+    'delay', 'set_timer_slack'
 ])
 
 # IO/Socket handling
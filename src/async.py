@@ -257,6 +257,7 @@ class InProgress(Signal, Object):
         """
         return self
 
+
     @property
     def exception(self):
         """
@@ -35,7 +35,8 @@ import fcntl
 import signal
 import time
 import errno
-import Queue
+import struct
+import collections
 
 # kaa imports
 from .callable import Callable, WeakCallable, CallableError
@@ -46,6 +47,34 @@ from . import nf_wrapper as notifier
 log = logging.getLogger('kaa.base.core')
 
 
+def _get_eventfd():
+    """
+    Returns a function creating a new eventfd, or None if eventfd is not
+    available.
+    """
+    if hasattr(os, 'eventfd'):
+        # Python 3.10+
+        return lambda: os.eventfd(0)
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        eventfd = libc.eventfd
+    except (ImportError, OSError, AttributeError):
+        return None
+    eventfd.argtypes = [ctypes.c_uint, ctypes.c_int]
+    def create():
+        fd = eventfd(0, 0)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return fd
+    return create
+
+_eventfd = _get_eventfd()
+
+
 class CoreThreading:
     """
     CoreThreading is a namespace (not intended to be instantiated) holding
@@ -64,6 +93,21 @@ class CoreThreading:
     # executing callbacks that were queued to be invoked from the main loop.
     mainthread_callback_max_time = 2.0
 
+    # The maximum number of queued callbacks run_queue() will invoke per main
+    # loop step before yielding to other events (timers, IO).
+    mainthread_callback_max_items = 1000
+
+    # The maximum number of callbacks that may be queued for the main thread.
+    # Threads queuing further callbacks will block until the main loop caught
+    # up, to prevent suicide-by-queuing.  See run_queue() for more details.
+    mainthread_queue_max = 10000
+
+    # If True, an eventfd is used to wake up the main loop from other threads
+    # where available (Linux), which coalesces any number of wakeups into a
+    # single counter.  Otherwise (or if eventfd is not available) a pipe is
+    # used.  Takes effect the next time CoreThreading.init() is called.
+    use_eventfd = True
+
     # Internal only attributes.
     #
     # The thread pipe, which is created by CoreThreading.init(), is used
@@ -71,7 +115,11 @@ class CoreThreading:
     # and CoreThreading.wakeup().  XXX: this pipe must not be carried through
     # to forked children, or ugly behaviour will ensue.  kaa.utils.fork() and
     # .daemonize() will ensure a new pipe is created in the child process.
+    # It is a (read fd, write fd) tuple, where both are the same fd if it is
+    # an eventfd.
     _pipe = None
+    # The token written to _pipe to wake up the main loop.
+    _pipe_token = None
     # The signal wake pipe.  We pass the write side of the pipe to Python's
     # signal.set_wakeup_fd(), and any time there is a unix signal received
     # for which there has been a Python handler attached, the interpreter
@@ -81,19 +129,29 @@ class CoreThreading:
     # received by the main thread, but Python always queues the handler to be
     # executed from the main thread.  Without this, we could wait up to 30
     # seconds (the maximum sleep time in notifier) to handle a signal.
+    #
+    # This can't be an eventfd, because the interpreter writes single bytes
+    # to it, and eventfd requires 8 byte writes.  A signalfd is not an option
+    # either, as it requires the signals to be blocked in all threads.
     _signal_wake_pipe = None
     # Holds a queue of callbacks and their arguments that need to be executed
     # from the main loop (by CoreThreading.run_queue, which is called by the
-    # notifier when there is activity on the pipe.)  The queue has some fairly
-    # large upper limit to prevent suicide-by-queuing.  See run_queue() for
-    # more details.
-    _queue = Queue.Queue(10000)
-    # Mutex to ensure put/qsize is atomic in queue_callback()
-    _queue_put_lock = threading.Lock()
+    # notifier when there is activity on the pipe.)  Appending to and popping
+    # from a deque are atomic, so no lock is needed for the common case.
+    _queue = collections.deque()
+    # True if the main loop has been woken up and run_queue() has not yet
+    # begun to process the queue.  Used to write to the thread pipe only once
+    # for any number of callbacks queued in between.
+    _wakeup_pending = False
+    # Condition on which threads wait if the queue is full.
+    _queue_not_full = threading.Condition(threading.Lock())
+    _queue_full_waiters = 0
     _mainthread = threading.currentThread()
     # Create a one byte dummy token for writing to the pipe.  Normally we'd
     # just use b'1' but Python 2.5 can't parse it.
     _PIPE_NOTIFY_TOKEN = bl('1')
+    # eventfd expects an unsigned 64 bit integer to add to its counter.
+    _EVENTFD_NOTIFY_TOKEN = struct.pack('@Q', 1)
 
 
     @staticmethod
@@ -118,13 +176,18 @@ class CoreThreading:
         if CoreThreading._pipe:
             # There is an existing pipe already, so stop monitoring it.
             notifier.socket_remove(CoreThreading._pipe[0])
-        CoreThreading._pipe = CoreThreading._create_nonblocking_pipe()
+            for fd in set(CoreThreading._pipe):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        CoreThreading._pipe, CoreThreading._pipe_token = CoreThreading._create_wakeup_fd()
         notifier.socket_add(CoreThreading._pipe[0], CoreThreading.run_queue)
 
+        CoreThreading._wakeup_pending = False
         if purge:
-            while not CoreThreading._queue.empty():
-                CoreThreading._queue.get()
-        elif not CoreThreading._queue.empty():
+            CoreThreading._queue.clear()
+        elif CoreThreading._queue:
             # A thread is already running and wanted to run something in the
             # mainloop before the mainloop is started. In that case we need
             # to wakeup the loop ASAP to handle the requests.
@@ -168,21 +231,49 @@ class CoreThreading:
         timer_id = notifier.timer_add(0, notifier_handler_cb)
 
 
+    @staticmethod
+    def _create_wakeup_fd():
+        """
+        Creates the file descriptors used to wake up the main loop from other
+        threads.  Returns a ((read fd, write fd), token) tuple, where token
+        is what needs to be written to the write fd.
+
+        An eventfd is preferred if available, because writing to it merely
+        increments a counter: it can never fill up like a pipe, and reading
+        it once resets the counter no matter how many wakeups occurred.
+        """
+        if CoreThreading.use_eventfd and _eventfd:
+            try:
+                fd = _eventfd()
+            except OSError, e:
+                log.warning('Unable to create eventfd, falling back to pipe: %s', e)
+            else:
+                CoreThreading._set_nonblocking(fd)
+                return (fd, fd), CoreThreading._EVENTFD_NOTIFY_TOKEN
+        return CoreThreading._create_nonblocking_pipe(), CoreThreading._PIPE_NOTIFY_TOKEN
+
+
+    @staticmethod
+    def _set_nonblocking(fd):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
     @staticmethod
     def _create_nonblocking_pipe():
         pipe = os.pipe()
         for fd in pipe:
-            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
-            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+            CoreThreading._set_nonblocking(fd)
         return pipe
 
 
     @staticmethod
     def _purge_pipe(fd):
         """
-        Purges all data from the given file descriptor.  Silently ignores
+        Purges all data from the given file descriptor (a pipe or an eventfd,
+        which is reset by a single read).  Silently ignores
         EAGAIN under the assumption that the pipe is used for some sort of
         wakeup and the wakeup has happened, so it's not worth complaining
         about.  In any case, the select(2) man page says that on Linux, there
@@ -201,17 +292,28 @@ class CoreThreading:
 
     @staticmethod
     def queue_callback(callback, args, kwargs, in_progress):
-        # We need to synchronize the put and qsize calls or we might not
-        # realize we need to wakeup. (e.g. two threads can do put() one after
-        # the other, and then the call to qsize() would be 2.)  We don't care
-        # if the get() in run_queue() means we miss wakeup() because if
-        # run_queue() is running then clearly we're already woken up. :)
-        with CoreThreading._queue_put_lock:
-            CoreThreading._queue.put((callback, args, kwargs, in_progress))
-            if CoreThreading._queue.qsize() == 1:
-                # We just added the first callback to the queue, so notify the
-                # mainthread.
-                CoreThreading._wakeup()
+        queue = CoreThreading._queue
+        if len(queue) >= CoreThreading.mainthread_queue_max and not CoreThreading.is_mainthread():
+            # The main loop can't keep up, so block until it drained the
+            # queue.  The timeout guards against a missed notify.
+            with CoreThreading._queue_not_full:
+                CoreThreading._queue_full_waiters += 1
+                try:
+                    while len(queue) >= CoreThreading.mainthread_queue_max:
+                        CoreThreading._queue_not_full.wait(0.1)
+                finally:
+                    CoreThreading._queue_full_waiters -= 1
+
+        queued = notifier.monotonic() if notifier.get_stats() else 0
+        queue.append((callback, args, kwargs, in_progress, queued))
+        # Only the first callback queued since the main loop last began to
+        # process the queue needs to wake it up.  run_queue() clears the flag
+        # before it looks at the queue, so either it sees our callback or we
+        # see the cleared flag.  Two threads racing here may both wake up the
+        # main loop, which is harmless.
+        if not CoreThreading._wakeup_pending:
+            CoreThreading._wakeup_pending = True
+            CoreThreading._wakeup()
 
 
     @staticmethod
@@ -225,7 +327,7 @@ class CoreThreading:
             # intended, and need to execute any queued callbacks.  Log a
             # warning instead.
             log.warning('Problem reading from thread notifier pipe: [%d] %s', err, msg)
-
+        CoreThreading._wakeup_pending = False
 
         # It's possible that a thread is actively enqueuing callbacks faster
         # than we can dequeue and invoke them.  207fc3af77 tried to fix this by
@@ -234,9 +336,12 @@ class CoreThreading:
         # queued callback is being invoked and is blocked on a resource used
         # by that thread (like a different mutex).
         #
-        # So we don't lock the whole loop to avoid the deadlock, and we stop
-        # invoking callbacks after mainthread_callback_max_time seconds
-        # has elapsed in order to solve the problem 207fc3af77 tried to fix.
+        # So we don't lock the queue at all, and only process the callbacks
+        # that were queued when we got here, up to mainthread_callback_max_items
+        # of them, and stop invoking callbacks after mainthread_callback_max_time
+        # seconds has elapsed in order to solve the problem 207fc3af77 tried to
+        # fix.  Anything left is processed in the next iteration of the main
+        # loop, giving timers and IO a chance to run in between.
         #
         # Now, there is a large upper bound on the queue to prevent memory
         # exhaustion, which means a producer will block if it's adding
@@ -247,28 +352,44 @@ class CoreThreading:
         # hopefully we have pushed that to an extreme corner case -- although
         # probably at the expense of making that corner case harder to
         # find/debug. :(
+        queue = CoreThreading._queue
+        stats = notifier.get_stats()
+        if stats:
+            stats.add_queue_depth(len(queue))
         t0 = time.time()
-        while not CoreThreading._queue.empty():
-            if time.time() - t0 > CoreThreading.mainthread_callback_max_time:
-                # We've spent too much time blocking the main loop invoking the
-                # queued callbacks, but we still have more.  Poke the thread
-                # pipe so the next iteration of the main loop calls us back
-                # and abort the loop.
+        try:
+            for n in xrange(min(len(queue), CoreThreading.mainthread_callback_max_items)):
+                if n and time.time() - t0 > CoreThreading.mainthread_callback_max_time:
+                    break
+                callback, args, kwargs, in_progress, queued = queue.popleft()
+                if stats:
+                    t1 = notifier.monotonic()
+                    if queued:
+                        stats.add_queue_wait(t1 - queued)
+                try:
+                    in_progress.finish(callback(*args, **kwargs))
+                except BaseException, e:
+                    # All exceptions, including SystemExit and KeyboardInterrupt,
+                    # are caught and thrown to the InProgress, because it may be
+                    # waiting in another thread.  However SE and KI are reraised
+                    # in here the main thread so they can be propagated back up
+                    # the mainloop.
+                    in_progress.throw()
+                    if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                        raise
+                finally:
+                    if stats:
+                        stats.add_callback('thread', callback, notifier.monotonic() - t1)
+        finally:
+            if queue and not CoreThreading._wakeup_pending:
+                # We've used up our time or item budget (or a callback raised),
+                # but we still have more.  Poke the thread pipe so the next
+                # iteration of the main loop calls us back.
+                CoreThreading._wakeup_pending = True
                 CoreThreading._wakeup()
-                break
-
-            callback, args, kwargs, in_progress = CoreThreading._queue.get()
-            try:
-                in_progress.finish(callback(*args, **kwargs))
-            except BaseException, e:
-                # All exceptions, including SystemExit and KeyboardInterrupt,
-                # are caught and thrown to the InProgress, because it may be
-                # waiting in another thread.  However SE and KI are reraised
-                # in here the main thread so they can be propagated back up
-                # the mainloop.
-                in_progress.throw()
-                if isinstance(e, (KeyboardInterrupt, SystemExit)):
-                    raise
+            if CoreThreading._queue_full_waiters:
+                with CoreThreading._queue_not_full:
+                    CoreThreading._queue_not_full.notify_all()
         return True
 
     @staticmethod
@@ -278,7 +399,7 @@ class CoreThreading:
         writes a byte to the notifier pipe.
         """
         if CoreThreading._pipe:
-            os.write(CoreThreading._pipe[1], CoreThreading._PIPE_NOTIFY_TOKEN)
+            os.write(CoreThreading._pipe[1], CoreThreading._pipe_token)
 
 
     @staticmethod
@@ -293,8 +414,8 @@ class CoreThreading:
         """
         # Only need to write to the pipe if the queue is empty; if it's not
         # empty, then queue_callback() would have called _wakeup().
-        if CoreThreading._queue.empty():
-            os.write(CoreThreading._pipe[1], CoreThreading._PIPE_NOTIFY_TOKEN)
+        if not CoreThreading._queue:
+            os.write(CoreThreading._pipe[1], CoreThreading._pipe_token)
 
 
     @staticmethod
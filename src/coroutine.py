@@ -76,6 +76,11 @@ POLICY_SYNCHRONIZED = 'synchronized'
 POLICY_SINGLETON = 'singleton'
 POLICY_PASS_LAST = 'passlast'
 
+# Callables converting values yielded by coroutines which are not InProgress
+# objects (e.g. asyncio futures) into InProgress objects, or returning None if
+# the value is a plain result.  Appended to by kaa.nf_asyncio.
+_yield_adapters = []
+
 # Currently running (not stopped) CoroutineInProgress objects.  See
 # CoroutineInProgress.__init__ for rational.
 _active_coroutines = set()
@@ -393,8 +398,15 @@ class CoroutineInProgress(InProgress):
                     # Schedule next iteration with the timer
                     return True
                 elif not isinstance(result, InProgress):
-                    # Coroutine is done.
-                    break
+                    for adapter in _yield_adapters:
+                        adapted = adapter(result)
+                        if adapted is not None:
+                            # Coroutine yielded a foreign future.
+                            result = adapted
+                            break
+                    if not isinstance(result, InProgress):
+                        # Coroutine is done.
+                        break
 
                 # Result is an InProgress, so there's more work to do.
                 self._prerequisite_ip = result
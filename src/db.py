@@ -26,7 +26,7 @@ __all__ = [
     'Database', 'QExpr', 'DatabaseError', 'DatabaseReadOnlyError',
     'split_path', 'ATTR_SIMPLE', 'ATTR_SEARCHABLE', 'ATTR_IGNORE_CASE',
     'ATTR_INDEXED', 'ATTR_INDEXED_IGNORE_CASE', 'ATTR_INVERTED_INDEX',
-    'RAW_TYPE'
+    'RAW_TYPE', 'PRIORITY_QUERY', 'PRIORITY_CHANGE', 'QueryCache'
 ]
 
 # python imports
@@ -36,10 +36,13 @@ import time
 import re
 import logging
 import math
+import itertools
+import heapq
 import cPickle
 import copy_reg
 import _weakref
 import threading
+import collections
 try:
     # Try a system install of pysqlite
     from pysqlite2 import dbapi2 as sqlite
@@ -50,6 +53,9 @@ except ImportError:
 # kaa base imports
 from .strutils import py3_str, BYTES_TYPE, UNICODE_TYPE
 from .timer import WeakOneShotTimer
+from .thread import ThreadPool, ThreadPoolCallable, register_thread_pool, get_thread_pool
+from .async import InProgress
+from .utils import wraps
 from . import main
 
 if sqlite.version < '2.1.0':
@@ -120,6 +126,21 @@ ATTR_INDEXED_IGNORE_CASE = ATTR_INDEXED | ATTR_IGNORE_CASE
 # these names cannot be registered.
 RESERVED_ATTRIBUTES = ('id', 'parent', 'object', 'type', 'limit', 'attrs', 'distinct', 'orattrs')
 
+# Thread pool priorities of the *_async methods of Database.  Queries are
+# usually done for the user interface, so they go before changes, which
+# are usually made by background indexing.
+PRIORITY_QUERY = 10
+PRIORITY_CHANGE = 0
+
+# Tuning of inverted index searches: when the least common of several terms
+# matches at least IVTIDX_INTERSECT_COUNT objects, sqlite intersects the terms
+# first.  The objects left are looked up individually for a term matching
+# more than IVTIDX_PROBE_RATIO times as many objects.  Posting lists of terms
+# matching at least IVTIDX_CACHE_COUNT objects are cached.
+IVTIDX_INTERSECT_COUNT = 1000
+IVTIDX_PROBE_RATIO = 4
+IVTIDX_CACHE_COUNT = 500
+
 STOP_WORDS = (
     "about", "and", "are", "but", "com", "for", "from", "how", "not",
     "some", "that", "the", "this", "was", "what", "when", "where", "who",
@@ -558,15 +579,248 @@ class RegexpCache(object):
         return self.last_result
 
 
+def _freeze(value):
+    """
+    Returns a hashable version of a query() argument, so that identical
+    queries can be recognized.  Raises TypeError if that isn't possible.
+    """
+    if isinstance(value, (list, tuple)):
+        # Keep the type, query() treats lists and tuples differently.
+        return type(value), tuple(_freeze(v) for v in value)
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    elif isinstance(value, QExpr):
+        return QExpr, value._operator, _freeze(value._operand)
+    elif isinstance(value, ObjectRow):
+        return ObjectRow, value['type'], value['id']
+    hash(value)
+    return value
+
+
+def _query_key(attrs):
+    """
+    Returns a key identifying the query for the given query() keyword
+    arguments, or None if the arguments can't be used as key.
+    """
+    try:
+        return tuple(sorted((attr, _freeze(value)) for attr, value in attrs.items()))
+    except TypeError:
+        return None
+
+
+class QueryCache(object):
+    """
+    LRU cache of query results, see :meth:`~kaa.db.Database.enable_query_cache`.
+
+    :param size: the maximum number of cached results.
+    :param ttl: the number of seconds after which a result expires, or None
+                to keep results until they are invalidated or evicted.
+
+    Each result is cached with a set of tags, which are the object types and
+    inverted indexes the result depends on.  Invalidating a tag increases
+    its generation, which makes all results cached with an older generation
+    of the tag stale.
+    """
+    def __init__(self, size=1000, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # query key -> (result, tags, generations, expiry time)
+        self._entries = collections.OrderedDict()
+        # tag -> generation
+        self._generations = {}
+        self.reset()
+
+
+    def reset(self):
+        """
+        Resets the statistics.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+    def generations(self, tags):
+        """
+        Returns the current generations of the given tags, to be passed to
+        put() for a result computed afterwards.
+        """
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in tags)
+
+
+    def get(self, key):
+        """
+        Returns the cached result for the given query key, or None if there
+        is no valid result.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                result, tags, generations, expiry = entry
+                if (expiry is None or expiry > time.time()) and \
+                   generations == tuple(self._generations.get(tag, 0) for tag in tags):
+                    # Reinsert as most recently used.
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+
+    def put(self, key, tags, generations, result):
+        """
+        Caches a result, evicting the least recently used results if the
+        cache is full.
+        """
+        expiry = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = result, tags, generations, expiry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def invalidate(self, tags):
+        """
+        Makes all cached results with any of the given tags stale.
+        """
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            self.invalidations += 1
+
+
+    def clear(self):
+        """
+        Discards all cached results.
+        """
+        with self._lock:
+            self._entries.clear()
+            # Results of queries in progress are cached with the None tag.
+            self._generations[None] = self._generations.get(None, 0) + 1
+
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of lookups which found a valid result.
+        """
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+
+    def snapshot(self):
+        """
+        Returns a dict containing the current statistics.
+        """
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
+
+
+
+class _PostingsCache(object):
+    """
+    LRU cache of complete posting lists of inverted index terms, holding at
+    most size postings in total.
+
+    The cache is cleared whenever an inverted index changes, which also
+    increases its generation.  Posting lists fetched by queries which started
+    before that, and so may come from an older snapshot of the database,
+    are then not cached.
+    """
+    def __init__(self, size=200000):
+        self.size = size
+        self.generation = 0
+        self._lock = threading.Lock()
+        # (ivtidx, term id, object type id) -> {(object_type, object_id): frequency}
+        self._entries = collections.OrderedDict()
+        # Total number of postings in _entries
+        self._count = 0
+
+
+    def get(self, key):
+        with self._lock:
+            postings = self._entries.pop(key, None)
+            if postings is not None:
+                # Reinsert as most recently used.
+                self._entries[key] = postings
+            return postings
+
+
+    def put(self, key, postings, generation):
+        if len(postings) > self.size:
+            return
+        with self._lock:
+            if generation != self.generation or key in self._entries:
+                return
+            self._entries[key] = postings
+            self._count += len(postings)
+            while self._count > self.size:
+                self._count -= len(self._entries.popitem(last=False)[1])
+
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._count = 0
+
+
+
+def _locked(func):
+    """
+    Decorator for Database methods which change the database, holding the
+    database lock for the whole change.  This keeps changes made from
+    different threads (e.g. by the *_async methods) from interleaving.
+    """
+    @wraps(func)
+    def newfunc(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return newfunc
+
+
 class Database(object):
-    def __init__(self, dbfile):
+    def __init__(self, dbfile, wal=False, readers=4, autocheckpoint=1000):
         """
         Open a database, creating one if it doesn't already exist.
 
         :param dbfile: path to the database file
         :type dbfile: str
+        :param wal: if True, the database is put into write-ahead log mode,
+                    which lets :meth:`~kaa.db.Database.query` run
+                    concurrently with writes and other queries.
+        :type wal: bool
+        :param readers: the maximum number of read-only connections used
+                        for queries in WAL mode.
+        :type readers: int
+        :param autocheckpoint: in WAL mode, the log size in pages after which
+                               a commit automatically checkpoints the log
+                               into the database; 0 disables automatic
+                               checkpoints, in which case the application
+                               should call :meth:`~kaa.db.Database.checkpoint`,
+                               e.g. when idle.
+        :type autocheckpoint: int
 
         SQLite is used to provide the underlying database.
+
+        All changes go through a single writer connection.  In WAL mode,
+        queries are done on a pool of read-only connections (opened as
+        needed) without holding the writer lock, so queries from threads
+        don't wait for each other or for writes in progress.  Readers only
+        see committed changes, so queries are done on the writer connection
+        while there are uncommitted changes; with
+        :attr:`~kaa.db.Database.lazy_commit` this is until the next commit.
         """
         super(Database, self).__init__()
         # _object_types dict is keyed on type name, where value is a 3-
@@ -601,6 +855,24 @@ class Database(object):
         self._lock = threading.RLock()
         self._lazy_commit_timer = WeakOneShotTimer(self.commit)
         self._lazy_commit_interval = None
+        self._wal = wal
+        self._autocheckpoint = autocheckpoint
+        # Idle reader connections as (cursor, qcursor) tuples, the number of
+        # readers opened, and the maximum (0 when not in WAL mode).
+        self._readers = []
+        self._readers_open = 0
+        self._readers_max = readers if wal else 0
+        self._readers_cond = threading.Condition(threading.Lock())
+        # Holds the reader used by query() in the current thread.
+        self._local = threading.local()
+        # Thread pool for the *_async methods, created when first needed.
+        self._pool = None
+        # Pending query_async() calls: query key -> [ThreadInProgress, callers]
+        self._async_queries = {}
+        # QueryCache, see enable_query_cache()
+        self._query_cache = None
+        # Posting lists of common inverted index terms
+        self._postings = _PostingsCache()
         self._open_db()
 
 
@@ -624,6 +896,15 @@ class Database(object):
             cursor.execute("PRAGMA cache_size=50000")
             cursor.execute("PRAGMA page_size=8192")
 
+        if self._wal:
+            self._cursor.execute("PRAGMA journal_mode=WAL")
+            if self._cursor.fetchone()[0].lower() != 'wal':
+                log.warning("Database '%s' can't use WAL mode, queries won't run concurrently", self._dbfile)
+                self._wal = False
+                self._readers_max = 0
+            else:
+                self._cursor.execute("PRAGMA wal_autocheckpoint=%d" % self._autocheckpoint)
+
         if not self._check_table_exists("meta"):
             self._db.executescript(CREATE_SCHEMA % SCHEMA_VERSION)
 
@@ -636,6 +917,82 @@ class Database(object):
         self._load_object_types()
 
 
+    def _open_reader(self):
+        """
+        Opens a read-only connection for queries in WAL mode and returns a
+        (cursor, qcursor) tuple like _cursor and _qcursor of the writer.
+        """
+        # Transactions are started explicitly by _acquire_reader().
+        db = sqlite.connect(self._dbfile, check_same_thread=False, isolation_level=None)
+        db.create_function("regexp", 2, RegexpCache())
+        cursor = db.cursor()
+
+        class Cursor(sqlite.Cursor):
+            _db = _weakref.ref(self)
+        db.row_factory = ObjectRow
+        qcursor = db.cursor(Cursor)
+
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=10000")
+        return cursor, qcursor
+
+
+    def _acquire_reader(self):
+        """
+        Takes a reader for queries done by _db_query() in the current thread
+        and begins a read transaction, so that all statements of a query see
+        the same snapshot of the database.
+
+        Returns None if queries need to be done on the writer connection,
+        either because the database isn't in WAL mode, there are uncommitted
+        changes, or the current thread already has a reader.
+        """
+        if not self._readers_max or self._dirty or getattr(self._local, 'reader', None):
+            return None
+        with self._readers_cond:
+            while not self._readers and self._readers_open >= self._readers_max:
+                self._readers_cond.wait()
+            if self._readers:
+                reader = self._readers.pop()
+            else:
+                reader = None
+                self._readers_open += 1
+        if not reader:
+            try:
+                reader = self._open_reader()
+            except:
+                with self._readers_cond:
+                    self._readers_open -= 1
+                    self._readers_cond.notify()
+                raise
+        reader[0].execute('BEGIN')
+        self._local.reader = reader
+        return reader
+
+
+    def _release_reader(self, reader):
+        self._local.reader = None
+        try:
+            reader[0].execute('COMMIT')
+        finally:
+            with self._readers_cond:
+                self._readers.append(reader)
+                self._readers_cond.notify()
+
+
+    def _clear_postings(self):
+        """
+        Clears the postings cache after an inverted index changed.  The
+        database is marked dirty first, so that queries starting from now
+        on are done on the writer connection, which sees the change, rather
+        than by a reader whose older postings would be cached under the new
+        generation.
+        """
+        self._set_dirty()
+        self._postings.clear()
+
+
     def _set_dirty(self):
         if self._lazy_commit_interval is not None:
             self._lazy_commit_timer.start(self._lazy_commit_interval)
@@ -646,6 +1003,14 @@ class Database(object):
 
 
     def _db_query(self, statement, args = (), cursor = None, many = False):
+        reader = getattr(self._local, 'reader', None)
+        if reader:
+            # A query() in WAL mode: this thread has its own connection, so
+            # the writer lock isn't needed.
+            cursor = reader[1] if cursor is self._qcursor else reader[0]
+            cursor.execute(statement, args)
+            return cursor.fetchall()
+
         t0=time.time()
         with self._lock:
             if not cursor:
@@ -716,6 +1081,7 @@ class Database(object):
                            (table_name, "_".join(cols), table_name, ",".join(cols)))
 
 
+    @_locked
     def register_object_type_attrs(self, type_name, indexes = [], **attrs):
         """
         Register one or more object attributes and/or multi-column indexes for
@@ -938,6 +1304,7 @@ class Database(object):
 
                 self.commit()
                 self._load_object_types()
+                self._invalidate_query_cache()
                 return
 
             # We need to update the database now ...
@@ -1030,8 +1397,10 @@ class Database(object):
         # Create multi-column indexes; indexes value has already been verified.
         self._register_create_multi_indexes(indexes, table_name)
         self.commit()
+        self._invalidate_query_cache()
 
 
+    @_locked
     def register_inverted_index(self, name, min = None, max = None, split = None, ignore = None):
         """
         Registers a new inverted index with the database.
@@ -1113,6 +1482,7 @@ class Database(object):
         defn['objectcount'] = 0
         self._inverted_indexes[name] = defn
         self.commit()
+        self._invalidate_query_cache()
 
 
     def _load_inverted_indexes(self):
@@ -1247,6 +1617,7 @@ class Database(object):
         return q, values
 
 
+    @_locked
     def delete(self, obj):
         """
         Delete the specified object.
@@ -1259,6 +1630,7 @@ class Database(object):
         return self._delete_multiple_objects({object_type: (object_id,)})
 
 
+    @_locked
     def reparent(self, obj, parent):
         """
         Change the parent of an object.
@@ -1276,6 +1648,7 @@ class Database(object):
         return self.update(obj, parent=parent)
 
 
+    @_locked
     def retype(self, obj, new_type):
         """
         Convert the object to a new type.
@@ -1320,6 +1693,7 @@ class Database(object):
         return new_obj
 
 
+    @_locked
     def delete_by_query(self, **attrs):
         """
         Delete all objects returned by the given query.
@@ -1374,9 +1748,11 @@ class Database(object):
 
         if count:
             self._set_dirty()
+            self._invalidate_query_cache(*objects)
         return count
 
 
+    @_locked
     def add(self, object_type, parent=None, **attrs):
         """
         Add an object to the database.
@@ -1424,27 +1800,9 @@ class Database(object):
         for ivtidx in inverted_indexes:
             # Sync cached objectcount with the DB (that we just updated above)
             self._inverted_indexes[ivtidx]['objectcount'] += 1
-            terms_list = []
-            split = self._inverted_indexes[ivtidx]['split']
-            for name, (attr_type, flags, attr_ivtidx, attr_split) in type_attrs.items():
-                if attr_ivtidx == ivtidx and name in attrs:
-                    terms_list.append((attrs[name], 1.0, attr_split or split, ivtidx))
-
-            if ivtidx in attrs and ivtidx not in type_attrs:
-                # Attribute named after an inverted index is given in kwagrs,
-                # but that ivtidx is not a registered attribute (which would be
-                # handled in the for loop just above).
-                terms_list.append((attrs[ivtidx], 1.0, split, ivtidx))
-
-            terms = self._score_terms(terms_list)
+            terms = self._score_object_terms(type_attrs, ivtidx, attrs)
             if terms:
                 ivtidx_terms.append((ivtidx, terms))
-                # If there are no terms for this ivtidx, we don't bother storing
-                # an empty list in the pickle.
-                if ivtidx in type_attrs:
-                    # Registered attribute named after ivtidx; store ivtidx
-                    # terms in object.
-                    attrs[ivtidx] = terms.keys()
 
         query, values = self._make_query_from_attrs("add", attrs, object_type)
         self._db_query(query, values)
@@ -1461,9 +1819,97 @@ class Database(object):
         attrs.update(dict.fromkeys([k for k in type_attrs if k not in attrs.keys() + ['pickle']]))
 
         self._set_dirty()
+        self._invalidate_query_cache(object_type)
         return ObjectRow(None, None, attrs)
 
 
+    def add_many(self, object_type, objects, chunk_size=1000):
+        """
+        Add many objects of the same type to the database.
+
+        :param object_type: the name of the object type previously created by
+                            :meth:`~kaa.db.Database.register_object_type_attrs`.
+        :type object_type: str
+        :param objects: the attributes of the objects to add, as passed to
+                        :meth:`~kaa.db.Database.add`, including the optional
+                        ``parent`` attribute
+        :type objects: iterable of dicts
+        :param chunk_size: the number of objects added at once
+        :returns: the number of objects added
+
+        This is considerably faster than calling :meth:`~kaa.db.Database.add`
+        for each object, as objects and inverted index terms are inserted
+        with one statement per chunk of objects.  The iterable is consumed
+        chunk by chunk, so it may be a generator producing a large number
+        of objects.  Unlike :meth:`~kaa.db.Database.add`, the added objects
+        are not returned; they can be queried once add_many() returns.
+
+        For example, continuing the example from :meth:`~kaa.db.Database.add`::
+
+            db.add_many('directory', ({'parent': root, 'name': name} for name in os.listdir('/')))
+        """
+        if self._readonly:
+            raise DatabaseReadOnlyError('upgrade_to_py3() must be called before database can be modified')
+
+        objects = iter(objects)
+        count = 0
+        with self._lock:
+            while True:
+                chunk = list(itertools.islice(objects, chunk_size))
+                if not chunk:
+                    break
+                self._add_chunk(object_type, chunk)
+                count += len(chunk)
+        if count:
+            self._set_dirty()
+            self._invalidate_query_cache(object_type)
+        return count
+
+
+    def _add_chunk(self, object_type, chunk):
+        """
+        Adds a list of objects (dicts of attributes) of the given type.
+        """
+        type_attrs = self._get_type_attrs(object_type)
+        inverted_indexes = self._get_type_inverted_indexes(object_type)
+        table_name = 'objects_' + object_type
+
+        # Objects are inserted with executemany(), so cursor.lastrowid can't
+        # be used and ids are assigned here instead, the same way sqlite
+        # would for an AUTOINCREMENT column.
+        row = self._db_query_row('SELECT seq FROM sqlite_sequence WHERE name=?', (table_name,))
+        last_id = max(row[0] if row else 0, self._db_query_row('SELECT MAX(id) FROM %s' % table_name)[0] or 0)
+
+        # Rows by INSERT statement, which depends on the attributes given,
+        # and a list of (object_id, terms) by inverted index.
+        inserts = {}
+        ivtidx_terms = dict((ivtidx, []) for ivtidx in inverted_indexes)
+        for attrs in chunk:
+            attrs = dict(attrs)
+            parent = attrs.pop('parent', None)
+            if parent:
+                attrs['parent_type'], attrs['parent_id'] = self._to_obj_tuple(parent, numeric=True)
+            last_id += 1
+            attrs['id'] = last_id
+            for ivtidx in inverted_indexes:
+                terms = self._score_object_terms(type_attrs, ivtidx, attrs)
+                if terms:
+                    ivtidx_terms[ivtidx].append((last_id, terms))
+            query, values = self._make_query_from_attrs("add", attrs, object_type)
+            inserts.setdefault(query, []).append(values)
+
+        if inverted_indexes:
+            self._db_query("UPDATE inverted_indexes SET value=value+? WHERE attr='objectcount' AND name IN %s" % \
+                           _list_to_printable(inverted_indexes), (len(chunk),))
+            for ivtidx in inverted_indexes:
+                self._inverted_indexes[ivtidx]['objectcount'] += len(chunk)
+
+        for query, rows in inserts.items():
+            self._db_query(query, rows, many=True)
+        for ivtidx, objects in ivtidx_terms.items():
+            self._add_objects_inverted_index_terms(object_type, ivtidx, objects)
+
+
     def get(self, obj):
         """
         Fetch the given object from the database.
@@ -1486,6 +1932,7 @@ class Database(object):
             return rows[0]
 
 
+    @_locked
     def update(self, obj, parent=None, **attrs):
         """
         Update attributes for an existing object in the database.
@@ -1641,6 +2088,7 @@ class Database(object):
         query, values = self._make_query_from_attrs("update", orig_attrs, object_type)
         self._db_query(query, values)
         self._set_dirty()
+        self._invalidate_query_cache(object_type)
         # TODO: if an objectrow was given, return an updated objectrow
 
 
@@ -1652,9 +2100,41 @@ class Database(object):
                   program exit.
         """
         main.signals['exit'].disconnect(self.commit)
-        self._dirty = False
         with self._lock:
             self._db.commit()
+            # Cleared only now, so that queries don't go to the readers
+            # before they can see the changes.
+            self._dirty = False
+
+
+    def checkpoint(self, mode='passive'):
+        """
+        Copy changes from the write-ahead log into the database file.
+
+        :param mode: ``passive`` checkpoints as much as possible without
+                     waiting for queries in progress; ``full`` and ``restart``
+                     wait for queries to finish so that the whole log is
+                     checkpointed, and ``restart`` also lets the next commit
+                     start over at the beginning of the log; ``truncate`` is
+                     like ``restart`` but also truncates the log file.
+        :type mode: str
+        :returns: 2-tuple (log size, checkpointed), both in pages, or None
+                  if the database isn't in WAL mode.
+
+        Any uncommitted changes are committed first.  This is only needed
+        when automatic checkpoints have been disabled or to limit the size
+        of the log file, see the *autocheckpoint* parameter of
+        :class:`~kaa.db.Database`.
+        """
+        if mode.upper() not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError('Invalid checkpoint mode: %s' % mode)
+        if not self._wal:
+            return None
+        with self._lock:
+            if self._dirty:
+                self.commit()
+            busy, pages, checkpointed = self._db_query_row('PRAGMA wal_checkpoint(%s)' % mode.upper())
+        return pages, checkpointed
 
 
     def query(self, **attrs):
@@ -1741,6 +2221,30 @@ class Database(object):
             [<kaa.db.ObjectRow object at 0x7f652b255030>]
 
         """
+        cache = self._query_cache
+        key = _query_key(attrs) if cache else None
+        if key is not None:
+            result = cache.get(key)
+            if result is not None:
+                return list(result)
+            tags = self._query_cache_tags(attrs)
+            generations = cache.generations(tags)
+
+        generation = self._postings.generation
+        reader = self._acquire_reader()
+        try:
+            result = self._query(attrs, generation)
+        finally:
+            if reader:
+                self._release_reader(reader)
+
+        if key is not None:
+            cache.put(key, tags, generations, result)
+            return list(result)
+        return result
+
+
+    def _query(self, attrs, generation=None):
         query_info = {}
         parents = []
         query_type = "ALL"
@@ -1768,7 +2272,7 @@ class Database(object):
                 else:
                     limit = attrs.get('limit')
 
-                r = self._query_inverted_index(ivtidx, attrs[ivtidx], limit, attrs.get('type'))
+                r = self._query_inverted_index(ivtidx, attrs[ivtidx], limit, attrs.get('type'), generation)
                 if ivtidx_results is None:
                     ivtidx_results = r
                 else:
@@ -2061,6 +2565,35 @@ class Database(object):
         return dict(terms_scores.values())
 
 
+    def _score_object_terms(self, type_attrs, ivtidx, attrs):
+        """
+        Scores the terms for the given inverted index of an object being
+        added, whose attributes are given in attrs.  If the object type has
+        a registered attribute named after the inverted index, the terms
+        are stored in attrs.
+        """
+        terms_list = []
+        split = self._inverted_indexes[ivtidx]['split']
+        for name, (attr_type, flags, attr_ivtidx, attr_split) in type_attrs.items():
+            if attr_ivtidx == ivtidx and name in attrs:
+                terms_list.append((attrs[name], 1.0, attr_split or split, ivtidx))
+
+        if ivtidx in attrs and ivtidx not in type_attrs:
+            # Attribute named after an inverted index is given in kwagrs,
+            # but that ivtidx is not a registered attribute (which would be
+            # handled in the for loop just above).
+            terms_list.append((attrs[ivtidx], 1.0, split, ivtidx))
+
+        terms = self._score_terms(terms_list)
+        # If there are no terms for this ivtidx, we don't bother storing
+        # an empty list in the pickle.
+        if terms and ivtidx in type_attrs:
+            # Registered attribute named after ivtidx; store ivtidx
+            # terms in object.
+            attrs[ivtidx] = terms.keys()
+        return terms
+
+
     def _delete_object_inverted_index_terms(self, (object_type, object_id), ivtidx):
         """
         Removes all indexed terms under the specified inverted index for the
@@ -2087,6 +2620,7 @@ class Database(object):
                 self._db_query("DELETE FROM ivtidx_%s_terms_map WHERE object_type=? AND object_id IN %s" % \
                                (ivtidx, _list_to_printable(object_ids)), (type_id,))
                 self._inverted_indexes[ivtidx]['objectcount'] -= len(object_ids)
+                self._clear_postings()
 
 
     def _add_object_inverted_index_terms(self, (object_type, object_id), ivtidx, terms):
@@ -2128,37 +2662,96 @@ class Database(object):
 
         self._db_query('UPDATE ivtidx_%s_terms SET count=? WHERE id=?' % ivtidx, update_list, many = True)
         self._db_query('INSERT INTO ivtidx_%s_terms_map VALUES(?, ?, ?, ?, ?)' % ivtidx, map_list, many = True)
+        self._clear_postings()
+
+
+    def _add_objects_inverted_index_terms(self, object_type, ivtidx, objects):
+        """
+        Adds the terms of many objects to the specified inverted index,
+        where objects is a list of (object_id, terms), and terms is a
+        dictionary as computed by _score_terms().
+        """
+        if not objects:
+            return
+
+        object_type = self._get_type_id(object_type)
+
+        # Number of objects each term is added to.
+        counts = {}
+        for object_id, terms in objects:
+            for term in terms:
+                term = term.lower()
+                counts[term] = counts.get(term, 0) + 1
+
+        # Look up the terms which already exist in the database with their
+        # id and count, and insert the others.  The terms are passed as SQL
+        # literals, so look them up in slices to keep statements short.
+        db_terms = {}
+        terms = counts.keys()
+        select = "SELECT id,term,count FROM ivtidx_%s_terms WHERE term IN %s"
+        for i in range(0, len(terms), 500):
+            for row in self._db_query(select % (ivtidx, _list_to_printable(terms[i:i+500]))):
+                db_terms[row[1]] = row[0], row[2]
+
+        update_list = [(count + counts[term], db_id) for term, (db_id, count) in db_terms.items()]
+        new_terms = [term for term in terms if term not in db_terms]
+        if new_terms:
+            self._db_query('INSERT INTO ivtidx_%s_terms VALUES(NULL, ?, ?)' % ivtidx,
+                           [(term, counts[term]) for term in new_terms], many = True)
+            for i in range(0, len(new_terms), 500):
+                for row in self._db_query(select % (ivtidx, _list_to_printable(new_terms[i:i+500]))):
+                    db_terms[row[1]] = row[0], row[2]
+
+        map_list = []
+        for object_id, terms in objects:
+            for term, score in terms.items():
+                map_list.append((int(score*10), db_terms[term.lower()][0], object_type, object_id, score))
+
+        self._db_query('UPDATE ivtidx_%s_terms SET count=? WHERE id=?' % ivtidx, update_list, many = True)
+        self._db_query('INSERT INTO ivtidx_%s_terms_map VALUES(?, ?, ?, ?, ?)' % ivtidx, map_list, many = True)
+        self._clear_postings()
 
 
-    def _query_inverted_index(self, ivtidx, terms, limit = 100, object_type = None):
+    def _query_inverted_index(self, ivtidx, terms, limit = 100, object_type = None, generation = None):
         """
         Queries the inverted index ivtidx for the terms supplied in the terms
         argument.  If terms is a string, it is parsed into individual terms
         based on the split for the given ivtidx.  The terms argument may
         also be a list or tuple, in which case no parsing is done.
 
-        The search algorithm tries to optimize for the common case.  When
-        terms are scored (_score_terms()), each term is assigned a score that
-        is stored in the database (as a float) and also as an integer in the
-        range 0-10, called rank.  (So a term with score 0.35 has a rank 3.)
-
-        Multiple passes are made over the terms map table for the given ivtidx,
-        first starting at the highest rank fetching a certain number of rows,
-        and progressively drilling down to lower ranks, trying to find enough
-        results to fill our limit that intersects on all supplied terms.  If
-        our limit isn't met and all ranks have been searched but there are
-        still more possible matches (because we use LIMIT on the SQL
-        statement), we expand the LIMIT (currently by an order of 10) and try
-        again, specifying an OFFSET in the query.
-
-        The worst case scenario is given two search terms, each term matches
-        50% of all rows but there is only one intersecting row.  (Or, more
-        generally, given N terms, each term matches (1/N)*100 percent rows with
-        only 1 row intersection between all N terms.)   This could be improved
-        by avoiding the OFFSET/LIMIT technique as described above, but that
-        approach provides a big performance win in more common cases.  This
-        case can be mitigated by caching common term combinations, but it is
-        an extremely difficult problem to solve.
+        When terms are scored (_score_terms()), each term is assigned a score
+        (its frequency in the object) that is stored in the database as a
+        float and also as an integer in the range 0-10, called rank.  (So a
+        term with score 0.35 has a rank 3.)  The score of an object matching
+        all terms is the sum of the term frequencies, each weighted by the
+        rarity of the term and its position in the query.
+
+        The search starts with the least common term, using the per-term
+        count in the terms table, and intersects its objects with those of
+        the other terms in order of increasing count, stopping as soon as the
+        intersection is empty.  For each term, either its complete posting
+        list (its rows in the terms map) is fetched, or, if the intersection
+        so far is much smaller than the term's count, only the rows of the
+        objects in the intersection are looked up.  If even the least common
+        term is common, sqlite computes the intersection of all terms first
+        (with INTERSECT), so the worst case -- say two terms each matching
+        half of all objects with only one object matching both -- doesn't
+        pass the posting lists through Python or repeat queries with growing
+        OFFSET and LIMIT.
+
+        If limit is less than the count of the least common term, its objects
+        are instead visited from the highest rank down (in growing chunks,
+        each intersected with the other terms as above), until the objects of
+        the remaining ranks can't score higher than the limit best found so
+        far, or, as the search did before, more than twice the limit were
+        found.  With a single term, only the most frequent objects of a rank
+        are fetched.  In any case, only the limit best scoring objects are
+        returned.
+
+        Complete posting lists of common terms are kept in an LRU cache,
+        which is cleared whenever an inverted index changes.  generation is
+        the generation of the cache when the query started, see
+        _PostingsCache.
 
         object_type specifies an type name to search (for example we can
         search type "image" with keywords "2005 vacation"), or if object_type
@@ -2209,8 +2802,7 @@ class Database(object):
             terms[row[0]] = {
                 'term': row[1],
                 'count': row[2],
-                'idf_t': math.log(objectcount / row[2] + 1) + order_weight,
-                'ids': {}
+                'idf_t': math.log(objectcount / row[2] + 1) + order_weight
             }
             ids.append(row[0])
 
@@ -2223,149 +2815,139 @@ class Database(object):
             # Resolve object type name to id
             object_type = self._get_type_id(object_type)
 
-        results, state = {}, {}
-        for id in ids:
-            results[id] = {}
-            state[id] = {
-                'offset': [0]*11,
-                'more': [True]*11,
-                'count': 0,
-                'done': False
-            }
-
-        all_results = {}
         if limit == None:
             limit = objectcount
 
         if limit <= 0 or objectcount <= 0:
             return {}
 
-        sql_limit = min(limit*3, 200)
-        finished = False
-        nqueries = 0
-
-        # Keep a dict keyed on object_id that we can use to narrow queries
-        # once we have a full list of all objects that match a given term.
-        id_constraints = None
+        if generation is None:
+            generation = self._postings.generation
         t1 = time.time()
-        while not finished:
-            for rank in range(10, -1, -1):
-                for id in ids:
-                    if not state[id]['more'][rank] or state[id]['done']:
-                        # If there's no more results at this rank, or we know
-                        # we've already seen all the results for this term, we
-                        # don't bother with the query.
-                        continue
-
-                    q = 'SELECT object_type,object_id,frequency FROM ivtidx_%s_terms_map ' % ivtidx + \
-                        'WHERE term_id=? AND rank=? %s %%s LIMIT ? OFFSET ?'
-
-                    if object_type == None:
-                        q %= ''
-                        v = [id, rank, sql_limit, state[id]["offset"][rank]]
+        nqueries = [0]
+        map_table = 'ivtidx_%s_terms_map' % ivtidx
+        type_clause = '' if object_type is None else ' AND object_type=%d' % object_type
+        # Complete posting lists fetched by this query
+        fetched = {}
+
+        def get_postings(id, candidates=None):
+            # Returns (object_type, object_id) -> frequency for the term,
+            # possibly limited to the objects in candidates.
+            postings = fetched.get(id) or self._postings.get((ivtidx, id, object_type))
+            if postings is not None:
+                return postings
+            if candidates is not None and len(candidates) * IVTIDX_PROBE_RATIO < terms[id]['count']:
+                # Only few objects are left, look them up rather than
+                # fetching all objects for this term.
+                postings = {}
+                object_ids = list(set(object_id for (tp, object_id) in candidates))
+                for i in range(0, len(object_ids), 500):
+                    rows = self._db_query('SELECT object_type,object_id,frequency FROM %s '
+                                          'WHERE term_id=? AND object_id IN %s%s' % \
+                                          (map_table, _list_to_printable(object_ids[i:i+500]),
+                                           type_clause), (id,))
+                    nqueries[0] += 1
+                    for row in rows:
+                        postings[row[0], row[1]] = row[2]
+                return postings
+            rows = self._db_query('SELECT object_type,object_id,frequency FROM %s '
+                                  'WHERE term_id=?%s' % (map_table, type_clause), (id,))
+            nqueries[0] += 1
+            postings = fetched[id] = dict(((row[0], row[1]), row[2]) for row in rows)
+            if len(postings) >= IVTIDX_CACHE_COUNT:
+                self._postings.put((ivtidx, id, object_type), postings, generation)
+            return postings
+
+        def intersect(results, ids, candidates=None):
+            # Adds the scores of the given terms to results, removing objects
+            # which don't contain all terms.
+            for id in ids:
+                postings = get_postings(id, candidates or results)
+                idf_t = terms[id]['idf_t']
+                for o in results.keys():
+                    if o in postings:
+                        results[o] += postings[o] * idf_t
                     else:
-                        q %= 'AND object_type=?'
-                        v = [id, rank, object_type, sql_limit, state[id]["offset"][rank]]
-
-                    if id_constraints:
-                        # We know about all objects that match one or more of the other
-                        # search terms, so we add the constraint that all rows for this
-                        # term match the others as well.  Effectively we push the logic
-                        # to generate the intersection into the db.
-                        # XXX: This can't benefit from the index if object_type
-                        # is not specified.
-                        q %= ' AND object_id IN %s' % _list_to_printable(tuple(id_constraints))
-                        # But since we're specifying a list of ids to search for with this
-                        # term, we can't use limit/offset, since the constraints might be
-                        # different since the last iteration.
-                        v[-2:] = [-1, 0]
+                        del results[o]
+                if not results:
+                    break
+            return results
+
+        first, others = ids[0], ids[1:]
+        idf_first = terms[first]['idf_t']
+        if limit < terms[first]['count']:
+            # Only the best objects are wanted.  Go through the objects of the
+            # least common term from the highest rank down, adding the scores
+            # of the other terms, until the objects of the remaining ranks
+            # can't score higher than those we already have: the frequency of
+            # the first term is below the current rank, and for the others it
+            # is below their highest rank.
+            bound = 0.0
+            for id in others:
+                row = self._db_query_row('SELECT rank FROM %s WHERE term_id=?%s ORDER BY rank DESC LIMIT 1' % \
+                                         (map_table, type_clause), (id,))
+                nqueries[0] += 1
+                if row is None:
+                    return {}
+                bound += min(row[0] + 1, 10) / 10.0 * terms[id]['idf_t']
+
+            results = {}
+            for rank in range(10, -1, -1):
+                offset, chunk = 0, min(limit * 3, 200)
+                while True:
+                    if others:
+                        q = 'SELECT object_type,object_id,frequency FROM %s WHERE term_id=? AND rank=?%s ' \
+                            'LIMIT ? OFFSET ?' % (map_table, type_clause)
+                        rows = self._db_query(q, (first, rank, chunk, offset))
                     else:
-                        q %= ''
-
-                    rows = self._db_query(q, v)
-                    nqueries += 1
-                    state[id]['more'][rank] = len(rows) == sql_limit
-                    state[id]['count'] += len(rows)
-
-                    for row in rows:
-                        results[id][row[0], row[1]] = row[2] * terms[id]['idf_t']
-                        terms[id]['ids'][row[1]] = 1
-
-                    if state[id]['count'] >= terms[id]['count'] or \
-                       (id_constraints and len(rows) == len(id_constraints)):
-                        # If we've now retrieved all objects for this term, or if
-                        # all the results we just got now intersect with our
-                        # constraints set, we're done this term and don't bother
-                        # querying it at other ranks.
-                        #print "Done term '%s' at rank %d" % (terms[id]['term'], rank)
-                        state[id]['done'] = True
-                        if id_constraints is not None:
-                            id_constraints = id_constraints.intersection(terms[id]['ids'])
-                        else:
-                            id_constraints = set(terms[id]['ids'])
-                #
-                # end loop over terms
-
-
-                for r in reduce(lambda a, b: set(a).intersection(b), results.values()):
-                    all_results[r] = 0
-                    for id in ids:
-                        if r in results[id]:
-                            all_results[r] += results[id][r]
-
-                # If we have enough results already, no sense in querying the
-                # next rank.
-                if limit > 0 and len(all_results) > limit*2:
-                    finished = True
-                    #print "Breaking at rank:", rank
+                        # With a single term, the most frequent objects of
+                        # this rank are all we need.  (Rank 10 means a
+                        # frequency of 1.0.)
+                        q = 'SELECT object_type,object_id,frequency FROM %s WHERE term_id=? AND rank=?%s %s' \
+                            'LIMIT ?' % (map_table, type_clause, 'ORDER BY frequency DESC ' if rank < 10 else '')
+                        rows = self._db_query(q, (first, rank, limit - len(results)))
+                    nqueries[0] += 1
+                    found = dict(((row[0], row[1]), row[2] * idf_first) for row in rows)
+                    results.update(intersect(found, others))
+                    if not others or len(rows) < chunk or len(results) > limit * 2:
+                        break
+                    offset += chunk
+                    chunk *= 2
+
+                if len(results) > limit * 2:
+                    # As before, stop once we have plenty of matches from
+                    # the highest ranks.
                     break
-            #
-            # end loop over ranks
-
-            if finished:
-                break
+                if len(results) >= limit and \
+                   heapq.nlargest(limit, results.values())[-1] >= rank / 10.0 * idf_first + bound:
+                    break
+        else:
+            candidates = None
+            if others and terms[first]['count'] >= IVTIDX_INTERSECT_COUNT:
+                # Let sqlite do the intersection, which is much faster than
+                # fetching the posting lists when all terms are common.
+                q = ' INTERSECT '.join(['SELECT object_type,object_id FROM %s WHERE term_id=%d%s' % \
+                                        (map_table, id, type_clause) for id in ids])
+                candidates = set(self._db_query(q))
+                nqueries[0] += 1
+                if not candidates:
+                    return {}
+
+            postings = get_postings(first, candidates)
+            results = {}
+            for o, frequency in postings.iteritems():
+                if candidates is None or o in candidates:
+                    results[o] = frequency * idf_first
+            results = intersect(results, others, candidates)
+
+        if len(results) > limit:
+            # Keep the best scoring objects; ties are broken by object id to
+            # give consistent results.
+            results = dict(heapq.nlargest(limit, results.items(), key=lambda (o, score): (score, o)))
 
-            finished = True
-            for index in range(len(ids)):
-                id = ids[index]
-
-                if index > 0:
-                    last_id = ids[index-1]
-                    a = results[last_id]
-                    b = results[id]
-                    intersect = set(a).intersection(b)
-
-                    if len(intersect) == 0:
-                        # Is there any more at any rank?
-                        a_more = b_more = False
-                        for rank in range(11):
-                            a_more = a_more or state[last_id]['more'][rank]
-                            b_more = b_more or state[id]['more'][rank]
-
-                        if not a_more and not b_more:
-                            # There's no intersection between these two search
-                            # terms and neither have more at any rank, so we
-                            # can stop the whole query.
-                            finished = True
-                            break
-
-                # There's still hope of a match.  Go through this term and
-                # see if more exists at any rank, increasing offset and
-                # unsetting finished flag so we iterate again.
-                for rank in range(10, -1, -1):
-                    if state[id]['more'][rank] and not state[id]['done']:
-                        state[id]['offset'][rank] += sql_limit
-                        finished = False
-
-            # If we haven't found enough results after this pass, grow our
-            # limit so that we expand our search scope.  (XXX: this value may
-            # need empirical tweaking.)
-            sql_limit *= 10
-
-        # end loop while not finished
         log.info('%d results, did %d subqueries, %.04f seconds (%.04f overhead)',
-                 len(all_results), nqueries, time.time()-t0, t1-t0)
-        return all_results
+                 len(results), nqueries[0], time.time()-t0, t1-t0)
+        return results
 
 
     def get_inverted_index_terms(self, ivtidx, associated = None, prefix = None):
@@ -2478,6 +3060,7 @@ class Database(object):
         return info
 
 
+    @_locked
     def set_metadata(self, key, value):
         """
         Associate simple key/value pairs with the database.
@@ -2513,6 +3096,7 @@ class Database(object):
         return default
 
 
+    @_locked
     def vacuum(self):
         """
         Cleans up the database, removing unused inverted index terms.
@@ -2533,6 +3117,225 @@ class Database(object):
         self._db_query("VACUUM")
 
 
+    def enable_query_cache(self, size=1000, ttl=None):
+        """
+        Cache the results of :meth:`~kaa.db.Database.query`.
+
+        :param size: the maximum number of cached results; the least recently
+                     used results are evicted first.
+        :type size: int
+        :param ttl: the number of seconds after which a cached result expires,
+                    or None to keep results until they are invalidated.
+        :type ttl: float
+        :returns: the :class:`~kaa.db.QueryCache`, which also holds hit rate
+                  statistics.
+
+        Results are cached by query arguments, and invalidated when objects of
+        the queried type (or, without *type*, of any type) are added, updated
+        or deleted.  Results of queries on inverted indexes are also
+        invalidated when objects of any type using that inverted index change,
+        as those affect the ranking.  Queries with arguments that can't be
+        used as cache key, such as dicts, aren't cached.
+
+        Changes made directly through sqlite, bypassing the Database methods,
+        aren't noticed; use :meth:`~kaa.db.QueryCache.clear` in that case.
+        """
+        self._query_cache = QueryCache(size, ttl)
+        return self._query_cache
+
+
+    def disable_query_cache(self):
+        """
+        Stop caching query results and discard the cache.
+        """
+        self._query_cache = None
+
+
+    def _query_cache_tags(self, attrs):
+        """
+        Returns the QueryCache tags for a query: the queried object type (or
+        None for all types) and the queried inverted indexes.
+        """
+        type_name = attrs.get('type')
+        if 'object' in attrs:
+            type_name = self._to_obj_tuple(attrs['object'])[0]
+        tags = [None, ('type', type_name)]
+        tags.extend(('ivtidx', ivtidx) for ivtidx in self._inverted_indexes if ivtidx in attrs)
+        return tuple(tags)
+
+
+    def _invalidate_query_cache(self, *types):
+        """
+        Invalidates cached results of queries on the given object types, or
+        all cached results if no types are given.
+        """
+        cache = self._query_cache
+        if not cache:
+            return
+        if not types:
+            return cache.clear()
+        tags = [('type', None)]
+        for type_name in types:
+            tags.append(('type', type_name))
+            tags.extend(('ivtidx', ivtidx) for ivtidx in self._get_type_inverted_indexes(type_name))
+        cache.invalidate(tags)
+
+
+    def run_async(self, priority, method, *args, **kwargs):
+        """
+        Call a method of this database in a thread.
+
+        :param priority: calls with higher priority are done first; see
+                         :data:`~kaa.db.PRIORITY_QUERY` and
+                         :data:`~kaa.db.PRIORITY_CHANGE`.
+        :type priority: int
+        :param method: the method to call, e.g. ``db.query``
+        :param args: positional arguments for the method
+        :param kwargs: keyword arguments for the method
+        :returns: :class:`~kaa.ThreadInProgress` finished with the result of
+                  the method.
+
+        The database has its own thread pool (registered as
+        ``kaa.db::<filename>``), with one thread or, in WAL mode, as many
+        threads as reader connections.  Calls waiting for a
+        thread are done in order of priority, and in the order they were made
+        for the same priority.  So a query made after a change is only
+        guaranteed to see that change when using the same priority.
+
+        If the InProgress is aborted before the call is started, the call is
+        not done.  A call in progress can't be interrupted, but its result is
+        discarded.
+        """
+        if not self._pool:
+            name = 'kaa.db::%s' % self._dbfile
+            self._pool = get_thread_pool(name) or register_thread_pool(name, ThreadPool(self._readers_max or 1))
+        callable = ThreadPoolCallable((self._pool, priority), method)
+        # Raising InProgressAborted inside the thread could leave a change
+        # half done.
+        callable.signals['abort'].connect(lambda *args: False)
+        return callable(*args, **kwargs)
+
+
+    def query_async(self, **attrs):
+        """
+        Like :meth:`~kaa.db.Database.query`, but done in a thread with
+        :data:`~kaa.db.PRIORITY_QUERY`.
+
+        :returns: :class:`~kaa.InProgress` finished with a list of
+                  :class:`ObjectRow` objects
+
+        If an identical query is already waiting or in progress, no new
+        query is done; all callers get (a copy of the list of) the same
+        result instead.  This method must be called from the main thread.
+        """
+        key = _query_key(attrs)
+        if key is None:
+            return self.run_async(PRIORITY_QUERY, self.query, **attrs)
+
+        pending = self._async_queries.get(key)
+        if not pending:
+            job = self.run_async(PRIORITY_QUERY, self.query, **attrs)
+            pending = self._async_queries[key] = [job, 0]
+            job.connect_both(lambda *args: self._async_queries.pop(key, None))
+
+        ip = InProgress(abortable=True)
+        pending[1] += 1
+        ip.signals['abort'].connect(self._abort_async_query, pending)
+
+        def finished(result):
+            if not ip.finished:
+                ip.finish(list(result))
+
+        def failed(tp, exc, tb):
+            if not ip.finished:
+                ip.throw(tp, exc, tb)
+            # Handled by the callers.
+            return False
+
+        pending[0].connect_both(finished, failed)
+        return ip
+
+
+    def _abort_async_query(self, exc, pending):
+        # One caller of a query_async() gave up, stop the query once
+        # nobody needs it anymore.
+        job = pending[0]
+        pending[1] -= 1
+        if pending[1] == 0 and not job.finished:
+            job.abort()
+
+
+    def get_async(self, obj):
+        """
+        Like :meth:`~kaa.db.Database.get`, but done in a thread with
+        :data:`~kaa.db.PRIORITY_QUERY`.
+
+        :returns: :class:`~kaa.ThreadInProgress`
+        """
+        return self.run_async(PRIORITY_QUERY, self.get, obj)
+
+
+    def add_async(self, object_type, parent=None, **attrs):
+        """
+        Like :meth:`~kaa.db.Database.add`, but done in a thread with
+        :data:`~kaa.db.PRIORITY_CHANGE`.
+
+        :returns: :class:`~kaa.ThreadInProgress`
+        """
+        return self.run_async(PRIORITY_CHANGE, self.add, object_type, parent, **attrs)
+
+
+    def add_many_async(self, object_type, objects, chunk_size=1000):
+        """
+        Like :meth:`~kaa.db.Database.add_many`, but done in a thread with
+        :data:`~kaa.db.PRIORITY_CHANGE`.
+
+        :returns: :class:`~kaa.ThreadInProgress`
+        """
+        return self.run_async(PRIORITY_CHANGE, self.add_many, object_type, objects, chunk_size)
+
+
+    def update_async(self, obj, parent=None, **attrs):
+        """
+        Like :meth:`~kaa.db.Database.update`, but done in a thread with
+        :data:`~kaa.db.PRIORITY_CHANGE`.
+
+        :returns: :class:`~kaa.ThreadInProgress`
+        """
+        return self.run_async(PRIORITY_CHANGE, self.update, obj, parent, **attrs)
+
+
+    def delete_async(self, obj):
+        """
+        Like :meth:`~kaa.db.Database.delete`, but done in a thread with
+        :data:`~kaa.db.PRIORITY_CHANGE`.
+
+        :returns: :class:`~kaa.ThreadInProgress`
+        """
+        return self.run_async(PRIORITY_CHANGE, self.delete, obj)
+
+
+    def delete_by_query_async(self, **attrs):
+        """
+        Like :meth:`~kaa.db.Database.delete_by_query`, but done in a thread
+        with :data:`~kaa.db.PRIORITY_CHANGE`.
+
+        :returns: :class:`~kaa.ThreadInProgress`
+        """
+        return self.run_async(PRIORITY_CHANGE, self.delete_by_query, **attrs)
+
+
+    def commit_async(self):
+        """
+        Like :meth:`~kaa.db.Database.commit`, but done in a thread with
+        :data:`~kaa.db.PRIORITY_CHANGE`, so after changes made before
+        with the *_async methods.
+
+        :returns: :class:`~kaa.ThreadInProgress`
+        """
+        return self.run_async(PRIORITY_CHANGE, self.commit)
+
+
     @property
     def filename(self):
         """
@@ -2541,6 +3344,15 @@ class Database(object):
         return self._dbfile
 
 
+    @property
+    def query_cache(self):
+        """
+        The :class:`~kaa.db.QueryCache` if enabled with
+        :meth:`~kaa.db.Database.enable_query_cache`, otherwise None.
+        """
+        return self._query_cache
+
+
     @property
     def lazy_commit(self):
         """
@@ -30,11 +30,12 @@ import sys
 import os
 import socket
 import logging
-import time
 import fcntl
 import re
 import errno
 import threading
+import itertools
+import collections
 try:
     from io import BytesIO
 except ImportError:
@@ -55,6 +56,27 @@ IO_READ   = 1
 IO_WRITE  = 2
 IO_EXCEPT = 3
 
+# Maximum number of buffers and bytes coalesced into a single write.
+try:
+    WRITEV_MAX_BUFFERS = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    WRITEV_MAX_BUFFERS = -1
+if WRITEV_MAX_BUFFERS <= 0:
+    WRITEV_MAX_BUFFERS = 1024
+WRITEV_MAX_BYTES = 256 * 1024
+
+# (class, method, fallback) -> result of IOChannel._can_use(), which is
+# consulted on every read and write.
+_can_use_cache = {}
+
+
+def _join_buffers(buffers):
+    """
+    Joins a list of strings and memoryviews into a single string.
+    """
+    return bl('').join(b.tobytes() if isinstance(b, memoryview) else b for b in buffers)
+
+
 class IOMonitor(notifier.NotifierCallback):
     def __init__(self, callback, *args, **kwargs):
         """
@@ -119,6 +141,178 @@ class WeakIOMonitor(notifier.WeakNotifierCallback, IOMonitor):
     pass
 
 
+
+class ReadBuffer(object):
+    """
+    Read queue used by IOChannels in zero-copy mode.
+
+    Data is held in a preallocated bytearray between a start and end offset.
+    Channels read directly into the free space after the end offset, and
+    consumed data is released by advancing the start offset, so no strings
+    are allocated per read.  When the free space at the end is exhausted the
+    remaining data is moved to the front of the buffer, and only if the
+    buffer is too small is a larger one allocated.
+
+    Line scanning is incremental: the offset up to which the buffer was
+    searched for a delimiter is remembered, so a long partial line is not
+    rescanned each time more data arrives.
+
+    The file-like write(), tell() and getvalue() methods are compatible with
+    the BytesIO object used as read queue otherwise.
+    """
+    def __init__(self, size):
+        self._buf = bytearray(size)
+        self._start = self._end = self._scan = 0
+        # (buffer, offset) of the region handed out by reserve()
+        self._reserved = None
+
+
+    def __len__(self):
+        return self._end - self._start
+
+
+    def _ensure(self, size):
+        """
+        Makes room for at least size bytes after the end offset.
+        """
+        if self._end + size <= len(self._buf):
+            return
+        used = self._end - self._start
+        if used + size <= len(self._buf):
+            # Compact.  This never resizes the bytearray, which is not
+            # permitted while memoryviews of it exist.
+            self._buf[:used] = self._buf[self._start:self._end]
+        else:
+            buf = bytearray(max(len(self._buf) * 2, used + size))
+            buf[:used] = self._buf[self._start:self._end]
+            self._buf = buf
+        self._scan -= self._start
+        self._start, self._end = 0, used
+
+
+    def reserve(self, size):
+        """
+        Returns a writable memoryview of size bytes after the end of the
+        buffered data.  Data read into it is added to the buffer by
+        :meth:`commit`.
+        """
+        if self._start == self._end:
+            self._start = self._end = self._scan = 0
+        self._ensure(size)
+        self._reserved = self._buf, self._end
+        return memoryview(self._buf)[self._end:self._end + size]
+
+
+    def commit(self, size):
+        """
+        Appends the first size bytes of the region last returned by
+        :meth:`reserve` to the buffer.
+        """
+        if not self._reserved:
+            return
+        buf, offset = self._reserved
+        self._reserved = None
+        if buf is self._buf and offset == self._end:
+            self._end += size
+        elif size:
+            # The buffer was modified since the region was reserved.
+            self.write(memoryview(buf)[offset:offset + size].tobytes())
+
+
+    def write(self, data):
+        self._ensure(len(data))
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+
+    def tell(self):
+        return self._end - self._start
+
+
+    def getvalue(self):
+        return bytes(self._buf[self._start:self._end])
+
+
+    def clear(self):
+        self._start = self._end = self._scan = 0
+
+
+    def find(self, find_delim, delim_len):
+        """
+        Returns the buffer offset just past the first delimiter, or None.
+
+        :param find_delim: IOChannel._find_delim compatible callable.
+        :param delim_len: the maximum length of the delimiter, needed to
+                          resume scanning correctly.
+        """
+        idx = find_delim(self._buf, max(self._scan, self._start), self._end)
+        if idx is None:
+            # Resume before the end in case the data ends with a partial
+            # delimiter.
+            self._scan = max(self._start, self._end - delim_len + 1)
+        return idx
+
+
+    def pop(self, idx, view=False):
+        """
+        Removes and returns the data up to the given offset (as returned by
+        :meth:`find`).
+
+        If view is True, a memoryview of the buffer is returned rather than
+        a copy, which is only valid until the buffer is next modified.
+        """
+        data = memoryview(self._buf)[self._start:idx]
+        self._start = self._scan = idx
+        return data if view else data.tobytes()
+
+
+
+class WriteQueue(collections.deque):
+    """
+    Deque of (data, inprogress) tuples waiting to be written to an IOChannel,
+    which keeps track of the number of bytes queued.
+
+    If the channel can't write several buffers at once, the first buffers
+    are joined for a write.  When the write is partial, joined holds a
+    (view, count) tuple, view being the remaining joined data of the first
+    count buffers, so the next write continues from there instead of joining
+    the buffers again.
+    """
+    def __init__(self):
+        super(WriteQueue, self).__init__()
+        self.size = 0
+        self.joined = None
+
+
+    def append(self, item):
+        super(WriteQueue, self).append(item)
+        self.size += len(item[0])
+
+
+    def popleft(self):
+        item = super(WriteQueue, self).popleft()
+        self.size -= len(item[0])
+        return item
+
+
+    def remove(self, item):
+        super(WriteQueue, self).remove(item)
+        self.size -= len(item[0])
+        self.joined = None
+
+
+    def clear(self):
+        super(WriteQueue, self).clear()
+        self.size = 0
+        self.joined = None
+
+
+    def __setitem__(self, idx, item):
+        self.size += len(item[0]) - len(self[idx][0])
+        super(WriteQueue, self).__setitem__(idx, item)
+
+
+
 class IOChannel(Object):
     """
     Base class for read-only, write-only or read-write stream-based
@@ -180,6 +374,11 @@ class IOChannel(Object):
     In order for readline to work properly, a read queue is maintained, which
     may grow up to *queue_size*.  See the :meth:`~kaa.IOChannel.readline` method
     for more details.
+
+    For high throughput channels, the :attr:`~kaa.IOChannel.zero_copy`
+    property enables reading into a preallocated buffer, in which case
+    callbacks connected to the *read* and *readline* signals receive
+    memoryview objects instead of strings.
     """
     __kaasignals__ = {
         'read':
@@ -189,7 +388,7 @@ class IOChannel(Object):
             .. describe:: def callback(chunk, ...)
 
                :param chunk: data read from the channel
-               :type chunk: str
+               :type chunk: str, or memoryview in :attr:`~kaa.IOChannel.zero_copy` mode
 
             When a callback is connected to the *read* signal, data is automatically
             read from the channel as soon as it becomes available, and the signal
@@ -207,7 +406,7 @@ class IOChannel(Object):
             .. describe:: def callback(line, ...)
 
                :param line: line read from the channel
-               :type line: str
+               :type line: str, or memoryview in :attr:`~kaa.IOChannel.zero_copy` mode
 
             It is not allowed to have a callback connected to the *readline* signal
             and simultaneously use the :meth:`~kaa.IOChannel.readline` method.
@@ -230,10 +429,14 @@ class IOChannel(Object):
     def __init__(self, channel=None, mode=IO_READ|IO_WRITE, chunk_size=1024*1024, delimiter='\n'):
         super(IOChannel, self).__init__()
         self.delimiter = delimiter
-        self._write_queue = []
+        # Deque of (data, inprogress).  If data was partially written, it is
+        # replaced by a memoryview of the remaining data.
+        self._write_queue = WriteQueue()
         # Read queue used for read() and readline(), and 'readline' signal.
         self._read_queue = BytesIO()
         self._read_queue_lock = threading.RLock()
+        # If True, _read_queue is a ReadBuffer; see zero_copy property.
+        self._zero_copy = False
         # Number of bytes each queue (read and write) are limited to.
         self._queue_size = 1024*1024
         self._chunk_size = chunk_size
@@ -377,9 +580,7 @@ class IOChannel(Object):
         """
         The number of bytes queued in memory to be written to the channel.
         """
-        # XXX: this is not terribly efficient when the write queue has
-        # many elements.  We may decide to keep a separate counter.
-        return sum(len(data) for data, inprogress in self._write_queue)
+        return self._write_queue.size
 
 
     @property
@@ -392,6 +593,62 @@ class IOChannel(Object):
         """
         return self._read_queue.tell()
 
+    @property
+    def zero_copy(self):
+        """
+        Whether data is read into a preallocated buffer rather than into a
+        newly allocated string for each chunk.
+
+        In zero-copy mode, data is read using ``recv_into()`` or
+        ``readinto()`` (when the channel supports it), the read queue used
+        for readline is scanned incrementally, and callbacks connected to the
+        *read* and *readline* signals receive memoryview objects referencing
+        the buffer.  These are only valid until the callback returns; use
+        ``view.tobytes()`` to keep the data.  InProgress objects returned by
+        :meth:`read` and :meth:`readline` are always finished with strings.
+
+        The default is False.
+        """
+        return self._zero_copy
+
+
+    @zero_copy.setter
+    def zero_copy(self, value):
+        value = bool(value)
+        if value == self._zero_copy:
+            return
+        with self._read_queue_lock:
+            data = self._read_queue.getvalue()
+            if value:
+                self._read_queue = ReadBuffer(self._chunk_size * 2)
+            else:
+                self._read_queue = BytesIO()
+            self._read_queue.write(data)
+            self._zero_copy = value
+
+
+    def _can_use(self, method, fallback):
+        """
+        Returns True if the low-level method (e.g. _read_into) can be used
+        instead of the given fallback method (e.g. _read).
+
+        This is not the case if a subclass overrides the fallback (e.g. to
+        decrypt data) without also overriding the method.
+        """
+        key = type(self), method, fallback
+        try:
+            return _can_use_cache[key]
+        except KeyError:
+            pass
+        result = False
+        for cls in key[0].__mro__:
+            if method in cls.__dict__ or fallback in cls.__dict__:
+                result = method in cls.__dict__
+                break
+        _can_use_cache[key] = result
+        return result
+
+
     @property
     def delimiter(self):
         """
@@ -409,9 +666,11 @@ class IOChannel(Object):
         self._delimiter = value
         if isinstance(value, (UNICODE_TYPE, BYTES_TYPE)):
             self._delimiter_encoded = py3_b(value)
+            self._delimiter_len = len(self._delimiter_encoded)
         elif isinstance(value, (list, tuple)):
             regexp = bl('|').join(py3_b(x) for x in value)
             self._delimiter_encoded = re.compile(regexp)
+            self._delimiter_len = max(len(py3_b(x)) for x in value)
         else:
             raise ValueError('delimiter must be a string, bytes, or sequence of strings or bytes')
 
@@ -594,31 +853,49 @@ class IOChannel(Object):
 
     def _clear_read_queue(self):
         with self._read_queue_lock:
-            self._read_queue.seek(0)
-            self._read_queue.truncate()
+            if self._zero_copy:
+                self._read_queue.clear()
+            else:
+                self._read_queue.seek(0)
+                self._read_queue.truncate()
 
 
-    def _find_delim(self, buf, start=0):
+    def _find_delim(self, buf, start=0, end=None):
         """
         Returns the position in the buffer where the first delimiter is found.
         The index position includes the delimiter.  If the delimiter is not
         found, None is returned.
         """
+        if end is None:
+            end = len(buf)
         if type(self._delimiter_encoded) == BYTES_TYPE:
-            idx = buf.find(self._delimiter_encoded, start)
+            idx = buf.find(self._delimiter_encoded, start, end)
             return idx + len(self._delimiter_encoded) if idx >= 0 else None
 
         # Delimiter is a list, so find any one of them.
-        m = self._delimiter_encoded.search(buf, start)
+        m = self._delimiter_encoded.search(buf, start, end)
         return m.end() if m else None
 
 
-    def _pop_line_from_read_queue(self):
+    def _pop_line_from_read_queue(self, view=False):
         """
         Pops a line (plus delimiter) from the read queue.  If the delimiter
         is not found in the queue, returns None.
+
+        In zero-copy mode, a memoryview of the read queue is returned if
+        view is True.
         """
         with self._read_queue_lock:
+            if self._zero_copy:
+                idx = self._read_queue.find(self._find_delim, self._delimiter_len)
+                if idx is not None:
+                    return self._read_queue.pop(idx, view)
+                elif (not self._channel or self._eof) and self._read_queue.tell():
+                    s = self._read_queue.getvalue()
+                    self._clear_read_queue()
+                    return s
+                return
+
             s = self._read_queue.getvalue()
             idx = self._find_delim(s)
             if idx is None:
@@ -742,6 +1019,40 @@ class IOChannel(Object):
             return os.read(self.fileno, size)
 
 
+    def _read_into(self, buf):
+        """
+        Low-level call to read from channel into the given writable buffer
+        (a memoryview) in zero-copy mode.  Can be overridden by subclasses.
+        Must return the number of bytes read, or 0 or None if no data is
+        available.
+        """
+        try:
+            return self._channel.readinto(buf)
+        except AttributeError:
+            data = os.read(self.fileno, len(buf))
+            buf[:len(data)] = data
+            return len(data)
+
+
+    def _read_chunk(self):
+        """
+        Reads a chunk in zero-copy mode.  The chunk is read into the free space
+        of the read queue (without being added to it) and returned as
+        memoryview, or the empty string if no data is available.
+        """
+        if self._can_use('_read_into', '_read'):
+            buf = self._read_queue.reserve(self._chunk_size)
+            size = self._read_into(buf) or 0
+        else:
+            # _read() may itself write to the read queue, so reserve space
+            # only after reading.
+            data = self._read(self._chunk_size)
+            size = len(data) if data else 0
+            buf = self._read_queue.reserve(size)
+            buf[:] = data or bl('')
+        return buf[:size] if size else ''
+
+
     def _handle_read(self):
         """
         IOMonitor callback when there is data to be read from the channel.
@@ -752,7 +1063,10 @@ class IOChannel(Object):
         """
         exc = None
         try:
-            data = self._read(self._chunk_size)
+            if self._zero_copy:
+                data = self._read_chunk()
+            else:
+                data = self._read(self._chunk_size)
         except (IOError, socket.error) as e:
             exc = sys.exc_info()
             if len(e.args) != 2:
@@ -788,12 +1102,14 @@ class IOChannel(Object):
             if exc:
                 self._read_signal.emit(*exc)
             else:
-                self._read_signal.emit(data)
+                self._read_signal.emit(data.tobytes() if isinstance(data, memoryview) else data)
         if data:
             self.signals['read'].emit(data)
 
         with self._read_queue_lock:
-            if len(self._readline_signal):
+            if self._zero_copy:
+                self._handle_read_zero_copy(data, exc)
+            elif len(self._readline_signal):
                 # Handle a readline() call
                 if self.read_queue_used + len(data) > self._queue_size:
                     # This data chunk would exceed the read queue limit.  We
@@ -847,6 +1163,41 @@ class IOChannel(Object):
         self._update_read_monitor()
 
 
+    def _handle_read_zero_copy(self, data, exc):
+        """
+        Readline handling for _handle_read() in zero-copy mode, where data
+        is a memoryview of the free space of the read queue.  Unlike the
+        normal mode, lines are found by scanning only the new data.
+        """
+        queue = self._read_queue
+        if len(self._readline_signal):
+            if queue.tell() + len(data) > self._queue_size:
+                # See comment in _handle_read()
+                line = queue.getvalue()
+                queue.clear()
+                queue.commit(len(data))
+            else:
+                queue.commit(len(data))
+                line = self._pop_line_from_read_queue()
+
+            if line is not None:
+                self._readline_signal.emit(line)
+            elif self._eof:
+                if exc:
+                    self._readline_signal.throw(*exc)
+                else:
+                    self._readline_signal.emit('')
+        elif len(self.signals['readline']):
+            # Emit all complete lines as views of the read queue.  The
+            # remaining partial line stays queued.
+            queue.commit(len(data))
+            while True:
+                idx = queue.find(self._find_delim, self._delimiter_len)
+                if idx is None:
+                    break
+                self.signals['readline'].emit(queue.pop(idx, view=True))
+
+
     def _write(self, data):
         """
         Low-level call to write to the channel  Can be overridden by subclasses.
@@ -855,6 +1206,24 @@ class IOChannel(Object):
         return os.write(self.fileno, data)
 
 
+    def _writev(self, buffers):
+        """
+        Low-level call to write a list of buffers to the channel with a single
+        system call.  Can be overridden by subclasses.  Must return number of
+        bytes written to the channel.  Only called if _can_writev() is True.
+        """
+        return os.writev(self.fileno, buffers)
+
+
+    def _can_writev(self):
+        """
+        Returns True if _writev() is available, otherwise buffers are joined
+        and written with _write().  Can be overridden by subclasses along
+        with _writev().
+        """
+        return self._can_use('_writev', '_write') and hasattr(os, 'writev')
+
+
     def _abort_write_inprogress(self, exc, data, ip):
         try:
             self._write_queue.remove((data, ip))
@@ -872,9 +1241,10 @@ class IOChannel(Object):
 
         :returns: An :class:`~kaa.InProgress` object which is finished when the
                   given data is fully written to the channel.  The InProgress
-                  is finished with the number of bytes sent in the last write
-                  required to commit the given data to the channel.  (This may
-                  not be the actual number of bytes of the given data.)
+                  is finished with the number of bytes of the given data sent
+                  in the last write required to commit it to the channel.
+                  (This may not be the actual number of bytes of the given
+                  data.)
 
                   If the channel closes unexpectedly before the data was
                   written, an IOError is thrown to the InProgress.
@@ -886,6 +1256,10 @@ class IOChannel(Object):
         exceed the desired size by waiting for past write() InProgress to
         finish before writing more data.
 
+        Small writes queued in the meantime are coalesced, so that they are
+        sent with a single system call (using writev or sendmsg where
+        available).
+
         If a write does not complete because the channel was closed
         prematurely, an IOError is thrown to the InProgress.
         """
@@ -919,59 +1293,104 @@ class IOChannel(Object):
         registered then the write queue is empty, so we only get called when
         there is something to write.
         """
-        if not self._write_queue:
-            # Can happen if a write was aborted.
-            return
+        queue = self._write_queue
+        while queue:
+            if queue.joined:
+                # Continue the partial write of buffers joined before.
+                joined, count = queue.joined
+                buffers, size = [joined], len(joined)
+            else:
+                # Coalesce as many queued buffers as possible into one write.
+                buffers, size = [queue[0][0]], len(queue[0][0])
+                for data, inprogress in itertools.islice(queue, 1, WRITEV_MAX_BUFFERS):
+                    if size + len(data) > WRITEV_MAX_BYTES:
+                        break
+                    buffers.append(data)
+                    size += len(data)
+                count, joined = len(buffers), None
+                if count > 1 and not self._can_writev():
+                    joined = memoryview(_join_buffers(buffers))
+                    buffers = [joined]
+                    queue.joined = joined, count
 
-        try:
-            while self._write_queue:
-                data, inprogress = self._write_queue.pop(0)
-                sent = self._write(data)
-                log.debug2('IOChannel write data: channel=%s fd=%s len=%d (of %d)',
-                           self._channel, self.fileno, sent, len(data))
-                if sent != len(data):
-                    # Not all data was able to be sent; push remaining data
-                    # back onto the write buffer.
-                    self._write_queue.insert(0, (data[(sent if sent >= 0 else 0):], inprogress))
-                    break
-                else:
-                    # All data is written, finish the InProgress associated
-                    # with this write.
-                    inprogress.finish(sent)
-
-            if not self._write_queue:
-                if self._queue_close:
-                    return self.close(immediate=True)
-                self._wmon.unregister()
-
-        except Exception, e:
-            tp, exc, tb = sys.exc_info()
-            if tp in (OSError, IOError, socket.error):
-                if e.args[0] == 11:
-                    # Resource temporarily unavailable -- we are trying to write
-                    # data to a socket which is not ready.  To prevent a busy loop
-                    # (mainloop will keep calling us back) we sleep a tiny
-                    # bit.  It's admittedly a bit kludgy, but it's a simple
-                    # solution to a condition which should not occur often.
-                    self._write_queue.insert(0, (data, inprogress))
-                    time.sleep(0.001)
-                    return
+            try:
+                if len(buffers) == 1:
+                    sent = self._write(buffers[0])
                 else:
-                    if self._close_on_eof:
-                        # Close, which also throws to any other pending
-                        # InProgress writes.
-                        self.close(immediate=True, expected=False)
-                    # Normalize exception into an IOError.
-                    tp, exc = IOError, IOError(*e.args)
+                    sent = self._writev(buffers)
+            except Exception, e:
+                return self._handle_write_error(queue, e)
+
+            log.debug2('IOChannel write data: channel=%s fd=%s len=%d (of %d in %d buffers)',
+                       self._channel, self.fileno, sent, size, count)
+            if not sent or sent < 0:
+                sent = 0
+            if joined is not None:
+                queue.joined = (joined[sent:], count) if sent < size else None
+
+            # Remove all fully written buffers from the queue before finishing
+            # their InProgress, whose callbacks may write to or close the
+            # channel.
+            written = []
+            while queue and sent >= len(queue[0][0]):
+                data, inprogress = queue.popleft()
+                sent -= len(data)
+                written.append((inprogress, len(data)))
+            if queue.joined:
+                queue.joined = queue.joined[0], count - len(written)
+            if sent:
+                # Not all data was able to be sent; replace the partially
+                # written buffer with a view of the remaining data.
+                data, inprogress = queue[0]
+                queue[0] = memoryview(data)[sent:], inprogress
+
+            # Finish the InProgress associated with each completed write.
+            for inprogress, size in written:
+                inprogress.finish(size)
+
+            if len(written) < count or queue is not self._write_queue:
+                # The channel can't take more data right now (we get called
+                # again once it can), or it was closed by a callback.
+                return
+
+        if self._queue_close:
+            return self.close(immediate=True)
+        if self._wmon:
+            self._wmon.unregister()
+
+
+    def _handle_write_error(self, queue, e):
+        """
+        Handles an exception raised by a low-level write of the first buffers
+        in the write queue.
+        """
+        tp, exc, tb = sys.exc_info()
+        if tp in (OSError, IOError, socket.error):
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # Resource temporarily unavailable -- we are trying to write
+                # data to a channel which is not ready.  The write monitor
+                # stays registered, so we get called again once it is.
+                return
+            # Take the write that failed off the queue before closing, which
+            # throws to any other pending InProgress writes.
+            data, inprogress = queue.popleft()
+            queue.joined = None
+            if self._close_on_eof:
+                self.close(immediate=True, expected=False)
+            # Normalize exception into an IOError.
+            tp, exc = IOError, IOError(*e.args)
+        else:
+            data, inprogress = queue.popleft()
+            queue.joined = None
 
-            # Throw the current exception to the InProgress for this write.
-            # If nobody is listening for it, it will eventually get logged
-            # as unhandled.
-            inprogress.throw(tp, exc, tb)
+        # Throw the current exception to the InProgress for this write.
+        # If nobody is listening for it, it will eventually get logged
+        # as unhandled.
+        inprogress.throw(tp, exc, tb)
 
-            # XXX: this seems to be necessary in order to get the unhandled
-            # InProgress to log, but I've no idea why.
-            del inprogress
+        # XXX: this seems to be necessary in order to get the unhandled
+        # InProgress to log, but I've no idea why.
+        del inprogress
 
 
     def _close(self):
@@ -1043,7 +1462,7 @@ class IOChannel(Object):
                 # Somebody cares about this InProgress, so we need to finish
                 # it.
                 inprogress.throw(IOError, IOError(9, 'Channel closed prematurely'), None)
-        del self._write_queue[:]
+        self._write_queue.clear()
 
         try:
             self._close()
@@ -1101,14 +1520,16 @@ class IOChannel(Object):
         self._delimiter = channel.delimiter
         self._write_queue = channel._write_queue
         self._read_queue = channel._read_queue
+        self._zero_copy = channel._zero_copy
         self._queue_size = channel._queue_size
         self._chunk_size = channel._chunk_size
         self._queue_close = channel._queue_close
 
         # Generate new queues on the channel object whose fd we are stealing, since
         # we stole its queues too.
-        channel._write_queue = []
+        channel._write_queue = WriteQueue()
         channel._read_queue = BytesIO()
+        channel._zero_copy = False
         channel._channel = None
 
         def clone(src, dst):
@@ -0,0 +1,223 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# loopstats.py - Main loop latency and utilization statistics
+#
+# A LoopStats object is attached to the notifier by kaa.main.enable_stats()
+# and is then fed with the time the main loop spent waiting in the poller and
+# the time each callback took to execute.  It is meant to be cheap enough to
+# stay enabled in production.
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2012 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+__all__ = [ 'LoopStats', 'TIMER', 'IO', 'THREAD', 'STEP' ]
+
+# python imports
+import time
+import bisect
+import collections
+
+# Callback categories
+TIMER = 'timer'
+IO = 'io'
+THREAD = 'thread'
+STEP = 'step'
+
+# Upper bounds (in seconds) of the latency histogram buckets.  The last
+# bucket counts everything above the largest bound.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram(object):
+    """
+    Count, sum, maximum and bucketed distribution of durations.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.buckets[bisect.bisect_left(BUCKETS, duration)] += 1
+
+
+    def percentile(self, pct):
+        """
+        Returns the upper bound of the bucket holding the given percentile,
+        capped at the maximum.
+        """
+        if not self.count:
+            return 0.0
+        threshold = self.count * pct / 100.0
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= threshold:
+                return min(bound, self.max)
+        return self.max
+
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'avg': self.total / self.count if self.count else 0.0,
+            'buckets': zip(BUCKETS + (None,), self.buckets)
+        }
+
+
+
+class LoopStats(object):
+    """
+    Collects main loop statistics.
+
+    :param slow_threshold: callbacks taking longer than this many seconds are
+                           recorded in the slow callback history.
+    :param history: the number of slow callbacks to remember.
+
+    The notifier reports the time spent waiting for events per step, and the
+    execution time of timer, IO, thread queue and step signal callbacks.
+    Time spent executing thread queue callbacks (which are themselves
+    dispatched from an IO callback on the thread notifier pipe) is not
+    accounted to the IO category.
+    """
+    def __init__(self, slow_threshold=0.01, history=50):
+        self.slow_threshold = slow_threshold
+        self.slow = collections.deque(maxlen=history)
+        self.reset()
+
+
+    def reset(self):
+        """
+        Discards all statistics collected so far.
+        """
+        self.started = time.time()
+        self.steps = 0
+        self.wait = Histogram()
+        self.callbacks = dict((category, Histogram()) for category in (TIMER, IO, THREAD, STEP))
+        self.slow.clear()
+        # Thread queue depth when run_queue() is invoked, and the time
+        # callbacks spent in the queue before being invoked.
+        self.queue_depth = Histogram()
+        self.queue_wait = Histogram()
+        # Time spent in thread queue callbacks that has not yet been
+        # deducted from the enclosing IO callback.
+        self._inner = 0.0
+
+
+    def add_wait(self, duration):
+        """
+        Records the time the main loop waited in the poller during one step.
+        """
+        self.steps += 1
+        self.wait.add(duration)
+
+
+    def add_queue_depth(self, depth):
+        """
+        Records the number of callbacks queued by threads for the main loop
+        when the main loop begins to process the queue.
+        """
+        self.queue_depth.add(depth)
+
+
+    def add_queue_wait(self, duration):
+        """
+        Records the time a callback queued by a thread waited for the main
+        loop to invoke it.
+        """
+        self.queue_wait.add(duration)
+
+
+    def add_callback(self, category, callback, duration):
+        """
+        Records the execution time of a callback.
+        """
+        if category == THREAD:
+            self._inner += duration
+        elif self._inner:
+            # The thread queue is run from an IO callback, so exclude the
+            # time already recorded for the queued callbacks.
+            duration = max(duration - self._inner, 0.0)
+            self._inner = 0.0
+        self.callbacks[category].add(duration)
+        if duration >= self.slow_threshold:
+            self.slow.append((time.time(), category, repr(callback), duration))
+
+
+    @property
+    def utilization(self):
+        """
+        Fraction of time the main loop spent executing callbacks rather than
+        waiting for events.
+        """
+        busy = sum(h.total for h in self.callbacks.values())
+        if busy + self.wait.total == 0:
+            return 0.0
+        return busy / (busy + self.wait.total)
+
+
+    def snapshot(self):
+        """
+        Returns a dict containing the current statistics.
+        """
+        return {
+            'elapsed': time.time() - self.started,
+            'steps': self.steps,
+            'utilization': self.utilization,
+            'wait': self.wait.snapshot(),
+            'callbacks': dict((category, h.snapshot()) for category, h in self.callbacks.items()),
+            'queue_depth': {'avg': self.queue_depth.total / self.queue_depth.count if self.queue_depth.count else 0.0,
+                            'max': self.queue_depth.max},
+            'queue_wait': self.queue_wait.snapshot(),
+            'slow': list(self.slow)
+        }
+
+
+    def summary(self):
+        """
+        Returns a human readable summary of the current statistics, suitable
+        for logging.
+        """
+        lines = ['main loop: %d steps in %.1fs, %.1f%% busy, wait avg %.2fms' % \
+                 (self.steps, time.time() - self.started, self.utilization * 100,
+                  self.wait.total / self.wait.count * 1000 if self.wait.count else 0)]
+        for category in (TIMER, IO, THREAD, STEP):
+            h = self.callbacks[category]
+            lines.append('  %-6s %8d calls, total %.3fs, p50 %.2fms, p99 %.2fms, max %.2fms' % \
+                         (category, h.count, h.total, h.percentile(50) * 1000,
+                          h.percentile(99) * 1000, h.max * 1000))
+        h = self.queue_wait
+        lines.append('  queue  depth avg %.1f max %d, wait p50 %.2fms, p99 %.2fms, max %.2fms' % \
+                     (self.queue_depth.total / self.queue_depth.count if self.queue_depth.count else 0,
+                      self.queue_depth.max, h.percentile(50) * 1000, h.percentile(99) * 1000,
+                      h.max * 1000))
+        for t, category, callback, duration in sorted(self.slow, key=lambda s: -s[3])[:5]:
+            lines.append('  slow %s %.2fms: %s' % (category, duration * 1000, callback))
+        return '\n'.join(lines)
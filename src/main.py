@@ -32,7 +32,8 @@ from __future__ import absolute_import
 
 __all__ = [ 'run', 'stop', 'step', 'is_running', 'wakeup',
             'set_as_mainthread', 'is_shutting_down', 'loop', 'signals', 'init',
-            'is_initialized' ]
+            'is_initialized', 'set_poller', 'get_poller', 'enable_stats',
+            'disable_stats', 'get_stats' ]
 
 # python imports
 import sys
@@ -47,6 +48,7 @@ from . import nf_wrapper as notifier
 from .core import Signals, CoreThreading
 from . import timer
 from . import thread
+from .loopstats import LoopStats
 
 # get logging object
 log = logging.getLogger('kaa.base.core.main')
@@ -63,6 +65,8 @@ _shutdown_event = threading.Event()
 _loop_lock = threading.Lock()
 # True if init() has been called
 _initialized = False
+# Timer logging the main loop statistics (see enable_stats())
+_stats_timer = None
 
 #: mainloop signals to connect to
 #:  - init: emitted when kaa.main.init() is invoked; will always be from the 
@@ -82,8 +86,8 @@ def init(reset=False):
     """
     Initialize the Kaa main loop facilities.
 
-    :param reset: discards any jobs queued by other threads; this is useful
-                  following a fork.
+    :param reset: discards any jobs queued by other threads and recreates
+                  the notifier's poller; this is useful following a fork.
 
     This function must be called from the Python main thread.
 
@@ -112,6 +116,10 @@ def init(reset=False):
         signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    if reset:
+        # An epoll set is shared with the parent process after a fork, so
+        # the child needs its own.
+        notifier.set_poller()
     CoreThreading.init(signals, reset)
     signals['init'].emit()
     _initialized = True
@@ -169,7 +177,11 @@ def loop(condition, timeout=None):
         while condition() and not abort:
             try:
                 notifier.step()
-                signals['step'].emit()
+                stats = notifier.get_stats()
+                if stats:
+                    _emit_step(stats)
+                else:
+                    signals['step'].emit()
             except BaseException, e:
                 if signals['exception'].emit(*sys.exc_info()) != False:
                     # Either there are no global exception handlers, or none of
@@ -358,7 +370,73 @@ def step(*args, **kwargs):
         time.sleep(0.001)
         return
     notifier.step(*args, **kwargs)
-    signals['step'].emit()
+    stats = notifier.get_stats()
+    if stats:
+        _emit_step(stats)
+    else:
+        signals['step'].emit()
+
+
+def _emit_step(stats):
+    """
+    Emits the step signal, accounting the time spent in its callbacks to the
+    given main loop statistics.  Without statistics, the callers emit the
+    signal directly, which saves a function call per step.
+    """
+    t0 = notifier.monotonic()
+    try:
+        return signals['step'].emit()
+    finally:
+        stats.add_callback('step', signals['step'], notifier.monotonic() - t0)
+
+
+def enable_stats(slow_threshold=0.01, history=50, log_interval=None):
+    """
+    Start collecting main loop latency and utilization statistics.
+
+    :param slow_threshold: callbacks taking longer than this many seconds are
+                           remembered as slow callbacks
+    :type slow_threshold: float
+    :param history: the number of slow callbacks to remember
+    :type history: int
+    :param log_interval: if not None, a summary of the statistics is logged
+                         every *log_interval* seconds
+    :type log_interval: float
+    :returns: the :class:`~kaa.base.loopstats.LoopStats` object collecting
+              the statistics
+
+    The time the main loop waits for events and the execution time of timer,
+    I/O, thread callbacks and the step signal are recorded.  Collecting
+    statistics has a small cost for every callback, so it is disabled by
+    default.  If statistics are already enabled, they are reset.
+    """
+    global _stats_timer
+    disable_stats()
+    stats = LoopStats(slow_threshold, history)
+    notifier.set_stats(stats)
+    if log_interval:
+        _stats_timer = timer.Timer(lambda: log.info(stats.summary()))
+        _stats_timer.start(log_interval)
+    return stats
+
+
+def disable_stats():
+    """
+    Stop collecting main loop statistics.
+    """
+    global _stats_timer
+    notifier.set_stats(None)
+    if _stats_timer:
+        _stats_timer.stop()
+        _stats_timer = None
+
+
+def get_stats():
+    """
+    Returns the :class:`~kaa.base.loopstats.LoopStats` object if main loop
+    statistics are enabled, or None otherwise.
+    """
+    return notifier.get_stats()
 
 
 def is_initialized():
@@ -398,6 +476,9 @@ def is_stopped():
 wakeup = CoreThreading.wakeup
 is_mainthread = CoreThreading.is_mainthread
 set_as_mainthread = CoreThreading.set_as_mainthread
+# Select the notifier backend ('epoll' or 'select') used to wait for IO.
+set_poller = notifier.set_poller
+get_poller = notifier.get_poller
 
 
 def _set_running(status):
@@ -42,6 +42,7 @@ import socket
 import logging
 import kaa
 
+from kaa.io import WriteQueue
 from .common import TLSSocketBase
 
 import gnutls.connection
@@ -137,7 +138,7 @@ class GNUTLSSocket(TLSSocketBase):
         self._handshake = True
         # Store current write queue and create a new one
         self._pre_handshake_write_queue = self._write_queue
-        self._write_queue = []
+        self._write_queue = WriteQueue()
         if self._pre_handshake_write_queue:
             # flush pre handshake write data
             yield self._pre_handshake_write_queue[-1][1]
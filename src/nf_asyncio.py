@@ -0,0 +1,375 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# nf_asyncio.py - asyncio based notifier
+# -----------------------------------------------------------------------------
+# Use an asyncio event loop as the kaa notifier:
+#
+# import kaa.nf_asyncio
+# kaa.nf_asyncio.init()
+#
+# All IO monitors and timers are then registered with the asyncio loop, so
+# kaa and asyncio share a single selector.  Either kaa.main.run() or the
+# asyncio loop's run_forever()/run_until_complete() may be used to run the
+# loop.  to_future() and from_future() convert between InProgress objects and
+# asyncio futures, and kaa coroutines can yield asyncio futures.
+#
+# With Python 2, the trollius backport of asyncio is used.
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2012 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+__all__ = [ 'init', 'to_future', 'from_future' ]
+
+# python imports
+import sys
+import math
+import logging
+
+# asyncio is only available with Python 3.4 and later; with older versions
+# the trollius backport is needed.  ImportError is raised if neither is
+# installed, like kaa.reactor does when Twisted is missing.
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+# kaa imports
+from . import nf_wrapper as notifier
+from . import main
+from .coroutine import _yield_adapters
+from .core import CoreThreading
+from .async import InProgress
+from .errors import InProgressAborted
+
+# get logging object
+log = logging.getLogger('kaa.base.core.main')
+
+# The asyncio loop used as notifier, set by init()
+_loop = None
+# True while step() runs the asyncio loop on behalf of kaa.main.loop().
+_stepping = False
+# sys.exc_info() of an exception raised by a kaa callback during step()
+_exc_info = None
+# timer id -> asyncio TimerHandle
+_timers = {}
+_timer_id = 0
+# (condition, id) -> fd, needed to unregister sockets which are already closed
+_sockets = {}
+# Timer slack in milliseconds, see timer_slack()
+_timer_slack = 0
+# Main loop statistics, and the time the last kaa callback returned, since
+# which the loop is considered waiting.
+_stats = None
+_idle_since = None
+
+
+def _dispatch(callback, *args):
+    """
+    Invokes a kaa notifier callback from the asyncio loop.
+
+    When the loop is run by step(), the loop is stopped after the current
+    iteration so kaa.main.loop() gets to evaluate its condition, and any
+    exception is passed on to step() so that it reaches the kaa main loop
+    rather than the asyncio exception handler.
+    """
+    global _exc_info
+    if not _stepping:
+        return callback(*args)
+    _loop.stop()
+    try:
+        return callback(*args)
+    except BaseException:
+        if _exc_info is None:
+            _exc_info = sys.exc_info()
+
+
+def _invoke(category, callback, *args):
+    """
+    Invokes a kaa notifier callback with _dispatch(), recording statistics
+    if enabled.
+    """
+    global _idle_since
+    stats = _stats
+    if not stats:
+        return _dispatch(callback, *args)
+    t0 = notifier.monotonic()
+    if _idle_since is not None:
+        stats.add_wait(t0 - _idle_since)
+    try:
+        return _dispatch(callback, *args)
+    finally:
+        _idle_since = notifier.monotonic()
+        stats.add_callback(category, callback, _idle_since - t0)
+
+
+def _socket_callback(id, method, condition):
+    if not _invoke('io', method, id):
+        socket_remove(id, condition)
+
+
+def socket_add(id, method, condition = 0):
+    """
+    Monitors the given socket (an fd or object with fileno()) for reading
+    (condition 0) or writing (condition 1).
+    """
+    if condition > 1:
+        raise ValueError('asyncio notifier only supports read and write conditions')
+    fd = id if isinstance(id, (int, long)) else id.fileno()
+    if (condition, id) in _sockets:
+        socket_remove(id, condition)
+    _sockets[(condition, id)] = fd
+    if condition == 0:
+        _loop.add_reader(fd, _socket_callback, id, method, condition)
+    else:
+        _loop.add_writer(fd, _socket_callback, id, method, condition)
+
+
+def socket_remove(id, condition = 0):
+    fd = _sockets.pop((condition, id), None)
+    if fd is None:
+        return
+    if condition == 0:
+        _loop.remove_reader(fd)
+    else:
+        _loop.remove_writer(fd)
+
+
+def timer_add(interval, method):
+    """
+    Calls method after interval milliseconds, and again every interval
+    milliseconds as long as it returns True.  Returns the timer id.
+    """
+    global _timer_id
+    _timer_id += 1
+    id = _timer_id
+    interval /= 1000.0
+
+    def fire(deadline):
+        if not _invoke('timer', method):
+            _timers.pop(id, None)
+        elif id in _timers:
+            # Same rescheduling semantics as the generic notifier.
+            now = _loop.time()
+            deadline += interval
+            if interval and deadline <= now:
+                deadline += ((now - deadline) // interval + 1) * interval
+            _timers[id] = _loop.call_at(_delay(max(deadline, now)), fire, deadline)
+
+    deadline = _loop.time() + interval
+    _timers[id] = _loop.call_at(_delay(deadline), fire, deadline)
+    return id
+
+
+def _delay(when):
+    """
+    Returns the loop time a timer due at the given time is run at: rounded
+    up to a multiple of the timer slack, so that timers due within the same
+    period are run in one iteration of the asyncio loop.
+    """
+    if not _timer_slack:
+        return when
+    slack = _timer_slack / 1000.0
+    return math.ceil(when / slack) * slack
+
+
+def timer_remove(id):
+    handle = _timers.pop(id, None)
+    if handle:
+        handle.cancel()
+
+
+def timer_slack(slack = None):
+    """
+    Sets the number of milliseconds timers may fire late, like the generic
+    notifier.  If no slack is given, the current value is returned.
+    """
+    global _timer_slack
+    if slack is None:
+        return _timer_slack
+    if slack < 0:
+        raise ValueError('timer slack must not be negative')
+    _timer_slack = slack
+
+
+def set_stats(stats):
+    """
+    Sets the object collecting main loop statistics, or None to disable
+    collection.
+
+    The asyncio loop waits for events itself, so each kaa callback it
+    invokes counts as one step, and the time spent outside of kaa
+    callbacks (including asyncio callbacks) as waiting.
+    """
+    global _stats, _idle_since
+    _stats = stats
+    _idle_since = None
+
+
+def get_stats():
+    """
+    Returns the current statistics object or None.
+    """
+    return _stats
+
+
+def step(sleep = True, external = True, simulate = False):
+    """
+    Runs the asyncio loop until at least one kaa callback was invoked (or
+    for up to 30 seconds), or for a single iteration if sleep is False.
+    """
+    global _stepping, _exc_info
+    if _loop.is_running():
+        raise RuntimeError('kaa main loop cannot be stepped while asyncio loop is running')
+    timeout = None
+    if sleep:
+        timeout = _loop.call_later(30, _loop.stop)
+    else:
+        _loop.call_soon(_loop.stop)
+    _stepping = True
+    try:
+        _loop.run_forever()
+    finally:
+        _stepping = False
+        if timeout:
+            timeout.cancel()
+    if _exc_info:
+        tp, exc, tb = _exc_info
+        _exc_info = None
+        raise tp, exc, tb
+
+
+def shutdown():
+    if _loop.is_running() and not _stepping:
+        # The asyncio loop is driving kaa, so it needs to be stopped.
+        _loop.stop()
+        main._set_running(False)
+    else:
+        sys.exit(0)
+
+
+def to_future(inprogress):
+    """
+    Returns an asyncio Future that is done when the given InProgress is
+    finished.
+
+    Cancelling the Future aborts the InProgress, and an aborted InProgress
+    cancels the Future.
+    """
+    future = asyncio.Future(loop=_loop)
+
+    def finished(result):
+        if not future.done():
+            future.set_result(result)
+
+    def failed(tp, exc, tb):
+        if future.done():
+            return
+        if isinstance(exc, InProgressAborted):
+            future.cancel()
+        else:
+            future.set_exception(exc)
+        # The exception is handled by whoever awaits the future.
+        return False
+
+    def cancelled(future):
+        if future.cancelled() and not inprogress.finished and inprogress.abortable:
+            inprogress.abort()
+
+    inprogress.connect_both(finished, failed)
+    future.add_done_callback(cancelled)
+    return future
+
+
+def from_future(future):
+    """
+    Returns an InProgress that finishes when the given asyncio Future (or
+    awaitable, which is scheduled as a Task) is done.
+
+    Aborting the InProgress cancels the Future.
+    """
+    future = asyncio.ensure_future(future, loop=_loop)
+    inprogress = InProgress(abortable=True)
+
+    def done(future):
+        if inprogress.finished:
+            return
+        if future.cancelled():
+            exc = InProgressAborted('asyncio future cancelled', inprogress=inprogress)
+            _dispatch(inprogress.throw, InProgressAborted, exc, None)
+        elif future.exception() is not None:
+            exc = future.exception()
+            _dispatch(inprogress.throw, exc.__class__, exc, getattr(exc, '__traceback__', None))
+        else:
+            _dispatch(inprogress.finish, future.result())
+
+    future.add_done_callback(done)
+    inprogress.signals['abort'].connect(lambda exc: future.cancel())
+    return inprogress
+
+
+def _adapt_yielded(obj):
+    """
+    Converts asyncio futures (and tasks) yielded by kaa coroutines into
+    InProgress objects.
+
+    asyncio coroutine objects are not converted, since with Python 2 they
+    are plain generators, which kaa coroutines may well yield as result.
+    Wrap them with asyncio.ensure_future() or from_future() instead.
+    """
+    if isinstance(obj, asyncio.Future):
+        return from_future(obj)
+
+
+def init(loop = None):
+    """
+    Use the given asyncio loop (or the current event loop if None) as the
+    kaa notifier.
+
+    This must be called before any timers or IO monitors are created.
+    Afterwards kaa.main.run() runs the asyncio loop, or alternatively the
+    asyncio loop may be run directly, in which case kaa callbacks are
+    invoked from it.  kaa.main.loop() and InProgress.wait() cannot be used
+    from within callbacks in the latter case; wait for the future returned
+    by to_future() instead.
+    """
+    global _loop
+    _loop = loop or asyncio.get_event_loop()
+    # Keep the timer slack and statistics set up before.
+    timer_slack(notifier.timer_slack())
+    set_stats(notifier.get_stats())
+    notifier.socket_add = socket_add
+    notifier.socket_remove = socket_remove
+    notifier.timer_add = timer_add
+    notifier.timer_remove = timer_remove
+    notifier.timer_slack = timer_slack
+    notifier.set_stats = set_stats
+    notifier.get_stats = get_stats
+    notifier.step = step
+    notifier.shutdown = shutdown
+    notifier.loaded = 'asyncio'
+    if _adapt_yielded not in _yield_adapters:
+        _yield_adapters.append(_adapt_yielded)
+    # Recreate the thread and signal wakeup fds with the asyncio loop, and
+    # treat the thread running the asyncio loop as kaa main thread.
+    main.init()
+    CoreThreading.set_as_mainthread()
+    return _loop
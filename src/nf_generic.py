@@ -31,10 +31,59 @@ from select import error as select_error
 from time import time, sleep as time_sleep
 import errno, os, sys
 import socket
+import fcntl
+from heapq import heappush, heappop, heapify
+
+try:
+    from select import epoll, EPOLLIN, EPOLLOUT, EPOLLPRI, EPOLLERR, EPOLLHUP
+except ImportError:
+    # Not Linux, or Python too old.  Only the select poller is available.
+    epoll = None
 
 # get logging object
 log = logging.getLogger('kaa.base.core.main')
 
+def _get_monotonic_clock():
+    """Returns a function returning the time in seconds (as float) from a
+    clock that is not affected by changes of the system time.  Falls back to
+    time() if no such clock is available."""
+    try:
+        from time import monotonic
+        return monotonic
+    except ImportError:
+        pass
+    if sys.platform.startswith( 'linux' ):
+        try:
+            import ctypes, ctypes.util, threading
+            class timespec( ctypes.Structure ):
+                _fields_ = [ ( 'tv_sec', ctypes.c_long ), ( 'tv_nsec', ctypes.c_long ) ]
+            # clock_gettime() doesn't block, so it is called without releasing
+            # the GIL, which is cheaper.
+            librt = ctypes.PyDLL( ctypes.util.find_library( 'rt' ) or 'librt.so.1', use_errno = True )
+            clock_gettime = librt.clock_gettime
+            CLOCK_MONOTONIC = 1
+            if clock_gettime( CLOCK_MONOTONIC, ctypes.byref( timespec() ) ) == 0:
+                # Each thread reads the clock into its own timespec, which is
+                # allocated once.
+                local = threading.local()
+                def monotonic():
+                    try:
+                        ts, ref = local.timespec
+                    except AttributeError:
+                        ts = timespec()
+                        ref = ctypes.byref( ts )
+                        local.timespec = ts, ref
+                    clock_gettime( CLOCK_MONOTONIC, ref )
+                    return ts.tv_sec + ts.tv_nsec * 1e-9
+                return monotonic
+        except ( ImportError, OSError, AttributeError ):
+            pass
+    log.warning( 'no monotonic clock available, timers depend on the system time' )
+    return time
+
+#: Time in seconds from a monotonic clock, used for all timers.
+monotonic = _get_monotonic_clock()
+
 IO_READ = 1
 IO_WRITE = 2
 IO_EXCEPT = 4
@@ -45,10 +94,291 @@ __sockets[ IO_READ ] = {}
 __sockets[ IO_WRITE ] = {}
 __sockets[ IO_EXCEPT ] = {}
 __timers = {}
+# Heap of ( timestamp, id ) tuples ordered by expiry.  Removed or rescheduled
+# timers are not taken out of the heap but skipped when they reach the top
+# (see _timer_current).
+__timer_heap = []
 __timer_id = 0
+__timer_slack = 0
 __min_timer = None
+__stats = None
 __step_depth = 0
 __step_depth_max = 5
+__poller = None
+
+
+def _get_fd( id ):
+    """Returns the file descriptor number for the given socket id, which is
+    either an int or an object with a fileno() method."""
+    if isinstance( id, ( int, long ) ):
+        return id
+    return id.fileno()
+
+
+class SelectPoller( object ):
+    """Poller backend based on select(2).  The fd lists are rebuilt from the
+    registered sockets on every call to poll(), so the cost of a step grows
+    with the number of registered sockets, and file descriptors above
+    FD_SETSIZE cannot be monitored.  This is the fallback backend if epoll
+    is not available."""
+    name = 'select'
+
+    def __init__( self, sockets ):
+        self._sockets = sockets
+
+    def register( self, id, condition ):
+        pass
+
+    def unregister( self, id, condition ):
+        pass
+
+    def poll( self, timeout ):
+        return select( self._sockets[ IO_READ ].keys(), self._sockets[ IO_WRITE ].keys(),
+                       self._sockets[ IO_EXCEPT ].keys(), timeout )
+
+    def close( self ):
+        pass
+
+
+class EpollPoller( object ):
+    """Poller backend based on epoll(7).  The kernel keeps the set of
+    monitored file descriptors, which is updated incrementally by socket_add()
+    and socket_remove(), so the cost of a step depends only on the number of
+    file descriptors that are ready.
+
+    Write monitors are usually registered for a single step, until queued
+    data is written, and modifying the epoll set for them twice per write
+    would cost two system calls each time.  Instead the file descriptors
+    waiting to be writable are passed to select(2) together with the epoll
+    file descriptor, which becomes readable when epoll has events."""
+    name = 'epoll'
+
+    # Events requested for each condition.
+    MASKS = { IO_READ: EPOLLIN, IO_WRITE: EPOLLOUT, IO_EXCEPT: EPOLLPRI } if epoll else {}
+    # Events that mark a condition as ready.  select(2) reports errors and
+    # hangups as readable and writable, so we do the same.
+    READ_EVENTS = EPOLLIN | EPOLLERR | EPOLLHUP if epoll else 0
+    WRITE_EVENTS = EPOLLOUT | EPOLLERR | EPOLLHUP if epoll else 0
+    EXCEPT_EVENTS = EPOLLPRI if epoll else 0
+    # File descriptors from this one on can't be passed to select(2)
+    # (FD_SETSIZE), so write monitors for them are added to the epoll set.
+    SELECT_FD_MAX = 1024
+
+    def __init__( self, sockets ):
+        self._open()
+        # fd -> { condition: id }
+        self._fds = {}
+        # fd -> event mask registered with the kernel
+        self._masks = {}
+        # condition -> { id: fd }, needed to unregister ids whose file
+        # descriptor was already closed.
+        self._ids = { IO_READ: {}, IO_WRITE: {}, IO_EXCEPT: {} }
+        # fds epoll refuses to monitor (regular files), which select(2)
+        # reports as always readable and writable.
+        self._unpollable = set()
+        # fds with a write monitor, which are passed to select(2) rather
+        # than added to the epoll set.
+        self._writers = set()
+        for condition, ids in sockets.items():
+            for id in ids:
+                self.register( id, condition )
+
+    def _open( self ):
+        self._epoll = epoll()
+        self._pid = os.getpid()
+        flags = fcntl.fcntl( self._epoll.fileno(), fcntl.F_GETFD )
+        fcntl.fcntl( self._epoll.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC )
+
+    def _reopen( self ):
+        """After a fork, the epoll set is shared with the parent process, so
+        a child must not touch it but create its own with the registered fds,
+        no matter whether the fork went through kaa.utils.fork().  The pid is
+        compared inline by the callers, which run several times per step."""
+        self._epoll.close()
+        self._open()
+        self._unpollable.clear()
+        self._masks.clear()
+        for fd in self._fds.keys():
+            try:
+                self._update( fd )
+            except ( IOError, OSError ):
+                log.warning( 'unable to monitor closed fd %d after fork', fd )
+
+    def register( self, id, condition ):
+        if self._pid != os.getpid():
+            self._reopen()
+        try:
+            fd = _get_fd( id )
+        except ( socket.error, ValueError, IOError, OSError ):
+            log.warning( 'unable to monitor closed socket %s', id )
+            return
+        ids = self._ids[ condition ]
+        if id in ids:
+            if ids[ id ] == fd and self._fds[ fd ].get( condition ) is id:
+                # Already monitored.
+                return
+            self.unregister( id, condition )
+        ids[ id ] = fd
+        entry = self._fds.get( fd )
+        if entry is None:
+            entry = self._fds[ fd ] = {}
+        entry[ condition ] = id
+        self._update( fd )
+
+    def unregister( self, id, condition ):
+        if self._pid != os.getpid():
+            self._reopen()
+        fd = self._ids[ condition ].pop( id, None )
+        entry = self._fds.get( fd )
+        if entry is None or entry.get( condition ) != id:
+            return
+        del entry[ condition ]
+        self._update( fd )
+
+    def _update( self, fd ):
+        """Synchronizes the kernel event mask for fd with our own state."""
+        entry = self._fds[ fd ]
+        if not entry:
+            del self._fds[ fd ]
+            self._writers.discard( fd )
+            if fd in self._unpollable:
+                self._unpollable.discard( fd )
+                return
+            self._masks.pop( fd, None )
+            try:
+                self._epoll.unregister( fd )
+            except ( IOError, OSError, ValueError ):
+                # fd was closed already, in which case the kernel dropped it
+                # from the epoll set by itself.
+                pass
+            return
+        if fd in self._unpollable:
+            return
+        mask = 0
+        for condition in entry:
+            mask |= self.MASKS[ condition ]
+        if mask & EPOLLOUT and fd < self.SELECT_FD_MAX:
+            self._writers.add( fd )
+            mask &= ~EPOLLOUT
+        else:
+            self._writers.discard( fd )
+        registered = self._masks.get( fd, 0 )
+        if mask == registered:
+            return
+        if not mask:
+            # Only a write monitor is left.
+            del self._masks[ fd ]
+            try:
+                self._epoll.unregister( fd )
+            except ( IOError, OSError, ValueError ):
+                pass
+            return
+        self._masks[ fd ] = mask
+        try:
+            if registered:
+                self._epoll.modify( fd, mask )
+            else:
+                self._epoll.register( fd, mask )
+        except ( IOError, OSError ), e:
+            if e.errno == errno.EPERM:
+                # Regular files and directories can't be monitored by epoll.
+                del self._masks[ fd ]
+                self._unpollable.add( fd )
+                self._writers.discard( fd )
+            elif e.errno == errno.ENOENT:
+                # fd was closed and reopened under the same number without
+                # being removed first.
+                self._epoll.register( fd, mask )
+            elif e.errno == errno.EEXIST:
+                # A stale registration for a closed fd whose number was reused.
+                self._epoll.modify( fd, mask )
+            else:
+                del self._masks[ fd ]
+                raise
+
+    def poll( self, timeout ):
+        if self._pid != os.getpid():
+            self._reopen()
+        read, write, exc = ready = ( [], [], [] )
+        if self._unpollable:
+            timeout = 0
+        fds, writers = self._fds, self._writers
+        if writers:
+            events = self._poll_writers( timeout, write )
+        else:
+            events = self._epoll.poll( timeout )
+        for fd, events in events:
+            entry = fds.get( fd )
+            if not entry:
+                continue
+            if events & self.READ_EVENTS and IO_READ in entry:
+                read.append( entry[ IO_READ ] )
+            if events & self.WRITE_EVENTS and IO_WRITE in entry and fd not in writers:
+                write.append( entry[ IO_WRITE ] )
+            if events & self.EXCEPT_EVENTS and IO_EXCEPT in entry:
+                exc.append( entry[ IO_EXCEPT ] )
+        for fd in self._unpollable:
+            entry = fds[ fd ]
+            if IO_READ in entry:
+                read.append( entry[ IO_READ ] )
+            if IO_WRITE in entry:
+                write.append( entry[ IO_WRITE ] )
+        return ready
+
+    def _poll_writers( self, timeout, write ):
+        """Waits with select(2) for the fds with a write monitor to become
+        writable or for epoll events, appends the ids of writable fds to
+        write and returns the epoll events."""
+        epfd = self._epoll.fileno()
+        try:
+            readable, writable = select( [ epfd ], list( self._writers ), [], timeout )[ :2 ]
+        except select_error, e:
+            if e.args[ 0 ] != errno.EBADF:
+                raise
+            # An fd was closed without removing its write monitor.  It is
+            # reported as writable once, like a hangup by epoll, so that the
+            # error is seen by whoever writes to it.
+            closed = []
+            for fd in self._writers:
+                try:
+                    os.fstat( fd )
+                except OSError:
+                    closed.append( fd )
+            if not closed:
+                raise
+            self._writers.difference_update( closed )
+            readable, writable = [ epfd ], closed
+        for fd in writable:
+            write.append( self._fds[ fd ][ IO_WRITE ] )
+        return self._epoll.poll( 0 ) if readable else ()
+
+    def close( self ):
+        self._epoll.close()
+
+
+POLLERS = { SelectPoller.name: SelectPoller, EpollPoller.name: EpollPoller }
+
+
+def set_poller( name = None ):
+    """Sets the backend used by step() to wait for activity on the registered
+    sockets.  Valid names are 'epoll' and 'select'.  If no name is given the
+    current backend is recreated, or the best available one is chosen if none
+    was set before."""
+    global __poller
+    if name is None:
+        name = __poller.name if __poller else ( 'epoll' if epoll else 'select' )
+    if name == 'epoll' and not epoll:
+        raise ValueError( 'epoll poller is not available on this system' )
+    if name not in POLLERS:
+        raise ValueError( 'unknown poller %s' % name )
+    if __poller:
+        __poller.close()
+    __poller = POLLERS[ name ]( __sockets )
+
+def get_poller():
+    """Returns the name of the current poller backend."""
+    return __poller.name
+
 
 def socket_add( id, method, condition = IO_READ ):
     """The first argument specifies a socket, the second argument has to be a
@@ -56,6 +386,7 @@ def socket_add( id, method, condition = IO_READ ):
     The callback function gets the socket back as only argument."""
     global __sockets
     __sockets[ condition ][ id ] = method
+    __poller.register( id, condition )
 
 def socket_remove( id, condition = IO_READ ):
     """Removes the given socket from scheduler. If no condition is specified the
@@ -63,6 +394,20 @@ def socket_remove( id, condition = IO_READ ):
     global __sockets
     if id in __sockets[ condition ]:
         del __sockets[ condition ][ id ]
+        __poller.unregister( id, condition )
+
+def set_stats( stats ):
+    """Sets the object that collects main loop statistics (see
+    kaa.base.loopstats.LoopStats), or None to disable collection.  The object's
+    add_wait() method is called with the time spent waiting for events in each
+    step, and add_callback() with the category ('timer' or 'io'), callback and
+    execution time of every callback invoked by step()."""
+    global __stats
+    __stats = stats
+
+def get_stats():
+    """Returns the current statistics object or None."""
+    return __stats
 
 def timer_add( interval, method ):
     """The first argument specifies an interval in milliseconds, the second
@@ -71,14 +416,16 @@ def timer_add( interval, method ):
     seconds, otherwise it is removed from the scheduler. The third
     (optional) argument is a parameter given to the called
     function. This function returns an unique identifer which can be
-    used to remove this timer"""
+    used to remove this timer.  The interval may be a float to express
+    fractions of a millisecond; timers run on a monotonic clock."""
     global __timer_id
     try:
         __timer_id += 1
     except OverflowError:
         __timer_id = 0
-    __timers[ __timer_id ] = \
-    [ interval, int( time() * 1000 ) + interval, method ]
+    timestamp = monotonic() * 1000 + interval
+    __timers[ __timer_id ] = [ interval, timestamp, method ]
+    _timer_push( timestamp, __timer_id )
     return __timer_id
 
 def timer_remove( id ):
@@ -86,6 +433,38 @@ def timer_remove( id ):
     if id in __timers:
         del __timers[ id ]
 
+def timer_slack( slack = None ):
+    """Sets the slack in milliseconds by which timers may be delayed so that
+    timers expiring close to each other are handled in a single wakeup of
+    the main loop instead of one wakeup each.  Timers never fire early.  If
+    no slack is given, the current value is returned."""
+    global __timer_slack
+    if slack is None:
+        return __timer_slack
+    if slack < 0:
+        raise ValueError( 'timer slack must not be negative' )
+    __timer_slack = slack
+
+def _timer_push( timestamp, id ):
+    """Schedules the timer with the given id in the timer heap.  Stale entries
+    left behind by timer_remove() are purged once they outnumber the active
+    timers, so the heap size stays bounded by the number of timers."""
+    global __timer_heap
+    if len( __timer_heap ) > 2 * len( __timers ) + 1024:
+        __timer_heap = [ ( timer[ TIMESTAMP ], i ) for i, timer in __timers.items()
+                         if timer[ TIMESTAMP ] ]
+        heapify( __timer_heap )
+    else:
+        heappush( __timer_heap, ( timestamp, id ) )
+
+def _timer_current( item ):
+    """Returns the timer for the given heap item, or None if the item is stale
+    because the timer was removed or rescheduled since it was pushed."""
+    timestamp, id = item
+    timer = __timers.get( id )
+    if timer is not None and timer[ TIMESTAMP ] == timestamp:
+        return timer
+
 def step( sleep = True, external = True, simulate = False ):
     """Do one step forward in the main loop. First all timers are checked for
     expiration and if necessary the accociated callback function is called.
@@ -106,29 +485,37 @@ def step( sleep = True, external = True, simulate = False ):
         if not sleep:
             timeout = 0
         else:
-            now = int( time() * 1000 )
-            for interval, timestamp, callback in __timers.values():
-                if not timestamp:
-                    # timer is blocked (recursion), ignore it
-                    continue
-                nextCall = timestamp - now
-                if timeout == None or nextCall < timeout:
-                    if nextCall > 0:
-                        timeout = nextCall
+            # Drop stale entries until the top of the heap is the next timer
+            # to expire.  Timers blocked by recursion (timestamp 0) are not in
+            # the heap while their callback runs.
+            # The current entry is pushed back rather than peeked at, as
+            # timer_add() may be called from the main thread while the
+            # thread notifier is running a simulated step.
+            while __timer_heap:
+                item = heappop( __timer_heap )
+                if _timer_current( item ):
+                    heappush( __timer_heap, item )
+                    timeout = item[ 0 ] - monotonic() * 1000
+                    if timeout > 0:
+                        # Sleep a little longer to catch more timers with the
+                        # same wakeup.
+                        timeout += __timer_slack
                     else:
                         timeout = 0
-                        break
+                    break
             if timeout == None:
                 # No timers, timeout could be infinity.
                 timeout = 30000
             if __min_timer and __min_timer < timeout: timeout = __min_timer
         # wait for event
+        stats = __stats
+        if stats:
+            t0 = monotonic()
         sockets_ready = None
         if __sockets[ IO_READ ] or __sockets[ IO_WRITE ] or __sockets[ IO_EXCEPT ]:
             try:
-                sockets_ready = select( __sockets[ IO_READ ].keys(), __sockets[ IO_WRITE ].keys(),
-                                        __sockets[ IO_EXCEPT ].keys(), timeout / 1000.0 )
-            except select_error, e:
+                sockets_ready = __poller.poll( timeout / 1000.0 )
+            except ( select_error, IOError, OSError ), e:
                 if e.args[ 0 ] != errno.EINTR:
                     raise e
         elif timeout:
@@ -136,31 +523,53 @@ def step( sleep = True, external = True, simulate = False ):
         if simulate:
             # we only simulate
             return
-        # handle timers
-        for i, timer in __timers.items():
-            timestamp = timer[ TIMESTAMP ]
-            if not timestamp or i not in __timers:
-                # timer was unregistered by previous timer, or would
-                # recurse, ignore this timer
+        # handle timers; the clock is read once for all of them, and only
+        # if it is needed.
+        now = None
+        if stats:
+            now = monotonic()
+            stats.add_wait( now - t0 )
+            now *= 1000
+        elif __timer_heap:
+            now = monotonic() * 1000
+        # Collect all expired timers first, so that timers added or
+        # rescheduled by the callbacks below only fire on the next step.
+        expired = []
+        while __timer_heap and __timer_heap[ 0 ][ 0 ] <= now:
+            expired.append( heappop( __timer_heap ) )
+        for item in expired:
+            timer = _timer_current( item )
+            if not timer:
+                # timer was unregistered or rescheduled by a previous timer,
+                # or would recurse, ignore this timer
                 continue
-            now = int( time() * 1000 )
-            if timestamp <= now:
-                # Update timestamp on timer before calling the callback to
-                # prevent infinite recursion in case the callback calls
-                # step().
-                timer[ TIMESTAMP ] = 0
-                if not timer[ CALLBACK ]():
-                    if i in __timers:
-                        del __timers[ i ]
-                else:
-                    # Find a moment in the future. If interval is 0, we
-                    # just reuse the old timestamp, doesn't matter.
-                    if timer[ INTERVAL ]:
-                        now = int( time() * 1000 )
-                        timestamp += timer[ INTERVAL ]
-                        while timestamp <= now:
-                            timestamp += timer[ INTERVAL ]
-                    timer[ TIMESTAMP ] = timestamp
+            timestamp, i = item
+            # Update timestamp on timer before calling the callback to
+            # prevent infinite recursion in case the callback calls
+            # step().
+            timer[ TIMESTAMP ] = 0
+            if stats:
+                t0 = monotonic()
+                ret = timer[ CALLBACK ]()
+                stats.add_callback( 'timer', timer[ CALLBACK ], monotonic() - t0 )
+            else:
+                ret = timer[ CALLBACK ]()
+            if not ret:
+                if i in __timers:
+                    del __timers[ i ]
+            elif __timers.get( i ) is timer:
+                # Find a moment in the future. If interval is 0, we
+                # just reuse the old timestamp, doesn't matter.
+                interval = timer[ INTERVAL ]
+                if interval:
+                    # now is from before the callbacks ran.  If they took
+                    # longer than the interval, the timer fires again on the
+                    # next step, which skips the ticks missed meanwhile.
+                    timestamp += interval
+                    if timestamp <= now:
+                        timestamp += ( ( now - timestamp ) // interval + 1 ) * interval
+                timer[ TIMESTAMP ] = timestamp
+                _timer_push( timestamp, i )
         # handle sockets
         if sockets_ready:
             for condition, sockets in zip((IO_READ, IO_WRITE, IO_EXCEPT), sockets_ready):
@@ -181,7 +590,18 @@ def step( sleep = True, external = True, simulate = False ):
                     # list and therefore sock is not in __sockets[ condition ]
                     # anymore.
                     callback = __sockets[ condition ].get(sock)
-                    if callback is not None and not callback( sock ):
+                    if callback is None:
+                        continue
+                    if stats:
+                        t0 = monotonic()
+                        ret = callback( sock )
+                        stats.add_callback( 'io', callback, monotonic() - t0 )
+                    else:
+                        ret = callback( sock )
+                    if not ret:
                         socket_remove( sock, condition )
     finally:
         __step_depth -= 1
+
+
+set_poller()
@@ -98,7 +98,13 @@ class WeakNotifierCallback(WeakCallable, NotifierCallback):
 
 timer_remove = nf_generic.timer_remove
 timer_add = nf_generic.timer_add
+timer_slack = nf_generic.timer_slack
+monotonic = nf_generic.monotonic
 step = nf_generic.step
+set_poller = nf_generic.set_poller
+get_poller = nf_generic.get_poller
+set_stats = nf_generic.set_stats
+get_stats = nf_generic.get_stats
 
 def shutdown():
     # prefered way to shut down the system
@@ -92,7 +92,7 @@
 # -----------------------------------------------------------------------------
 from __future__ import absolute_import
 
-__all__ = [ 'Server', 'Client', 'expose' ]
+__all__ = [ 'Server', 'Client', 'ClientPool', 'Stats', 'expose', 'register_codec' ]
 
 # python imports
 import types
@@ -100,28 +100,209 @@ import socket
 import logging
 import cPickle
 import pickle
+import marshal
+import zlib
 import struct
+import re
 import sys
 import hashlib
 import time
 import traceback
 import os
+import collections
+import functools
+import weakref
+import binascii
 
 # kaa imports
 import kaa
 from .strutils import py3_b, bl
 from .core import Object, CoreThreading
-from .errors import make_exception_class, AsyncExceptionBase
+from .errors import make_exception_class, AsyncExceptionBase, InProgressAborted, TimeoutException
 from .main import is_shutting_down
+from . import nf_wrapper as notifier
+from .loopstats import Histogram
 
 # get logging object
 log = logging.getLogger('kaa.base.rpc')
 
 # Global constants
-RPC_PACKET_HEADER_SIZE = struct.calcsize("I4sI")
+RPC_PACKET_HEADER = struct.Struct("I4sI")
+RPC_PACKET_HEADER_SIZE = RPC_PACKET_HEADER.size
 # Protocol compatible between Python 2 and 3.  (Well, quasi-compatible, there
 # are some issues due to the str/unicode changes in 3.)
 PICKLE_PROTOCOL = 2
+# Payloads larger than this are not concatenated with the packet header but
+# written as separate buffers, on sockets supporting vectored writes.
+RPC_PACKET_COPY_MAX = 64 * 1024
+# Iterators and files returned by functions exposed with stream=True are
+# streamed in items of (for files) this size.  The stream pauses while more
+# than RPC_STREAM_WINDOW bytes are waiting to be written to the socket, or
+# haven't been read by the receiver yet.
+RPC_STREAM_CHUNK_SIZE = 64 * 1024
+RPC_STREAM_WINDOW = 512 * 1024
+# Auth packets carry a 60 byte challenge/response/salt block, optionally
+# followed by up to this many bytes of handshake options.
+RPC_AUTH_OPTIONS_MAX = 256
+# If compression is negotiated, payloads of at least this size are
+# compressed once authentication is complete.  Compressed packets are flagged
+# by the high bit of the payload length in the packet header.  Payloads
+# larger than RPC_DECOMPRESS_MAX are sent uncompressed, and compressed
+# packets decompressing to more than that are refused.
+RPC_COMPRESS_THRESHOLD = 4096
+RPC_DECOMPRESS_MAX = 64 * 1024 * 1024
+RPC_PACKET_COMPRESSED = 0x80000000
+# Clients with pipelining enabled send up to this many bytes of calls before
+# authentication completes.
+RPC_PIPELINE_MAX = 8 * 1024
+# Servers keep at most RPC_TICKETS_MAX unused session tickets, and clients
+# keep RPC_CLIENT_TICKETS tickets per server.
+RPC_TICKETS_MAX = 1024
+RPC_CLIENT_TICKETS = 8
+RPC_AUTH_PACKETS = (bl('AUTH'), bl('RESP'), bl('RSUM'))
+# Protocol extensions that are only used if both peers agreed on them during
+# authentication:
+#   stream: streamed results (STRM, ITEM, SEND and SACK packets, and CNCL
+#           packets cancelling streams)
+#   batch:  batched calls (BTCH and BRTN packets)
+#   deadline: call deadlines (CALL payloads with a fourth item) and CNCL
+#           packets cancelling calls
+RPC_FEATURES = ('stream', 'batch', 'deadline')
+
+# Session tickets received from servers, by (address, secret): a deque of
+# (ticket, expiry time, codec, compressor, features)
+_session_tickets = {}
+
+
+class Codec(object):
+    """
+    Serializer for RPC payloads.
+
+    Codecs other than pickle may not be able to serialize all objects
+    (e.g. exceptions or class instances).  Their payloads are prefixed with
+    a tag byte, and objects they can't serialize are pickled instead.
+    """
+    def __init__(self, name, dumps, loads, fallback=True):
+        self.name = name
+        if fallback:
+            self.dumps = lambda obj: self._dumps_fallback(dumps, obj)
+            self.loads = lambda data: self._loads_fallback(loads, data)
+        else:
+            self.dumps = dumps
+            self.loads = loads
+
+
+    def _dumps_fallback(self, dumps, obj):
+        try:
+            return bl('C') + dumps(obj)
+        except (ValueError, TypeError):
+            return bl('P') + cPickle.dumps(obj, PICKLE_PROTOCOL)
+
+
+    def _loads_fallback(self, loads, data):
+        if data[:1] == bl('P'):
+            return cPickle.loads(data[1:])
+        return loads(data[1:])
+
+
+    def __repr__(self):
+        return '<kaa.rpc.Codec %s>' % self.name
+
+
+# Registered codecs, by name.
+CODECS = {}
+
+def register_codec(name, dumps, loads):
+    """
+    Registers a codec that can be negotiated by RPC channels.
+
+    :param name: the name of the codec, which is passed to the *codecs*
+                 argument of :class:`~kaa.rpc.Server` and
+                 :class:`~kaa.rpc.Client`.
+    :param dumps: callable serializing an object to a string; it must
+                  raise ValueError or TypeError for unsupported objects,
+                  which are then pickled.
+    :param loads: callable deserializing a string returned by dumps.
+    """
+    if not re.match(r'^[a-z0-9_]+$', name):
+        raise ValueError('Invalid codec name %r' % name)
+    CODECS[name] = Codec(name, dumps, loads)
+
+
+# Pickle is the default and is understood by all peers, so its payloads are
+# not tagged.
+CODECS['pickle'] = Codec('pickle', functools.partial(cPickle.dumps, protocol=PICKLE_PROTOCOL), cPickle.loads,
+                         fallback=False)
+# Fast compact binary codec for plain types (None, bool, numbers, strings,
+# and tuples, lists, dicts and sets thereof).  Subclasses of these types are
+# rejected by marshal and thus pickled, except for str and unicode: those
+# are marshalled as str, like other objects supporting the buffer interface
+# (buffer, bytearray, array.array).  See doc/rpc.rst.  Checking payloads for
+# these types up front would make the codec slower than pickle.
+register_codec('marshal', lambda obj: marshal.dumps(obj, 2), marshal.loads)
+try:
+    import msgpack
+except ImportError:
+    pass
+else:
+    # Note that msgpack is lossy, see doc/rpc.rst.
+    register_codec('msgpack', msgpack.dumps, msgpack.loads)
+
+
+def _zlib_decompress(data, max_len):
+    """
+    Decompresses data, raising ValueError if the result would be larger than
+    max_len bytes, without decompressing more than that.
+    """
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(data, max_len)
+    if decompressor.unconsumed_tail:
+        raise ValueError('decompressed payload larger than %d bytes' % max_len)
+    return data
+
+
+# Payload compressors that can be negotiated, by name: (compress, decompress),
+# where decompress takes the maximum size of the result.  zlib_fast trades
+# compression ratio for speed, which is preferable for fast (e.g. local) links.
+COMPRESSORS = {
+    'zlib': (lambda data: zlib.compress(data, 6), _zlib_decompress),
+    'zlib_fast': (lambda data: zlib.compress(data, 1), _zlib_decompress)
+}
+
+
+def _check_codecs(codecs, registry=CODECS):
+    """
+    Raises ValueError if any of the given codec names is not registered.
+    """
+    for name in codecs or []:
+        if name not in registry:
+            raise ValueError('Unknown rpc codec %s' % name)
+    return codecs
+
+
+def _pack_auth_options(options):
+    """
+    Encodes a dict of handshake options to be appended to an auth packet.
+    """
+    return py3_b(';'.join('%s=%s' % item for item in sorted(options.items())))
+
+
+def _unpack_auth_options(data):
+    """
+    Decodes handshake options from an auth packet.  The data is untrusted,
+    so anything unexpected raises ValueError.
+    """
+    if len(data) > RPC_AUTH_OPTIONS_MAX:
+        raise ValueError('auth options too long')
+    options = {}
+    if not data:
+        return options
+    for item in data.decode('ascii').split(';'):
+        if not re.match(r'^[a-z_]+=[a-zA-Z0-9_,.-]*$', item):
+            raise ValueError('malformed auth option')
+        key, value = item.split('=', 1)
+        options[str(key)] = str(value)
+    return options
 
 
 class RemoteException(AsyncExceptionBase):
@@ -147,6 +328,389 @@ class NotConnectedError(Exception):
     """
     pass
 
+class TooManyCallsError(Exception):
+    """
+    Raised when a call is made on a channel whose max_in_flight calls are
+    outstanding and whose queue of max_queued calls is full.
+    """
+    pass
+
+
+class Stream(object):
+    """
+    Items streamed from a remote function.
+
+    If a function exposed with ``stream=True`` returns an iterator (e.g. a
+    generator) or a file object, the items (or for files, chunks of data)
+    are sent to the caller one by one rather than as one large payload, and
+    the InProgress returned by :meth:`~kaa.rpc.Channel.rpc` is finished with
+    a Stream object as soon as the first packet arrives.  Items are received
+    with :meth:`read`::
+
+        stream = yield client.rpc('get_file')
+        while True:
+            data = yield stream.read()
+            if data is None:
+                break
+
+    The remote function is paused while RPC_STREAM_WINDOW bytes of items
+    have been received but not read yet.  If the items are no longer
+    needed, call :meth:`close`, which stops the remote function.
+    """
+    def __init__(self, cmd, channel, seq):
+        self.cmd = cmd
+        self._channel = channel
+        self._seq = seq
+        # (item, payload size)
+        self._items = collections.deque()
+        # InProgress objects waiting for the next item
+        self._waiting = collections.deque()
+        self._ended = False
+        self._exc_info = None
+        # Payload bytes read but not yet acknowledged to the sender
+        self._consumed = 0
+
+
+    @property
+    def finished(self):
+        """
+        True if the remote end finished the stream and all items were read.
+        """
+        return (self._ended or self._exc_info is not None) and not self._items
+
+
+    def read(self):
+        """
+        Reads the next item from the stream.
+
+        :returns: :class:`~kaa.InProgress` finished with the next item, or
+                  with None when the stream has ended.  If the remote
+                  function raised an exception while iterating, or the
+                  channel was closed, it is raised here.
+        """
+        ip = kaa.InProgress()
+        if self._items:
+            item, size = self._items.popleft()
+            self._ack(size)
+            ip.finish(item)
+        elif self._exc_info:
+            ip.throw(*self._exc_info)
+        elif self._ended:
+            ip.finish(None)
+        else:
+            self._waiting.append(ip)
+        return ip
+
+
+    def close(self):
+        """
+        Stops receiving items.  The remote function is stopped (generators
+        are closed) and items not read yet are discarded.  Pending and
+        future reads are finished with None.
+        """
+        if self._ended or self._exc_info:
+            return
+        self._items.clear()
+        if self._channel._rpc_streams.pop(self._seq, None) is self and self._channel.connected:
+            self._channel._send_packet(self._seq, 'CNCL', '')
+        self._end()
+
+
+    def _ack(self, size):
+        """
+        Tells the sender once a good part of its window was read, so that
+        it continues.
+        """
+        self._consumed += size
+        if self._consumed >= RPC_STREAM_WINDOW / 2 and not self._ended and self._channel.connected:
+            self._channel._send_packet(self._seq, 'SACK', struct.pack('I', self._consumed))
+            self._consumed = 0
+
+
+    def _push(self, item, size):
+        if self._waiting:
+            self._ack(size)
+            self._waiting.popleft().finish(item)
+        else:
+            self._items.append((item, size))
+
+
+    def _end(self):
+        self._ended = True
+        while self._waiting:
+            self._waiting.popleft().finish(None)
+
+
+    def _throw(self, tp, exc, tb):
+        self._exc_info = tp, exc, tb
+        while self._waiting:
+            self._waiting.popleft().throw(tp, exc, tb)
+
+
+    def __repr__(self):
+        return '<kaa.rpc.Stream %s>' % self.cmd
+
+
+
+class _StreamCredit(object):
+    """
+    Flow control state of a stream being sent: the payload bytes the
+    receiver hasn't acknowledged yet, and whether it cancelled the stream.
+    """
+    def __init__(self):
+        self.unacked = 0
+        self.cancelled = False
+        self._waiting = None
+
+
+    def wait(self):
+        """
+        Returns an InProgress finished once the receiver acknowledged
+        enough data or cancelled the stream.
+        """
+        self._waiting = kaa.InProgress()
+        return self._waiting
+
+
+    def ack(self, size):
+        self.unacked -= size
+        if self._waiting and self.unacked <= RPC_STREAM_WINDOW:
+            self._waiting, ip = None, self._waiting
+            ip.finish(None)
+
+
+    def cancel(self):
+        self.cancelled = True
+        if self._waiting:
+            self._waiting, ip = None, self._waiting
+            ip.finish(None)
+
+
+
+class CommandStats(object):
+    """
+    Call count, errors, payload bytes and timing of one RPC command.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.time = Histogram()
+
+
+    def add(self, duration, bytes_in, bytes_out, failed):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.time.add(duration)
+
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'time': self.time.snapshot(),
+            'p50': self.time.percentile(50),
+            'p99': self.time.percentile(99)
+        }
+
+
+
+class Stats(object):
+    """
+    Statistics of the calls on one or more RPC channels.
+
+    Calls from the peer are recorded by command in *served*, timed from
+    receiving the call until the answer is sent, and calls to the peer in
+    *issued*, timed from sending the call until the answer arrives.  The
+    time spent serializing and deserializing payloads is recorded in
+    *serialization*.  Payload sizes of batched calls are not recorded.
+    """
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        """
+        Discards all statistics collected so far.
+        """
+        self.started = time.time()
+        self.served = {}
+        self.issued = {}
+        self.serialization = Histogram()
+
+
+    def add_served(self, cmd, duration, bytes_in, bytes_out, failed):
+        """
+        Records a call from the peer.
+        """
+        stats = self.served.get(cmd)
+        if stats is None:
+            stats = self.served[cmd] = CommandStats()
+        stats.add(duration, bytes_in, bytes_out, failed)
+
+
+    def add_issued(self, cmd, duration, bytes_out, bytes_in, failed):
+        """
+        Records a call to the peer.
+        """
+        stats = self.issued.get(cmd)
+        if stats is None:
+            stats = self.issued[cmd] = CommandStats()
+        stats.add(duration, bytes_in, bytes_out, failed)
+
+
+    def snapshot(self):
+        """
+        Returns a dict containing the current statistics.
+        """
+        return {
+            'elapsed': time.time() - self.started,
+            'served': dict((cmd, s.snapshot()) for cmd, s in self.served.items()),
+            'issued': dict((cmd, s.snapshot()) for cmd, s in self.issued.items()),
+            'serialization': self.serialization.snapshot()
+        }
+
+
+    def summary(self):
+        """
+        Returns a human readable summary of the current statistics, suitable
+        for logging.
+        """
+        lines = ['rpc: %.1fs, serialization total %.3fs in %d payloads' % \
+                 (time.time() - self.started, self.serialization.total, self.serialization.count)]
+        for title, commands in (('served', self.served), ('issued', self.issued)):
+            for cmd, s in sorted(commands.items(), key=lambda item: -item[1].time.total):
+                lines.append('  %s %-20s %8d calls, %d errors, total %.3fs, p50 %.2fms, p99 %.2fms, '
+                             'max %.2fms, in %d bytes, out %d bytes' % \
+                             (title, cmd, s.calls, s.errors, s.time.total, s.time.percentile(50) * 1000,
+                              s.time.percentile(99) * 1000, s.time.max * 1000, s.bytes_in, s.bytes_out))
+        return '\n'.join(lines)
+
+
+
+def _is_stream(obj):
+    """
+    Returns True if the given return value of a function exposed with
+    stream=True is to be streamed to the caller.
+    """
+    return isinstance(obj, collections.Iterator) and not isinstance(obj, (str, bytes))
+
+
+def _read_stream(source):
+    """
+    Returns all items of a stream source (or for files, their contents), for
+    peers that don't support streams.
+    """
+    try:
+        if hasattr(source, 'read'):
+            return source.read()
+        return list(source)
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
+
+
+class _CallInProgress(kaa.InProgress):
+    """
+    InProgress of a call to the peer.  The handler cancelling the call is
+    only connected to the abort signal once the call is actually aborted,
+    as most calls never are.
+    """
+    def __init__(self):
+        super(_CallInProgress, self).__init__(abortable=True)
+        # (handler, args) connected to the abort signal by abort()
+        self._cancel = None
+
+
+    def abort(self, exc=None):
+        if self._cancel and not self.finished:
+            handler, args = self._cancel
+            self._cancel = None
+            self.signals['abort'].connect(handler, *args)
+        return super(_CallInProgress, self).abort(exc)
+
+
+
+class Batch(object):
+    """
+    Remote calls collected to be sent to the peer in a single packet.
+
+    Batches are created by :meth:`~kaa.rpc.Channel.batch`.  The peer
+    invokes the calls back to back and returns the results of all calls
+    that finish immediately in a single packet as well, which is much
+    cheaper than many individual calls when the calls themselves are
+    cheap.  A batch is sent when the with block is left without an
+    exception, otherwise its calls are aborted::
+
+        with client.batch() as batch:
+            results = [batch.rpc('get', key) for key in keys]
+        values = yield kaa.InProgressAll(*results)
+
+    If the peer doesn't support batches, the calls are sent one by one.
+    """
+    def __init__(self, channel):
+        self._channel = channel
+        self._calls = []
+
+
+    def rpc(self, cmd, *args, **kwargs):
+        """
+        Adds a call of the remote command to the batch.
+
+        :returns: :class:`~kaa.InProgress` finished with the result of the
+                  call, or which raises the remote exception, once the
+                  batch has been sent and answered.
+        """
+        callback = _CallInProgress()
+        callback._cancel = self._discard, (callback,)
+        self._calls.append((callback, cmd, args, kwargs))
+        return callback
+
+
+    def _discard(self, exc, callback):
+        """
+        Removes a call aborted before the batch was sent.
+        """
+        for call in self._calls:
+            if call[0] is callback:
+                self._calls.remove(call)
+                break
+
+
+    def send(self):
+        """
+        Sends the calls added since the batch was last sent.
+        """
+        calls, self._calls = self._calls, []
+        if calls:
+            self._channel._send_batch(calls)
+
+
+    def __len__(self):
+        return len(self._calls)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, tb):
+        if type is None:
+            self.send()
+            return
+        for call in self._calls[:]:
+            call[0].abort(InProgressAborted('batch not sent: %r' % value))
+
+
+    def __repr__(self):
+        return '<kaa.rpc.Batch %d calls>' % len(self._calls)
+
 
 class Server(Object):
     """
@@ -157,6 +721,28 @@ class Server(Object):
     must correspond to the ``bind_info`` argument of :meth:`kaa.Socket.listen`.
 
     See kaa.Socket.buffer_size docstring for information on buffer_size.
+
+    codecs is a list of payload codec names (see :func:`register_codec`) in
+    order of preference that are offered to clients.  Clients choose one of
+    them during authentication; pickle is used with clients not supporting
+    any of them, and if no codecs are given.  Built-in codecs are 'pickle'
+    and 'marshal', and 'msgpack' if the msgpack module is installed.
+
+    compressors is a list of payload compressors ('zlib' or 'zlib_fast') in
+    order of preference that are offered to clients.  If a client accepts
+    one, payloads of at least RPC_COMPRESS_THRESHOLD bytes are compressed
+    in both directions.  'zlib_fast' is a cheaper, lower compression level
+    better suited for fast links.
+
+    ticket_lifetime enables session resumption: clients are given single-use
+    tickets valid for this many seconds, which allow them to authenticate
+    their next connection without a full challenge/response handshake.
+
+    If features is True, the protocol extensions in RPC_FEATURES (streamed
+    results, batches, and deadlines and cancellation of calls) are offered
+    to clients during authentication.  Clients from before handshake
+    options can't authenticate if anything is offered, so to accept them,
+    pass features=False and no codecs, compressors or ticket_lifetime.
     """
     __kaasignals__ = {
         'client-connected':
@@ -170,12 +756,23 @@ class Server(Object):
 
             '''
     }
-    def __init__(self, address, auth_secret = '', buffer_size=None):
+    def __init__(self, address, auth_secret = '', buffer_size=None, codecs=None, compressors=None,
+                 ticket_lifetime=None, features=True):
         super(Server, self).__init__()
         self._auth_secret = py3_b(auth_secret)
+        self._codecs = _check_codecs(codecs)
+        self._compressors = _check_codecs(compressors, COMPRESSORS)
+        self._offer_features = features
+        # Unused session tickets, by ticket: (expiry time, codec, compressor)
+        self._ticket_lifetime = ticket_lifetime
+        self._tickets = {}
         self._socket = kaa.Socket(buffer_size=buffer_size)
         self._socket.listen(address)
         self._socket.signals['new-client'].connect_weak(self._new_connection)
+        self._stats = None
+        self._stats_exposed = False
+        # Channels of connected clients, for enable_stats()
+        self._channels = weakref.WeakSet()
 
         self.objects = []
 
@@ -185,13 +782,67 @@ class Server(Object):
         """
         log.debug("New connection %s", client_sock)
         client_sock.buffer_size = self._socket.buffer_size
-        client = Channel(sock = client_sock, auth_secret = self._auth_secret)
+        client = Channel(sock = client_sock, auth_secret = self._auth_secret, codecs = self._codecs,
+                         compressors = self._compressors)
         for obj in self.objects:
             client.register(obj)
+        if self._stats:
+            client.enable_stats(self._stats)
+        if self._ticket_lifetime:
+            client._tickets = self._tickets
+            client._ticket_lifetime = self._ticket_lifetime
+        client._offer_features = self._offer_features
+        self._channels.add(client)
         client._send_auth_challenge()
         kaa.inprogress(client).connect(self.signals['client-connected'].emit)
 
 
+    @property
+    def stats(self):
+        """
+        The :class:`~kaa.rpc.Stats` of all client channels, or None if
+        statistics are disabled.
+        """
+        return self._stats
+
+
+    def enable_stats(self, introspection=False):
+        """
+        Start collecting statistics of the calls on all client channels.
+
+        :param introspection: if True, clients can retrieve a snapshot of
+                              the statistics by calling the ``kaa.rpc.stats``
+                              command.
+        :returns: the :class:`~kaa.rpc.Stats` object collecting the
+                  statistics
+
+        Collecting statistics has a small cost for every call, so it is
+        disabled by default.  If statistics are already enabled, they are
+        reset.
+        """
+        self._stats = Stats()
+        for channel in self._channels:
+            channel.enable_stats(self._stats)
+        if introspection and not self._stats_exposed:
+            @expose('kaa.rpc.stats')
+            def stats():
+                return self._stats.snapshot() if self._stats else None
+            self.register(stats)
+            for channel in self._channels:
+                channel.register(stats)
+            self._stats_exposed = True
+        return self._stats
+
+
+    def disable_stats(self):
+        """
+        Stop collecting statistics.
+        """
+        self._stats = None
+        for channel in self._channels:
+            channel.disable_stats()
+
+
     def close(self):
         """
         Close the server socket.
@@ -227,6 +878,11 @@ class Channel(Object):
     Channel object for two point communication, implementing the kaa.rpc
     protocol. The server creates a Channel object for each incoming client
     connection.  Client itself is also a Channel.
+
+    If max_in_flight is set, at most that many calls are outstanding at a
+    time; further calls are queued until answers arrive.  If max_queued is
+    set as well, calls exceeding the queue raise TooManyCallsError.  Pings
+    and batches are not subject to these limits.
     """
     __kaasignals__ = {
         'closed':
@@ -245,9 +901,23 @@ class Channel(Object):
     }
 
     channel_type = 'server'
+    max_in_flight = None
+    max_queued = None
 
-    def __init__(self, sock, auth_secret):
+    def __init__(self, sock, auth_secret, codecs=None, compressors=None):
         super(Channel, self).__init__()
+        _check_codecs(codecs)
+        _check_codecs(compressors, COMPRESSORS)
+        # Codecs and compressors offered (server) or accepted (client) in
+        # order of preference.
+        self._codecs = codecs
+        self._compressors = compressors
+        # Codec and compressor in use, negotiated during authentication.
+        self._codec = CODECS['pickle']
+        self._compressor = None
+        # Payload bytes of compressed packets, before and after compression:
+        # [sent, sent compressed, received, received compressed]
+        self._compression_bytes = [0, 0, 0, 0]
         self._socket = sock
         self._authenticated = False
         self._connect_inprogress = kaa.InProgress()
@@ -256,13 +926,66 @@ class Channel(Object):
         self._socket.chunk_size = 1024
         # Buffer containing packets deferred until after authentication.
         self._write_buffer_deferred = []
-        self._read_buffer = []
+        # The beginning of the header of the next packet if it was only
+        # received partially, the packet whose payload is being received
+        # as [seq, type, payload_len, payload chunks, bytes missing], and
+        # the received packets not handled yet as (seq, type, payload_len,
+        # payload).
+        self._read_header = bl('')
+        self._read_packet = None
+        self._read_packets = collections.deque()
         self._callbacks = {}
         self._next_seq = 1
         self._rpc_in_progress = {}
+        # Calls waiting for room in the max_in_flight window:
+        # (seq, callback, cmd, args, kwargs, deadline)
+        self._call_queue = collections.deque()
+        # Streams being received, and _StreamCredit of streams being sent,
+        # by seq
+        self._rpc_streams = {}
+        self._streams_out = {}
+        # Protocol extensions (see RPC_FEATURES) both peers support, and
+        # whether they are offered to clients (server side).
+        self._features = frozenset()
+        self._offer_features = False
+        # InProgress objects of calls from the peer still running, and the
+        # timers of their deadlines, by seq
+        self._rpc_running = {}
+        self._deadline_timers = {}
+        # Statistics, and the (cmd, start time, payload size) of calls from
+        # and (start time, payload size) of calls to the peer while they are
+        # recorded.
+        self._stats = None
+        self._served_started = {}
+        self._issued_started = {}
+        # Session tickets of the server and their lifetime (server side), or
+        # the key of the server in _session_tickets (client side).
+        self._tickets = None
+        self._ticket_lifetime = None
+        self._ticket_key = None
+        # Client side: whether a session ticket was looked up for this
+        # connection, (ticket, nonce) while resuming a session, and the
+        # (seq, challenge, options) of an AUTH packet received meanwhile.
+        self._resume_tried = False
+        self._resuming = None
+        self._deferred_challenge = None
+        # Client side: whether calls may be sent before authentication is
+        # complete, and while this is the case, the bytes that may still be
+        # sent and the calls sent: (seq, callback, cmd, args, kwargs,
+        # deadline)
+        self._pipeline = False
+        self._pipelining = False
+        self._pipeline_budget = 0
+        self._pipelined_calls = []
+        # Server side: bytes of pipelined calls still to discard after a
+        # session resumption was rejected, or None.
+        self._discard_budget = None
         self._auth_secret = py3_b(auth_secret)
         self._pending_challenge = None
 
+        # Payloads are copied from the socket's read buffer, so there is no
+        # need for the socket to allocate a string per chunk.
+        self._socket.zero_copy = True
         # Creates a circular reference so that RPC channels survive even when
         # there is no reference to them.  (Servers may not hold references to
         # clients channels.)  As long as the socket is connected, the channel
@@ -276,6 +999,74 @@ class Channel(Object):
         return self._socket.connected and self._connect_inprogress.finished
 
 
+    @property
+    def codec(self):
+        """
+        The name of the codec used to serialize payloads on this channel.
+        """
+        return self._codec.name
+
+
+    @property
+    def compressor(self):
+        """
+        The name of the compressor used for large payloads on this channel,
+        or None if payloads are not compressed.
+        """
+        return self._compressor[0] if self._compressor else None
+
+
+    @property
+    def compression_stats(self):
+        """
+        A dict with the number of payload bytes of compressed packets sent
+        and received before (*sent*, *received*) and after
+        (*sent_compressed*, *received_compressed*) compression, and the
+        resulting compression ratios (*sent_ratio*, *received_ratio*).
+        """
+        sent, sent_compressed, received, received_compressed = self._compression_bytes
+        return {
+            'compressor': self.compressor,
+            'sent': sent,
+            'sent_compressed': sent_compressed,
+            'sent_ratio': float(sent) / sent_compressed if sent_compressed else 1.0,
+            'received': received,
+            'received_compressed': received_compressed,
+            'received_ratio': float(received) / received_compressed if received_compressed else 1.0
+        }
+
+
+    @property
+    def stats(self):
+        """
+        The :class:`~kaa.rpc.Stats` of this channel, or None if statistics
+        are disabled.
+        """
+        return self._stats
+
+
+    def enable_stats(self, stats=None):
+        """
+        Start collecting statistics of the calls on this channel.
+
+        :param stats: the :class:`~kaa.rpc.Stats` object to record the
+                      statistics in (e.g. to share it between channels), or
+                      None to create a new one
+        :returns: the :class:`~kaa.rpc.Stats` object
+        """
+        self._stats = stats or Stats()
+        return self._stats
+
+
+    def disable_stats(self):
+        """
+        Stop collecting statistics.
+        """
+        self._stats = None
+        self._served_started = {}
+        self._issued_started = {}
+
+
     def register(self, obj):
         """
         Registers one or more previously exposed callables to the peer
@@ -300,177 +1091,661 @@ class Channel(Object):
     def rpc(self, cmd, *args, **kwargs):
         """
         Call the remote command and return InProgress.
+
+        Aborting the InProgress cancels the call: the peer aborts the
+        InProgress returned by the remote function, if it is still running.
+        """
+        callback = kwargs.pop('_kaa_rpc_callback', None)
+        return self._call(cmd, args, kwargs, None, callback)
+
+
+    def rpc_timeout(self, timeout, cmd, *args, **kwargs):
+        """
+        Call the remote command and return InProgress, which raises
+        :class:`~kaa.TimeoutException` if the call is not finished within
+        timeout seconds.
+
+        If the peer supports deadlines, the deadline is passed to it, and it
+        aborts the InProgress returned by the remote function when the
+        deadline expires.
+        """
+        callback = kwargs.pop('_kaa_rpc_callback', None)
+        return self._call(cmd, args, kwargs, timeout, callback).timeout(timeout, abort=True)
+
+
+    def _call(self, cmd, args, kwargs, timeout, callback):
+        """
+        Sends a CALL packet, or queues the call if max_in_flight calls are
+        outstanding.
         """
         if not CoreThreading.is_mainthread():
             # create InProgress object and return
-            callback = kaa.InProgress()
-            kwargs['_kaa_rpc_callback'] = callback
-            kaa.MainThreadCallable(self.rpc)(cmd, *args, **kwargs)
+            callback = callback or _CallInProgress()
+            kaa.MainThreadCallable(self._call)(cmd, args, kwargs, timeout, callback)
             return callback
 
-        if not self.connected:
-            raise NotConnectedError()
+        if self.connected:
+            pending = False
+        elif self._pipeline and self._socket.alive and not self._connect_inprogress.finished:
+            # The connection is being set up; the call is sent once calls can
+            # be pipelined or authentication is complete.
+            pending = not self._pipelining or self._pipeline_budget <= 0
+        else:
+            raise NotConnectedError()
+
+        if pending or (self.max_in_flight and (self._call_queue or len(self._rpc_in_progress) >= self.max_in_flight)):
+            if self.max_queued is not None and len(self._call_queue) >= self.max_queued:
+                raise TooManyCallsError('%d calls in flight, %d queued' % \
+                                        (len(self._rpc_in_progress), len(self._call_queue)))
+            send = False
+        else:
+            send = True
+
+        seq = self._next_seq
+        self._next_seq += 1
+        # create InProgress object
+        if callback is None:
+            callback = _CallInProgress()
+        if send:
+            self._send_call(seq, callback, cmd, args, kwargs, timeout)
+        else:
+            deadline = notifier.monotonic() + timeout if timeout is not None else None
+            self._call_queue.append((seq, callback, cmd, args, kwargs, deadline))
+        self._watch_abort(callback, seq)
+        return callback
+
+
+    def _send_call(self, seq, callback, cmd, args, kwargs, timeout):
+        # The deadline is relative, so that the clocks of both ends need not
+        # be synchronized, and only sent to peers supporting deadlines.
+        started = notifier.monotonic() if self._stats else 0
+        if timeout is None or 'deadline' not in self._features:
+            payload = self._dumps((cmd, args, kwargs))
+        else:
+            payload = self._dumps((cmd, args, kwargs, timeout))
+        if self._pipelining:
+            deadline = notifier.monotonic() + timeout if timeout is not None else None
+            if len(payload) + RPC_PACKET_HEADER_SIZE > self._pipeline_budget:
+                # Too large to pipeline, so it waits for authentication
+                # along with all further calls.
+                self._pipeline_budget = 0
+                self._call_queue.appendleft((seq, callback, cmd, args, kwargs, deadline))
+                return
+            self._pipeline_budget -= len(payload) + RPC_PACKET_HEADER_SIZE
+            self._pipelined_calls.append((seq, callback, cmd, args, kwargs, deadline))
+        self._send_packet(seq, 'CALL', payload)
+        # callback with error handler
+        self._rpc_in_progress[seq] = (callback, cmd)
+        if self._stats:
+            self._issued_started[seq] = (started, len(payload))
+
+
+    def _send_queued_calls(self):
+        """
+        Sends queued calls as long as there is room in the max_in_flight
+        window.
+        """
+        while self._call_queue and (not self.max_in_flight or len(self._rpc_in_progress) < self.max_in_flight):
+            if not self._authenticated and (not self._pipelining or self._pipeline_budget <= 0):
+                break
+            seq, callback, cmd, args, kwargs, deadline = self._call_queue.popleft()
+            timeout = max(deadline - notifier.monotonic(), 0) if deadline is not None else None
+            try:
+                self._send_call(seq, callback, cmd, args, kwargs, timeout)
+            except Exception:
+                # The caller is long gone, e.g. the arguments can't be
+                # serialized.
+                callback.throw(*sys.exc_info())
+
+
+    def _watch_abort(self, callback, seq):
+        """
+        Makes aborting the InProgress of a call cancel the call.
+        """
+        if isinstance(callback, _CallInProgress):
+            callback._cancel = self._cancel_call, (seq,)
+        else:
+            callback.signals['abort'].connect(self._cancel_call, seq)
+
+
+    def _cancel_call(self, exc, seq):
+        """
+        Invoked when the InProgress of a call is aborted.
+        """
+        entry = self._rpc_in_progress.pop(seq, None)
+        if entry:
+            self._record_issued(seq, entry[1], 0, True)
+            if self.connected and 'deadline' in self._features:
+                self._send_packet(seq, 'CNCL', '')
+            if self._call_queue:
+                self._send_queued_calls()
+            return
+        for call in self._call_queue:
+            if call[0] == seq:
+                self._call_queue.remove(call)
+                break
+
+
+    def ping(self):
+        """
+        Checks whether the peer is responsive.
+
+        :returns: :class:`~kaa.InProgress` finished with None when the peer
+                  answered.  The peer must support pings as well.
+        """
+        if not self.connected:
+            raise NotConnectedError()
+
+        seq = self._next_seq
+        self._next_seq += 1
+        callback = kaa.InProgress()
+        self._send_packet(seq, 'PING', '')
+        self._rpc_in_progress[seq] = (callback, 'ping')
+        return callback
+
+
+    def batch(self):
+        """
+        Returns a :class:`~kaa.rpc.Batch` to collect calls that are sent to
+        the peer in a single packet, if the peer supports batches.
+        """
+        return Batch(self)
+
+
+    def rpc_many(self, calls):
+        """
+        Calls multiple remote commands with a single packet.
+
+        :param calls: sequence of (cmd, args) or (cmd, args, kwargs) tuples
+        :returns: list of :class:`~kaa.InProgress` objects, one per call
+        """
+        batch = Batch(self)
+        results = [ batch.rpc(call[0], *call[1], **(call[2] if len(call) > 2 else {})) for call in calls ]
+        batch.send()
+        return results
+
+
+    def _send_batch(self, calls):
+        """
+        Sends the (callback, cmd, args, kwargs) calls of a batch in one BTCH
+        packet.
+        """
+        if not CoreThreading.is_mainthread():
+            return kaa.MainThreadCallable(self._send_batch)(calls)
+
+        if not self.connected or 'batch' not in self._features:
+            # The peer doesn't know BTCH packets, or it isn't known yet
+            # whether it does; calls are queued until authentication is
+            # complete like any other.
+            for callback, cmd, args, kwargs in calls:
+                self._call(cmd, args, kwargs, None, callback)
+            return
+
+        batch = []
+        for callback, cmd, args, kwargs in calls:
+            seq = self._next_seq
+            self._next_seq += 1
+            batch.append((seq, cmd, args, kwargs))
+        started = notifier.monotonic() if self._stats else 0
+        payload = self._dumps(batch)
+        self._send_packet(batch[0][0], 'BTCH', payload)
+        for (callback, cmd, args, kwargs), call in zip(calls, batch):
+            self._rpc_in_progress[call[0]] = (callback, cmd)
+            self._watch_abort(callback, call[0])
+            if self._stats:
+                self._issued_started[call[0]] = (started, 0)
+
+
+    def close(self):
+        """
+        Forcefully close the RPC channel.
+        """
+        self._socket.close()
+
+
+    def __inprogress__(self):
+        return self._connect_inprogress
+
+
+    def _write(self, *buffers):
+        """
+        Writes data to the channel.  Returns the InProgress of the last write.
+        """
+        for data in buffers:
+            ip = self._socket.write(data)
+            cb = ip.exception.connect_weak(self._handle_close, False, write_failed=True)
+            cb.ignore_caller_args = True
+        return ip
+
+
+    def _handle_close(self, expected, reset_signals=True, write_failed=False):
+        """
+        kaa.Socket callback invoked when socket is closed.
+        """
+        if not self._socket or (write_failed and not self._socket.alive):
+            # Socket already closed.  Return False to indicate the exception
+            # was handled, if invoked from write() exception handler (see
+            # Channel._write())
+            return False
+
+        if not self._authenticated:
+            # Socket closed before authentication completed.  We assume it's
+            # because authentication failed (though it may not be).
+            log.error('rpc peer closed before authentication completed; probably incorrect shared secret.')
+
+        log.debug('close socket for %s', self)
+        self.signals['closed'].emit()
+        if reset_signals:
+            self.signals = {}
+        self._socket.signals['read'].disconnect(self._handle_read)
+        self._socket.signals['closed'].disconnect(self._handle_close)
+        while self._rpc_in_progress:
+            # raise exception for callback
+            callback = self._rpc_in_progress.popitem()[1][0]
+            if callback and (not is_shutting_down() or callback.count() or callback.exception.count()):
+                # Raise an error if this happens during runtime or if
+                # someone wants to get the result or exception.
+                callback.throw(IOError, IOError('kaa.rpc channel closed'), None)
+        while self._call_queue:
+            callback = self._call_queue.popleft()[1]
+            callback.throw(IOError, IOError('kaa.rpc channel closed'), None)
+        self._served_started.clear()
+        self._issued_started.clear()
+        while self._rpc_streams:
+            self._rpc_streams.popitem()[1]._throw(IOError, IOError('kaa.rpc channel closed'), None)
+        while self._streams_out:
+            self._streams_out.popitem()[1].cancel()
+        while self._deadline_timers:
+            self._deadline_timers.popitem()[1].stop()
+
+        # Return False for reason explained above.
+        return False
+
+
+    def _handle_read(self, data):
+        """
+        Invoked when a new chunk is read from the socket.  When not authenticated,
+        chunk size is 1k; when authenticated it is 1M.
+        """
+        # Packets are parsed from the chunk, which is only valid until we
+        # return, and payloads copied out of it.  Payloads of packets
+        # arriving in several chunks are joined once they are complete.
+        packet = self._read_packet
+        if not self._authenticated:
+            pending = len(self._read_header) + (sum(len(chunk) for chunk in packet[3]) if packet else 0)
+            limit = 1024 if self._discard_budget is None else 1024 + RPC_PIPELINE_MAX
+            if pending + len(data) > limit:
+                # Because we are not authenticated, we shouldn't have more
+                # than 1k in the buffer.  If we do it's because the remote
+                # has sent a large amount of data before completing
+                # authentication.
+                log.warning("Too much data received from remote end before authentication; disconnecting")
+                self.close()
+                return
+
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        size = len(view)
+        pos = 0
+        while pos < size:
+            if packet:
+                # Continue the payload of a packet received partially.
+                n = min(packet[4], size - pos)
+                packet[3].append(view[pos:pos + n].tobytes())
+                packet[4] -= n
+                pos += n
+                if packet[4]:
+                    break
+                chunks = packet[3]
+                payload = chunks[0] if len(chunks) == 1 else bl('').join(chunks)
+                self._read_packets.append((packet[0], packet[1], packet[2], payload))
+                packet = self._read_packet = None
+                continue
+
+            if self._read_header or size - pos < RPC_PACKET_HEADER_SIZE:
+                n = min(RPC_PACKET_HEADER_SIZE - len(self._read_header), size - pos)
+                self._read_header += view[pos:pos + n].tobytes()
+                pos += n
+                if len(self._read_header) < RPC_PACKET_HEADER_SIZE:
+                    break
+                seq, packet_type, payload_len = RPC_PACKET_HEADER.unpack(self._read_header)
+                self._read_header = bl('')
+            else:
+                seq, packet_type, payload_len = RPC_PACKET_HEADER.unpack_from(view, pos)
+                pos += RPC_PACKET_HEADER_SIZE
+            n = payload_len & ~RPC_PACKET_COMPRESSED
+            if size - pos >= n:
+                self._read_packets.append((seq, packet_type, payload_len, view[pos:pos + n].tobytes()))
+                pos += n
+            else:
+                packet = self._read_packet = [seq, packet_type, payload_len, [view[pos:].tobytes()], n - (size - pos)]
+                pos = size
+
+        # Packet handlers may recurse into the main loop and so into this
+        # method, which then handles the packets left here first.
+        packets = self._read_packets
+        while packets:
+            seq, packet_type, payload_len, payload = packets.popleft()
+            if payload_len & RPC_PACKET_COMPRESSED:
+                if not self._compressor or not self._authenticated:
+                    log.error('received compressed packet, but no compression was negotiated; disconnecting')
+                    self.close()
+                    return
+                self._compression_bytes[3] += len(payload)
+                try:
+                    payload = self._compressor[2](payload, RPC_DECOMPRESS_MAX)
+                except (ValueError, zlib.error), e:
+                    log.error('received invalid compressed packet (%s); disconnecting', e)
+                    self.close()
+                    return
+                self._compression_bytes[2] += len(payload)
+            if not self._authenticated:
+                self._handle_packet_before_auth(seq, packet_type, payload)
+            else:
+                self._handle_packet_after_auth(seq, packet_type, payload)
+
+
+    def _send_packet(self, seq, packet_type, payload):
+        """
+        Send a packet (header + payload) to the other side.  Returns the
+        InProgress of the write, or None if the packet is deferred.
+        """
+        if not self._socket:
+            return
+        payload_len = len(payload)
+        if self._compressor and self._authenticated and \
+           RPC_COMPRESS_THRESHOLD <= payload_len <= RPC_DECOMPRESS_MAX:
+            compressed = self._compressor[1](payload)
+            if len(compressed) < payload_len:
+                self._compression_bytes[0] += payload_len
+                self._compression_bytes[1] += len(compressed)
+                payload = compressed
+                payload_len = len(payload) | RPC_PACKET_COMPRESSED
+        header = RPC_PACKET_HEADER.pack(seq, packet_type, payload_len)
+        if not self._authenticated and bl(packet_type) not in RPC_AUTH_PACKETS and \
+           not (self._pipelining and packet_type == 'CALL'):
+            log.debug('delay packet %s', packet_type)
+            self._write_buffer_deferred.append(header + payload)
+        elif len(payload) > RPC_PACKET_COPY_MAX and self._socket._can_writev():
+            # Avoid copying large payloads if the socket can write header
+            # and payload with one system call; otherwise it would join
+            # them itself.
+            return self._write(header, payload)
+        else:
+            return self._write(header + payload)
+
+
+    def _send_answer(self, answer, seq, stream=False):
+        """
+        Send delayed answer when callback returns InProgress.  Returns the
+        size of the payload sent.  If stream is True (the function was
+        exposed with stream=True), iterators and files are streamed.
+        """
+        if stream and _is_stream(answer):
+            if 'stream' in self._features:
+                self._send_stream(answer, seq)
+                return 0
+            try:
+                answer = _read_stream(answer)
+            except Exception:
+                return self._send_exception(*sys.exc_info() + (seq,))
+        payload = self._dumps(answer)
+        self._send_packet(seq, 'RETN', payload)
+        return len(payload)
+
+
+    @kaa.coroutine()
+    def _send_stream(self, source, seq):
+        """
+        Streams the items of an iterator, or the contents of a file, returned
+        by an exposed function.  The stream is started by a STRM packet,
+        followed by an ITEM packet per item and a SEND packet (or an EXCP
+        packet if the iterator raised).
+
+        The receiver acknowledges the payload bytes it has read with SACK
+        packets, and we stop iterating while more than RPC_STREAM_WINDOW
+        bytes are unacknowledged.  A CNCL packet from the receiver stops the
+        stream.
+        """
+        self._send_packet(seq, 'STRM', '')
+        credit = self._streams_out[seq] = _StreamCredit()
+        if hasattr(source, 'read'):
+            iterator = iter(lambda: source.read(RPC_STREAM_CHUNK_SIZE), source.read(0))
+        else:
+            iterator = source
+        try:
+            for item in iterator:
+                if not self._socket.alive or credit.cancelled:
+                    # Channel closed or stream cancelled, nobody to send the
+                    # rest to.
+                    return
+                payload = self._dumps(item)
+                ip = self._send_packet(seq, 'ITEM', payload)
+                credit.unacked += len(payload)
+                if credit.unacked > RPC_STREAM_WINDOW:
+                    # Wait for the receiver to catch up before producing more.
+                    yield credit.wait()
+                elif self._socket.write_queue_used > RPC_STREAM_WINDOW:
+                    # Wait for the socket to catch up.
+                    yield ip
+                if not self._socket.alive or credit.cancelled:
+                    return
+        except Exception:
+            if self._socket.alive:
+                self._send_exception(*sys.exc_info() + (seq,))
+            return
+        finally:
+            if self._streams_out.get(seq) is credit:
+                del self._streams_out[seq]
+            if hasattr(source, 'close'):
+                source.close()
+        self._send_packet(seq, 'SEND', '')
+
+
+    def _send_exception(self, type, value, tb, seq):
+        """
+        Send delayed exception when callback returns InProgress.  Returns
+        the size of the payload sent.
+        """
+        payload = self._dumps_exception(value, traceback.extract_tb(tb))
+        self._send_packet(seq, 'EXCP', payload)
+        return len(payload)
+
+
+    def _dumps(self, obj):
+        """
+        Serializes a payload with the channel's codec.
+        """
+        if not self._stats:
+            return self._codec.dumps(obj)
+        t0 = notifier.monotonic()
+        data = self._codec.dumps(obj)
+        self._stats.serialization.add(notifier.monotonic() - t0)
+        return data
+
+
+    def _loads(self, data):
+        """
+        Deserializes a payload with the channel's codec.
+        """
+        if not self._stats:
+            return self._codec.loads(data)
+        t0 = notifier.monotonic()
+        obj = self._codec.loads(data)
+        self._stats.serialization.add(notifier.monotonic() - t0)
+        return obj
+
 
-        seq = self._next_seq
-        self._next_seq += 1
-        # create InProgress object
-        callback = kwargs.pop('_kaa_rpc_callback', kaa.InProgress())
-        payload = cPickle.dumps((cmd, args, kwargs), PICKLE_PROTOCOL)
-        self._send_packet(seq, 'CALL', payload)
-        # callback with error handler
-        self._rpc_in_progress[seq] = (callback, cmd)
-        return callback
+    def _dumps_exception(self, value, stack):
+        """
+        Serializes an exception and its stack, replacing exceptions which
+        can't be pickled by a generic one.
+        """
+        try:
+            return self._dumps((value, stack))
+        except cPickle.UnpickleableError:
+            return self._dumps((Exception(py3_b(value)), stack))
 
 
-    def close(self):
+    def _send_batch_answers(self, answers):
         """
-        Forcefully close the RPC channel.
+        Sends the (seq, failed, value) answers of a batch in one BRTN packet,
+        where value is an (exception, stack) tuple for failed calls.
         """
-        self._socket.close()
+        try:
+            payload = self._dumps(answers)
+        except Exception:
+            # Some answer can't be serialized; send them one by one, so that
+            # only the affected calls fail.
+            for seq, failed, value in answers:
+                try:
+                    if failed:
+                        self._send_packet(seq, 'EXCP', self._dumps_exception(*value))
+                    else:
+                        self._send_answer(value, seq)
+                except Exception:
+                    self._send_exception(*sys.exc_info() + (seq,))
+            return
+        self._send_packet(answers[0][0], 'BRTN', payload)
 
 
-    def __inprogress__(self):
-        return self._connect_inprogress
+    def _is_streamed(self, function):
+        """
+        Returns True if the exposed function's iterator results are streamed.
+        """
+        callback = self._callbacks.get(function)
+        return callback is not None and callback._kaa_rpc_param[1]
 
 
-    def _write(self, data):
+    def _invoke(self, function, args, kwargs):
+        """
+        Invokes the exposed function for a remote call.
         """
-        Writes data to the channel.
+        try:
+            callback = self._callbacks[function]
+            if callback._kaa_rpc_param[0]:
+                args = [ self ] + list(args)
+            dispatcher = getattr(callback, '_kaa_rpc_dispatcher', None)
+            if dispatcher:
+                return dispatcher(callback, args, kwargs)
+            return callback(*args, **kwargs)
+        except Exception:
+            #log.exception('Exception in rpc function "%s"', function)
+            if not function in self._callbacks:
+                log.error('%s - %s', function, self._callbacks.keys())
+            raise
+
+
+    def _track_result(self, result, seq, timeout, stream=False):
+        """
+        Sends the answer of a call once the InProgress returned by the
+        exposed function is finished.  Until then, the call can be cancelled
+        by the peer, and it is aborted if the deadline given by the peer
+        expires.
         """
-        cb = self._socket.write(data).exception.connect_weak(self._handle_close, False, write_failed=True)
-        cb.ignore_caller_args = True
+        self._rpc_running[seq] = result
+        result.connect(self._send_tracked_answer, seq, stream)
+        result.exception.connect(self._send_tracked_exception, seq)
+        if timeout is not None:
+            timer = self._deadline_timers[seq] = kaa.OneShotTimer(self._handle_deadline, seq)
+            timer.start(timeout)
 
 
-    def _handle_close(self, expected, reset_signals=True, write_failed=False):
+    def _stop_deadline(self, seq):
         """
-        kaa.Socket callback invoked when socket is closed.
+        Stops the deadline timer of a call from the peer, if it has one.
         """
-        if not self._socket or (write_failed and not self._socket.alive):
-            # Socket already closed.  Return False to indicate the exception
-            # was handled, if invoked from write() exception handler (see
-            # Channel._write())
-            return False
+        timer = self._deadline_timers.pop(seq, None)
+        if timer:
+            timer.stop()
 
-        if not self._authenticated:
-            # Socket closed before authentication completed.  We assume it's
-            # because authentication failed (though it may not be).
-            log.error('rpc peer closed before authentication completed; probably incorrect shared secret.')
 
-        log.debug('close socket for %s', self)
-        self.signals['closed'].emit()
-        if reset_signals:
-            self.signals = {}
-        self._socket.signals['read'].disconnect(self._handle_read)
-        self._socket.signals['closed'].disconnect(self._handle_close)
-        while self._rpc_in_progress:
-            # raise exception for callback
-            callback = self._rpc_in_progress.popitem()[1][0]
-            if callback and (not is_shutting_down() or callback.count() or callback.exception.count()):
-                # Raise an error if this happens during runtime or if
-                # someone wants to get the result or exception.
-                callback.throw(IOError, IOError('kaa.rpc channel closed'), None)
+    def _send_tracked_answer(self, answer, seq, stream):
+        self._stop_deadline(seq)
+        if self._rpc_running.pop(seq, None) is not None:
+            self._record_served(seq, self._send_answer(answer, seq, stream), False)
 
-        # Return False for reason explained above.
+
+    def _send_tracked_exception(self, type, value, tb, seq):
+        self._stop_deadline(seq)
+        if self._rpc_running.pop(seq, None) is None:
+            # Aborted because the call was cancelled or timed out.
+            return False
+        self._record_served(seq, self._send_exception(type, value, tb, seq), True)
+        # The exception is the peer's to handle.
         return False
 
 
-    def _handle_read(self, data):
+    def _record_served(self, seq, size, failed):
         """
-        Invoked when a new chunk is read from the socket.  When not authenticated,
-        chunk size is 1k; when authenticated it is 1M.
+        Records a call from the peer in the statistics once it is answered.
         """
-        self._read_buffer.append(data)
-        # Before we start into the loop, make sure we have enough data for
-        # a full packet.  For very large packets (if we just received a huge
-        # pickled object), this saves the string.join() which can be very
-        # expensive.  (This is the reason we use a list for our read buffer.)
-        buflen = sum(len(x) for x in self._read_buffer)
-        if buflen < RPC_PACKET_HEADER_SIZE:
-            return
-
-        if not self._authenticated and buflen > 1024:
-            # Because we are not authenticated, we shouldn't have more than 1k
-            # in the buffer.  If we do it's because the remote has sent a
-            # large amount of data before completing authentication.
-            log.warning("Too much data received from remote end before authentication; disconnecting")
-            self.close()
-            return
+        info = self._served_started.pop(seq, None)
+        if info and self._stats:
+            cmd, started, size_in = info
+            self._stats.add_served(cmd, notifier.monotonic() - started, size_in, size, failed)
 
-        # Ensure the first block in the read buffer is big enough for a full
-        # packet header.  If it isn't, then we must have more than 1 block in
-        # the buffer, so keep merging blocks until we have a block big enough
-        # to be a header.  If we're here, it means that buflen >=
-        # RPC_PACKET_HEADER_SIZE, so we can safely loop.
-        while len(self._read_buffer[0]) < RPC_PACKET_HEADER_SIZE:
-            self._read_buffer[0] += self._read_buffer.pop(1)
-
-        # Make sure the the buffer holds enough data as indicated by the
-        # payload size in the header.
-        header = self._read_buffer[0][:RPC_PACKET_HEADER_SIZE]
-        payload_len = struct.unpack("I4sI", header)[2]
-        if buflen < payload_len + RPC_PACKET_HEADER_SIZE:
-            return
-
-        # At this point we know we have enough data in the buffer for the
-        # packet, so we merge the array into a single buffer.
-        strbuf = bl('').join(self._read_buffer)
-        self._read_buffer = []
-        while True:
-            if len(strbuf) <= RPC_PACKET_HEADER_SIZE:
-                if len(strbuf) > 0:
-                    self._read_buffer.append(py3_b(strbuf))
-                break
-            header = strbuf[:RPC_PACKET_HEADER_SIZE]
-            seq, packet_type, payload_len = struct.unpack("I4sI", header)
-            if len(strbuf) < payload_len + RPC_PACKET_HEADER_SIZE:
-                # We've also received portion of another packet that we
-                # haven't fully received yet.  Put back to the buffer what
-                # we have so far, and we can exit the loop.
-                self._read_buffer.append(strbuf)
-                break
 
-            # Grab the payload for this packet, and shuffle strbuf to the
-            # next packet.
-            payload = strbuf[RPC_PACKET_HEADER_SIZE:RPC_PACKET_HEADER_SIZE + payload_len]
-            strbuf = strbuf[RPC_PACKET_HEADER_SIZE + payload_len:]
-            if not self._authenticated:
-                self._handle_packet_before_auth(seq, packet_type, payload)
-            else:
-                self._handle_packet_after_auth(seq, packet_type, payload)
+    def _record_issued(self, seq, cmd, size, failed):
+        """
+        Records a call to the peer in the statistics once it is answered.
+        """
+        info = self._issued_started.pop(seq, None)
+        if info and self._stats:
+            started, size_out = info
+            self._stats.add_issued(cmd, notifier.monotonic() - started, size_out, size, failed)
 
 
-    def _send_packet(self, seq, packet_type, payload):
+    def _abort_running(self, seq, exc):
         """
-        Send a packet (header + payload) to the other side.
+        Aborts the InProgress of a running call from the peer.  Returns
+        False if the call is not running (anymore).
         """
-        if not self._socket:
-            return
-        header = struct.pack("I4sI", seq, packet_type, len(payload))
-        if not self._authenticated and bl(packet_type) not in (bl('RESP'), bl('AUTH')):
-            log.debug('delay packet %s', packet_type)
-            self._write_buffer_deferred.append(header + payload)
-        else:
-            self._write(header + payload)
+        self._stop_deadline(seq)
+        result = self._rpc_running.pop(seq, None)
+        if result is None:
+            return False
+        self._record_served(seq, 0, True)
+        if not result.finished:
+            try:
+                result.abort(exc)
+            except (RuntimeError, InProgressAborted):
+                # Not abortable, or aborted without abort handlers.  Its
+                # answer is discarded in any case.
+                pass
+        return True
+
 
+    def _handle_deadline(self, seq):
+        exc = TimeoutException('rpc call timed out on remote end')
+        if self._abort_running(seq, exc) and self.connected:
+            self._send_exception(TimeoutException, exc, None, seq)
 
-    def _send_answer(self, answer, seq):
+
+    def _handle_return(self, seq, result, size=0):
         """
-        Send delayed answer when callback returns InProgress.
+        Finishes the InProgress of a remote call.
         """
-        payload = cPickle.dumps(answer, PICKLE_PROTOCOL)
-        self._send_packet(seq, 'RETN', payload)
+        callback, cmd = self._rpc_in_progress.pop(seq, (None, None))
+        if self._issued_started:
+            self._record_issued(seq, cmd, size, False)
+        if self._call_queue:
+            self._send_queued_calls()
+        if callback is not None:
+            callback.finish(result)
 
 
-    def _send_exception(self, type, value, tb, seq):
+    def _handle_exception(self, seq, exc_value, stack, size=0):
         """
-        Send delayed exception when callback returns InProgress.
+        Raises the exception of a remote call to its InProgress.
         """
-        stack = traceback.extract_tb(tb)
-        try:
-            payload = cPickle.dumps((value, stack), PICKLE_PROTOCOL)
-        except cPickle.UnpickleableError:
-            payload = cPickle.dumps((Exception(py3_b(value)), stack), PICKLE_PROTOCOL)
-        self._send_packet(seq, 'EXCP', payload)
+        callback, cmd = self._rpc_in_progress.pop(seq, (None, None))
+        if self._issued_started:
+            self._record_issued(seq, cmd, size, True)
+        if self._call_queue:
+            self._send_queued_calls()
+        if callback is not None:
+            remote_exc = RemoteException(exc_value, stack, cmd)
+            callback.throw(remote_exc.__class__, remote_exc, None)
 
 
     def _handle_packet_after_auth(self, seq, packet_type, payload):
@@ -480,48 +1755,133 @@ class Channel(Object):
         """
         if packet_type == bl('CALL'):
             # Remote function call, send answer
-            function, args, kwargs = cPickle.loads(payload)
+            started = notifier.monotonic() if self._stats else 0
+            call = self._loads(payload)
+            function, args, kwargs = call[:3]
+            if self._stats:
+                self._served_started[seq] = (function, started, len(payload))
             try:
-                if self._callbacks[function]._kaa_rpc_param[0]:
-                    args = [ self ] + list(args)
-                result = self._callbacks[function](*args, **kwargs)
+                result = self._invoke(function, args, kwargs)
+                if isinstance(result, kaa.InProgress) and result.finished:
+                    # e.g. a dispatched call that failed right away
+                    result = result.result
             except Exception, e:
-                #log.exception('Exception in rpc function "%s"', function)
-                if not function in self._callbacks:
-                    log.error('%s - %s', function, self._callbacks.keys())
-                self._send_exception(*sys.exc_info() + (seq,))
+                self._record_served(seq, self._send_exception(*sys.exc_info() + (seq,)), True)
                 return True
 
+            stream = self._is_streamed(function)
             if isinstance(result, kaa.InProgress):
-                result.connect(self._send_answer, seq)
-                result.exception.connect(self._send_exception, seq)
+                # The call may carry a deadline (relative, in seconds).
+                self._track_result(result, seq, call[3] if len(call) > 3 else None, stream)
             else:
-                self._send_answer(result, seq)
+                self._record_served(seq, self._send_answer(result, seq, stream), False)
+
+            return True
+
+        if packet_type == bl('BTCH'):
+            # Batch of remote function calls.  Answers available right away
+            # are collected and sent back in a single packet.
+            answers = []
+            for seq, function, args, kwargs in self._loads(payload):
+                if self._stats:
+                    self._served_started[seq] = (function, notifier.monotonic(), 0)
+                try:
+                    result = self._invoke(function, args, kwargs)
+                    if isinstance(result, kaa.InProgress) and result.finished:
+                        result = result.result
+                except Exception, e:
+                    answers.append((seq, True, (e, traceback.extract_tb(sys.exc_info()[2]))))
+                    continue
+                stream = self._is_streamed(function)
+                if isinstance(result, kaa.InProgress):
+                    self._track_result(result, seq, None, stream)
+                elif stream and _is_stream(result):
+                    self._record_served(seq, self._send_answer(result, seq, stream), False)
+                else:
+                    answers.append((seq, False, result))
+            if answers:
+                self._send_batch_answers(answers)
+                if self._served_started:
+                    for answer in answers:
+                        self._record_served(answer[0], 0, answer[1])
+            return True
+
+        if packet_type == bl('CNCL'):
+            # The peer is no longer interested in the result of a call, or
+            # in the rest of a stream.
+            self._abort_running(seq, InProgressAborted('rpc call cancelled by peer'))
+            if seq in self._streams_out:
+                self._streams_out.pop(seq).cancel()
+            return True
+
+        if packet_type == bl('SACK'):
+            # The receiver of a stream has read this many bytes.
+            credit = self._streams_out.get(seq)
+            if credit and len(payload) == 4:
+                credit.ack(struct.unpack('I', payload)[0])
+            return True
+
+        if packet_type == bl('PING'):
+            self._send_packet(seq, 'PONG', '')
+            return True
 
+        if packet_type == bl('PONG'):
+            self._handle_return(seq, None)
             return True
 
         if packet_type == bl('RETN'):
             # RPC return
-            payload = cPickle.loads(payload)
-            callback, cmd = self._rpc_in_progress.get(seq)
+            self._handle_return(seq, self._loads(payload), len(payload))
+            return True
+
+        if packet_type == bl('BRTN'):
+            # Answers to a batch of calls
+            for seq, failed, value in self._loads(payload):
+                if failed:
+                    self._handle_exception(seq, *value)
+                else:
+                    self._handle_return(seq, value)
+            return True
+
+        if packet_type == bl('STRM'):
+            # The remote function returned an iterator; the result is a Stream
+            # receiving the items that follow.
+            callback, cmd = self._rpc_in_progress.pop(seq, (None, None))
+            if self._issued_started:
+                self._record_issued(seq, cmd, 0, False)
+            if self._call_queue:
+                self._send_queued_calls()
             if callback is None:
                 return True
-            del self._rpc_in_progress[seq]
-            callback.finish(payload)
+            stream = self._rpc_streams[seq] = Stream(cmd, self, seq)
+            callback.finish(stream)
+            return True
+
+        if packet_type == bl('ITEM'):
+            stream = self._rpc_streams.get(seq)
+            if stream:
+                stream._push(self._loads(payload), len(payload))
+            return True
+
+        if packet_type == bl('SEND'):
+            stream = self._rpc_streams.pop(seq, None)
+            if stream:
+                stream._end()
             return True
 
         if packet_type == bl('EXCP'):
             # Exception for remote call
             try:
-                exc_value, stack = cPickle.loads(payload)
+                exc_value, stack = self._loads(payload)
             except Exception, e:
                 exc_value, stack = e, ''
-            callback, cmd = self._rpc_in_progress.get(seq)
-            if callback is None:
+            if seq in self._rpc_streams:
+                # Exception while iterating a stream
+                stream = self._rpc_streams.pop(seq)
+                remote_exc = RemoteException(exc_value, stack, stream.cmd)
+                stream._throw(remote_exc.__class__, remote_exc, None)
                 return True
-            del self._rpc_in_progress[seq]
-            remote_exc = RemoteException(exc_value, stack, cmd)
-            callback.throw(remote_exc.__class__, remote_exc, None)
+            self._handle_exception(seq, exc_value, stack, len(payload))
             return True
 
         log.error('unknown packet type %s', packet_type)
@@ -579,6 +1939,33 @@ class Channel(Object):
         Step 1 happens when a new connection is initiated.  Steps 2-4 happen in
         this function.  3 packets are sent in this handshake (steps 1-3).
 
+        The AUTH packet in step 1 and the RESP packet in step 2 may carry
+        handshake options following the challenge, response and salt, which
+        are used to negotiate the channel codec and compressor: the server
+        offers codecs and compressors and the client replies with its
+        choice.  Unless disabled, the server also offers the protocol
+        extensions it supports (RPC_FEATURES), and the client replies with
+        those it supports too.  Options are only sent if there is something
+        to negotiate, so peers not supporting them can still authenticate
+        with servers that offer nothing.
+
+        If the server offers session tickets and the client accepts them,
+        the RESP packet in step 3 carries a random single-use ticket.  When
+        the client connects again, it doesn't wait for the challenge but
+        sends the ticket, along with a nonce and its response to the ticket
+        salted with the nonce (RSUM packet).  The server validates the
+        ticket and the response, and replies with its own response to the
+        nonce salted with the ticket and a new ticket (RSUM packet), or with
+        a null response if the ticket is unknown or expired, in which case
+        the client responds to the challenge from step 1 as usual.  Tickets
+        restore the codec, compressor and extensions negotiated before.
+
+        Clients may pipeline calls (i.e. send CALL packets before
+        authentication is complete) after sending a RESP or RSUM packet, up
+        to RPC_PIPELINE_MAX bytes.  The server processes them after the
+        authentication packet preceding them succeeded, or, if a resumption
+        was rejected, discards them; the client then sends them again.
+
         WARNING: once authentication succeeds, there is implicit full trust.
         There is no security after that point, and it should be assumed that
         the client can invoke arbitrary calls on the server, and vice versa,
@@ -606,15 +1993,21 @@ class Channel(Object):
             self.close()
 
 
-        if packet_type not in (bl('AUTH'), bl('RESP')):
+        if packet_type not in RPC_AUTH_PACKETS:
+            if self._discard_budget is not None and packet_type == bl('CALL'):
+                # A call pipelined by the client after a rejected session
+                # resumption, which it will send again.
+                self._discard_budget -= len(payload) + RPC_PACKET_HEADER_SIZE
+                if self._discard_budget >= 0:
+                    return
             # Received a non-auth command while expecting auth.
             return panic(IOError('got %s before authentication is complete; closing socket.' % packet_type))
 
         try:
-            # Payload could safely be longer than 20+20+20 bytes, but if it
-            # is, something isn't quite right.  We'll be paranoid and
-            # disconnect unless it's exactly 60 bytes.
-            assert(len(payload) == 60)
+            # The payload is 20+20+20 bytes, followed by handshake options
+            # which must be short.  If it is longer, something isn't quite
+            # right, so we'll be paranoid and disconnect.
+            assert(60 <= len(payload) <= 60 + RPC_AUTH_OPTIONS_MAX)
 
             # Unpack the auth packet payload into three separate 20 byte
             # strings: the challenge, response, and salt.  If challenge is
@@ -622,31 +2015,77 @@ class Channel(Object):
             # a response.  If response is not NULL then salt must also not
             # be NULL, and the salt is used along with the previously sent
             # challenge to validate the response.
-            challenge, response, salt = struct.unpack("20s20s20s", payload)
-        except (AssertionError, struct.error):
+            challenge, response, salt = struct.unpack("20s20s20s", payload[:60])
+            options = _unpack_auth_options(payload[60:])
+        except (AssertionError, struct.error, ValueError, UnicodeError):
             return panic(IOError('Malformed authentication packet from remote; disconnecting.'))
 
         # At this point, challenge, response, and salt are 20 byte strings of
-        # arbitrary binary data.  They're considered benign.
+        # arbitrary binary data, and options is a dict of short alphanumeric
+        # strings.  They're considered benign.
 
         if packet_type == bl('AUTH'):
             # Step 2: We've received a challenge.  If we've already sent a
             # challenge (which is the case if _pending_challenge is not None),
             # then something isn't right.  This could be a DoS so we'll
             # disconnect immediately.
-            if self._pending_challenge:
-                self._pending_challenge = None
+            if self._pending_challenge or self._deferred_challenge:
+                self._pending_challenge = self._deferred_challenge = None
                 self.close()
                 return
-
-            # Otherwise send the response, plus a challenge of our own.
-            response, salt = self._get_challenge_response(challenge)
-            self._pending_challenge = self._get_rand_value()
-            payload = struct.pack("20s20s20s", self._pending_challenge, response, salt)
-            self._send_packet(seq, 'RESP', payload)
-            log.debug('Got initial challenge from server, sending response.')
+            # The challenge may be read before the socket's connect callback
+            # got a chance to send our session ticket.
+            self._try_resume()
+            if self._resuming:
+                # We are resuming a session and only need to respond if the
+                # server rejects the ticket.
+                self._deferred_challenge = seq, challenge, options
+                return
+            self._respond_to_challenge(seq, challenge, options)
             return
 
+        elif packet_type == bl('RSUM'):
+            if self._resuming:
+                # The server's reply to our session ticket.
+                ticket, nonce = self._resuming
+                self._resuming = None
+                if response == struct.pack('20s', ''):
+                    log.debug('Session ticket rejected, falling back to challenge.')
+                    self._handle_resume_rejected()
+                    return
+                if response != self._get_challenge_response(nonce, ticket)[0]:
+                    return panic(IOError('Peer failed authentication.'))
+                try:
+                    self._auth_apply_options(options)
+                except ValueError, e:
+                    return panic(IOError('Invalid authentication options: %s' % e))
+                log.debug('Session resumed, remote authenticated.')
+                return self._handle_authenticated()
+
+            if self.channel_type != 'server' or self._pending_challenge is None:
+                return panic(IOError('Unexpectedly received session ticket; disconnecting.'))
+            # A client resuming a session: challenge is the ticket and salt
+            # the client's nonce.
+            info = self._tickets.pop(challenge, None) if self._tickets is not None else None
+            if not info or info[0] < notifier.monotonic() or \
+               response != self._get_challenge_response(challenge, salt)[0]:
+                # The client falls back to responding to our challenge and
+                # sends pipelined calls again.
+                self._discard_budget = RPC_PIPELINE_MAX
+                self._send_packet(seq, 'RSUM', struct.pack("20s20s20s", '', '', ''))
+                log.debug('Rejected session ticket, waiting for response to challenge.')
+                return
+            self._pending_challenge = None
+            self._codec = CODECS[info[1]]
+            if info[2]:
+                self._compressor = (info[2],) + COMPRESSORS[info[2]]
+            self._features = info[3]
+            payload = struct.pack("20s20s20s", '', self._get_challenge_response(salt, challenge)[0], '')
+            payload += _pack_auth_options({'ticket': self._issue_ticket()})
+            self._send_packet(seq, 'RSUM', payload)
+            log.debug('Valid session ticket received, remote authenticated.')
+            return self._handle_authenticated()
+
         elif packet_type == bl('RESP'):
             # We've received a reply to an auth request.
 
@@ -667,12 +2106,13 @@ class Channel(Object):
             # Now check to see if we were sent what we expected.
             if response != expected_response:
                 return panic(IOError('Peer failed authentication.'))
-
-            # Challenge response was good, so the remote is considered
-            # authenticated now.  We increase the chunk size on the socket
-            # so we read more at once.
-            self._authenticated = True
-            self._socket.chunk_size = 1024*1024
+            if options:
+                # Options chosen by the client from the ones we offered, or
+                # the session ticket the server issued us.
+                try:
+                    self._auth_apply_options(options)
+                except ValueError, e:
+                    return panic(IOError('Invalid authentication options: %s' % e))
             log.debug('Valid response received, remote authenticated.')
 
             # If remote has issued a counter-challenge along with their
@@ -687,13 +2127,113 @@ class Channel(Object):
             if len(challenge.strip(bl('\x00'))) != 0:
                 response, salt = self._get_challenge_response(challenge)
                 payload = struct.pack("20s20s20s", '', response, salt)
+                if options.get('tickets') and self._tickets is not None:
+                    payload += _pack_auth_options({'ticket': self._issue_ticket()})
                 self._send_packet(seq, 'RESP', payload)
                 log.debug('Sent response to challenge from client.')
+            self._handle_authenticated()
+
+
+    def _respond_to_challenge(self, seq, challenge, options):
+        """
+        Sends the response to the server's challenge, plus a challenge of our
+        own and our choice of the options offered (client side).
+        """
+        response, salt = self._get_challenge_response(challenge)
+        self._pending_challenge = self._get_rand_value()
+        payload = struct.pack("20s20s20s", self._pending_challenge, response, salt)
+        options = self._auth_accept_options(options)
+        if options:
+            payload += _pack_auth_options(options)
+        self._send_packet(seq, 'RESP', payload)
+        log.debug('Got initial challenge from server, sending response.')
+        if self._pipeline:
+            self._start_pipelining()
+
+
+    def _try_resume(self):
+        """
+        Sends a session ticket for the server if we have one, once per
+        connection (client side).
+        """
+        if self._resume_tried or not self._ticket_key:
+            return
+        self._resume_tried = True
+        ticket = self._take_ticket()
+        if ticket:
+            self._send_resume(ticket)
+
+
+    def _send_resume(self, ticket):
+        """
+        Sends a session ticket instead of waiting for the server's challenge
+        (client side).
+        """
+        ticket, expiry, codec, compressor, features = ticket
+        nonce = self._get_rand_value()
+        self._resuming = ticket, nonce
+        # Calls are pipelined with the codec, compressor and features of the
+        # session.
+        self._codec = CODECS[codec]
+        self._compressor = (compressor,) + COMPRESSORS[compressor] if compressor else None
+        self._features = features
+        payload = struct.pack("20s20s20s", ticket, self._get_challenge_response(ticket, nonce)[0], nonce)
+        self._send_packet(0, 'RSUM', payload)
+        if self._pipeline:
+            self._start_pipelining()
+
+
+    def _handle_resume_rejected(self):
+        """
+        Falls back to the challenge/response handshake after the server
+        rejected our session ticket (client side).
+        """
+        self._codec = CODECS['pickle']
+        self._compressor = None
+        self._features = frozenset()
+        # The server discarded the calls we pipelined, so send them again
+        # once they may be pipelined again.
+        for call in reversed(self._pipelined_calls):
+            seq, callback = call[:2]
+            self._rpc_in_progress.pop(seq, None)
+            self._issued_started.pop(seq, None)
+            if not callback.finished:
+                self._call_queue.appendleft(call)
+        self._pipelined_calls = []
+        self._pipelining = False
+        if self._deferred_challenge:
+            seq, challenge, options = self._deferred_challenge
+            self._deferred_challenge = None
+            self._respond_to_challenge(seq, challenge, options)
+
+
+    def _start_pipelining(self):
+        """
+        Sends queued calls before authentication is complete (client side).
+        """
+        self._pipelining = True
+        self._pipeline_budget = RPC_PIPELINE_MAX
+        self._send_queued_calls()
+
 
-            # Empty deferred write buffer now that we're authenticated.
-            self._write(bl('').join(self._write_buffer_deferred))
-            self._write_buffer_deferred = []
-            self._handle_connected()
+    def _handle_authenticated(self):
+        """
+        Called when the remote is authenticated.
+        """
+        # We increase the chunk size on the socket so we read more at once.
+        self._authenticated = True
+        self._socket.chunk_size = 1024*1024
+        self._pipelining = False
+        self._pipelined_calls = []
+        self._deferred_challenge = None
+        self._discard_budget = None
+        # Empty deferred write buffer now that we're authenticated, and send
+        # the calls issued meanwhile.
+        self._write(bl('').join(self._write_buffer_deferred))
+        self._write_buffer_deferred = []
+        if self._call_queue:
+            self._send_queued_calls()
+        self._handle_connected()
 
 
     def _handle_connected(self):
@@ -720,9 +2260,136 @@ class Channel(Object):
         """
         self._pending_challenge = self._get_rand_value()
         payload = struct.pack("20s20s20s", self._pending_challenge, '', '')
+        options = self._auth_offer_options()
+        if options:
+            payload += _pack_auth_options(options)
         self._send_packet(0, 'AUTH', payload)
 
 
+    def _auth_offer_options(self):
+        """
+        Returns the handshake options offered to the client with the initial
+        challenge (server side).
+        """
+        options = {}
+        if self._codecs:
+            options['codecs'] = ','.join(self._codecs)
+        if self._compressors:
+            options['compressors'] = ','.join(self._compressors)
+        if self._tickets is not None:
+            options['tickets'] = '1'
+        if self._offer_features:
+            options['features'] = ','.join(RPC_FEATURES)
+        return options
+
+
+    def _auth_accept_options(self, offer):
+        """
+        Chooses from the handshake options offered by the server and returns
+        the options to send back with the response (client side).
+        """
+        options = {}
+        if 'codecs' in offer:
+            offered = offer['codecs'].split(',')
+            # Our own preference takes precedence if we have one.
+            for name in (self._codecs or offered):
+                if name in offered and name in CODECS:
+                    self._codec = CODECS[name]
+                    break
+            options['codec'] = self._codec.name
+        if 'compressors' in offer:
+            offered = offer['compressors'].split(',')
+            # Unlike codecs, compression can be declined with an empty list.
+            for name in (offered if self._compressors is None else self._compressors):
+                if name in offered and name in COMPRESSORS:
+                    self._compressor = (name,) + COMPRESSORS[name]
+                    options['compressor'] = name
+                    break
+        if 'tickets' in offer and self._ticket_key:
+            options['tickets'] = '1'
+        if 'features' in offer:
+            offered = offer['features'].split(',')
+            self._features = frozenset(name for name in RPC_FEATURES if name in offered)
+            options['features'] = ','.join(sorted(self._features))
+        return options
+
+
+    def _auth_apply_options(self, options):
+        """
+        Applies the handshake options chosen by the client (server side), or
+        stores the session ticket issued by the server (client side).
+        Raises ValueError if the client chose something that wasn't offered.
+        """
+        if 'ticket' in options and self._ticket_key:
+            self._store_ticket(options['ticket'])
+        if 'codec' in options:
+            name = options['codec']
+            if name != 'pickle' and name not in (self._codecs or []):
+                raise ValueError('codec %s was not offered' % name)
+            self._codec = CODECS[name]
+        if 'compressor' in options:
+            name = options['compressor']
+            if name not in (self._compressors or []):
+                raise ValueError('compressor %s was not offered' % name)
+            self._compressor = (name,) + COMPRESSORS[name]
+        if 'features' in options:
+            features = frozenset(name for name in options['features'].split(',') if name)
+            if not features.issubset(RPC_FEATURES):
+                raise ValueError('features %s were not offered' % options['features'])
+            self._features = features
+
+
+    def _issue_ticket(self):
+        """
+        Creates a session ticket for the client and returns it as handshake
+        option (server side).
+        """
+        now = notifier.monotonic()
+        if len(self._tickets) >= RPC_TICKETS_MAX:
+            for ticket, info in self._tickets.items():
+                if info[0] < now:
+                    del self._tickets[ticket]
+            while len(self._tickets) >= RPC_TICKETS_MAX:
+                self._tickets.popitem()
+        ticket = self._get_rand_value()
+        compressor = self._compressor[0] if self._compressor else ''
+        self._tickets[ticket] = (now + self._ticket_lifetime, self._codec.name, compressor, self._features)
+        return '%s,%d' % (binascii.hexlify(ticket), self._ticket_lifetime)
+
+
+    def _store_ticket(self, option):
+        """
+        Stores the session ticket issued by the server for the next
+        connection (client side).  Raises ValueError if it is malformed.
+        """
+        ticket, lifetime = option.split(',')
+        try:
+            ticket = binascii.unhexlify(ticket)
+        except TypeError:
+            raise ValueError('malformed session ticket')
+        if len(ticket) != 20:
+            raise ValueError('malformed session ticket')
+        tickets = _session_tickets.get(self._ticket_key)
+        if tickets is None:
+            tickets = _session_tickets[self._ticket_key] = collections.deque(maxlen=RPC_CLIENT_TICKETS)
+        compressor = self._compressor[0] if self._compressor else ''
+        tickets.append((ticket, notifier.monotonic() + int(lifetime), self._codec.name, compressor,
+                        self._features))
+
+
+    def _take_ticket(self):
+        """
+        Returns a valid session ticket for the server, if we have one
+        (client side).
+        """
+        tickets = _session_tickets.get(self._ticket_key)
+        now = notifier.monotonic()
+        while tickets:
+            ticket = tickets.pop()
+            if ticket[1] > now and ticket[2] in CODECS:
+                return ticket
+
+
     def _get_challenge_response(self, challenge, salt = None):
         """
         Generate a response for the challenge based on the auth secret supplied
@@ -778,13 +2445,30 @@ CONNECTED = 'CONNECTED'
 class Client(Channel):
     """
     RPC client to be connected to a server.
+
+    codecs is a list of payload codec names the client is willing to use, in
+    order of preference.  If None, the client uses the codec the server
+    prefers, provided it is registered locally.
+
+    compressors likewise is a list of payload compressors the client is
+    willing to use.  If None, the client uses the compressor the server
+    prefers, if the server offers compression; an empty list declines
+    compression.
+
+    If pipeline is True, calls can be issued while the connection is being
+    set up, and are sent along with the response to the server's challenge
+    (or with the session ticket, if the server issued one before), saving a
+    round trip.  They are sent before the server is authenticated, though.
     """
 
     channel_type = 'client'
 
-    def __init__(self, address, auth_secret = '', buffer_size = None, retry = None):
-        super(Client, self).__init__(kaa.Socket(buffer_size), auth_secret)
-        self._socket.connect(address).exception.connect(self._handle_refused)
+    def __init__(self, address, auth_secret = '', buffer_size = None, retry = None, codecs = None,
+                 compressors = None, pipeline = False):
+        super(Client, self).__init__(kaa.Socket(buffer_size), auth_secret, codecs, compressors)
+        self._pipeline = pipeline
+        self._ticket_key = (repr(address), self._auth_secret)
+        self._connect(address)
         self.monitoring = False
         if retry is not None:
             self._monitor(address, buffer_size, retry)
@@ -797,9 +2481,20 @@ class Client(Channel):
         self.status = CONNECTED
         super(Client, self)._handle_connected()
 
+    def _connect(self, address):
+        ip = self._socket.connect(address)
+        ip.connect(self._handle_socket_connected)
+        ip.exception.connect(self._handle_refused)
+
+    def _handle_socket_connected(self, result):
+        self._try_resume()
+
     def _handle_refused(self, type, value, tb):
         self._socket.signals['read'].disconnect(self._handle_read)
         self._socket.signals['closed'].disconnect(self._handle_close)
+        while self._call_queue:
+            # Calls issued while connecting with pipelining enabled
+            self._call_queue.popleft()[1].throw(type, value, tb)
         self._connect_inprogress.throw(type, value, tb)
         return False
 
@@ -828,31 +2523,354 @@ class Client(Channel):
             self.status = DISCONNECTED
             # wait some time until we retry
             yield kaa.delay(retry)
+            if not self.monitoring:
+                # Reconnecting was disabled in the meantime.
+                break
             # reset variables
             self._authenticated = False
             self._pending_challenge = None
-            self._read_buffer = []
+            self._read_header = bl('')
+            self._read_packet = None
+            self._read_packets.clear()
+            self._codec = CODECS['pickle']
+            self._compressor = None
+            self._features = frozenset()
+            self._rpc_running = {}
+            self._deadline_timers = {}
+            self._served_started = {}
+            self._issued_started = {}
+            self._resume_tried = False
+            self._resuming = self._deferred_challenge = None
+            self._pipelining = False
+            self._pipelined_calls = []
             self.status = CONNECTING
             self._socket = kaa.Socket(buffer_size)
             self._socket.chunk_size = 1024
+            self._socket.zero_copy = True
             self._socket.signals['read'].connect(self._handle_read)
             self._socket.signals['closed'].connect(self._handle_close)
-            self._socket.connect(address).exception.connect(self._handle_refused)
+            self._connect(address)
 
 
 # expose Client as connect
 connect = Client
 
 
-def expose(command=None, add_client=False, coroutine=False):
+class ClientPool(Object):
+    """
+    Pool of RPC client connections to one or more servers.
+
+    address is the address of a server, or a list of addresses.  size
+    connections are maintained to each of them, and calls are issued on the
+    connection with the fewest outstanding calls.  Lost connections are
+    reestablished in the background every retry seconds, and connections are
+    excluded from use until they are authenticated again.
+
+    Every health_interval seconds, connections are pinged (see
+    :meth:`Channel.ping`) and those that don't answer within health_timeout
+    seconds are closed and reconnected.  Pass None as health_interval for
+    servers that don't support pings.
+
+    The remaining arguments are passed to :class:`~kaa.rpc.Client`.  The pool
+    is connected when any of its connections is, so
+    ``yield kaa.inprogress(pool)`` waits for the first connection.
+    """
+    def __init__(self, address, auth_secret = '', size = 1, buffer_size = None, retry = 1,
+                 codecs = None, compressors = None, health_interval = 10, health_timeout = 5):
+        super(ClientPool, self).__init__()
+        self._connect_inprogress = kaa.InProgress()
+        # Index of the client to consider first, rotated on each call so that
+        # calls are spread when clients are equally busy.
+        self._next = 0
+        self._objects = []
+        self.clients = []
+        for address in (address if isinstance(address, list) else [address]):
+            for i in range(size):
+                client = Client(address, auth_secret, buffer_size, retry, codecs, compressors)
+                client.signals['open'].connect_weak(self._handle_open)
+                self.clients.append(client)
+        self._health_timer = None
+        if health_interval:
+            self._health_timer = kaa.WeakTimer(self._check_health, health_timeout)
+            self._health_timer.start(health_interval)
+
+
+    @property
+    def connected(self):
+        """
+        True if any of the connections in the pool is usable.
+        """
+        for client in self.clients:
+            if client.connected:
+                return True
+        return False
+
+
+    def register(self, obj):
+        """
+        Registers one or more previously exposed callables to the servers
+        on all connections of the pool.
+        """
+        self._objects.append(obj)
+        for client in self.clients:
+            client.register(obj)
+
+
+    def rpc(self, cmd, *args, **kwargs):
+        """
+        Call the remote command on the least busy connection and return
+        InProgress.
+        """
+        if not CoreThreading.is_mainthread():
+            callback = _CallInProgress()
+            kwargs['_kaa_rpc_callback'] = callback
+            kaa.MainThreadCallable(self.rpc)(cmd, *args, **kwargs)
+            return callback
+
+        client = self._choose()
+        if not client:
+            raise NotConnectedError()
+        return client.rpc(cmd, *args, **kwargs)
+
+
+    def rpc_timeout(self, timeout, cmd, *args, **kwargs):
+        """
+        Call the remote command with a deadline on the least busy connection
+        (see :meth:`Channel.rpc_timeout`) and return InProgress.
+        """
+        if not CoreThreading.is_mainthread():
+            callback = _CallInProgress()
+            kwargs['_kaa_rpc_callback'] = callback
+            kaa.MainThreadCallable(self.rpc_timeout)(timeout, cmd, *args, **kwargs)
+            return callback
+
+        client = self._choose()
+        if not client:
+            raise NotConnectedError()
+        return client.rpc_timeout(timeout, cmd, *args, **kwargs)
+
+
+    def close(self):
+        """
+        Closes all connections of the pool.
+        """
+        if self._health_timer:
+            self._health_timer.stop()
+        for client in self.clients:
+            client.monitoring = False
+            if client.connected:
+                client.close()
+
+
+    def _choose(self):
+        """
+        Returns the connected client with the fewest outstanding calls, or
+        None if no client is connected.
+        """
+        best = None
+        n = len(self.clients)
+        for i in range(n):
+            client = self.clients[(self._next + i) % n]
+            if client.connected and (not best or len(client._rpc_in_progress) < len(best._rpc_in_progress)):
+                best = client
+        self._next = (self._next + 1) % n
+        return best
+
+
+    def _handle_open(self):
+        if not self._connect_inprogress.finished:
+            self._connect_inprogress.finish(self)
+
+
+    def _check_health(self, timeout):
+        for client in self.clients:
+            if client.connected:
+                ping = client.ping()
+                ping.timeout(timeout).exception.connect(self._handle_unhealthy, client)
+                # Pings outstanding when the connection is closed fail as
+                # well, which needs no further handling.
+                ping.exception.connect(lambda *args: False)
+
+
+    def _handle_unhealthy(self, tp, exc, tb, client):
+        if client.connected:
+            log.warning('rpc connection %s not responding; reconnecting', client)
+            client.close()
+        # Handled; the connection is excluded until it is reestablished.
+        return False
+
+
+    def __inprogress__(self):
+        return self._connect_inprogress
+
+
+    def __repr__(self):
+        return '<kaa.rpc.ClientPool %d/%d connected>' % \
+               (len([c for c in self.clients if c.connected]), len(self.clients))
+
+
+def _call_in_process(data):
+    """
+    Invokes an exposed function in a process pool worker.  data is the
+    pickled (func, args, kwargs).  Returns (True, pickled result), or (False,
+    exception) if the function raised, or if the call or result couldn't be
+    pickled.  Nothing must fail outside of this function, because a pool only
+    invokes the callback of apply_async on success.
+    """
+    try:
+        func, args, kwargs = cPickle.loads(data)
+        return True, cPickle.dumps(func(*args, **kwargs), PICKLE_PROTOCOL)
+    except Exception, e:
+        try:
+            cPickle.dumps(e, PICKLE_PROTOCOL)
+        except Exception:
+            e = Exception(py3_b(e))
+        return False, e
+
+
+class _Dispatcher(object):
+    """
+    Runs an exposed function in a thread or process pool, and limits the
+    number of concurrent invocations of the function.
+    """
+    def __init__(self, pool, concurrency):
+        self.pool = pool
+        self.concurrency = concurrency
+        self.running = 0
+        # (InProgress, func, args, kwargs) waiting for a free slot
+        self.waiting = collections.deque()
+
+
+    def __call__(self, func, args, kwargs):
+        ip = kaa.InProgress()
+        if self.concurrency and self.running >= self.concurrency:
+            job = (ip, func, args, kwargs)
+            self.waiting.append(job)
+            ip.signals['abort'].connect(self._abort_waiting, job)
+        else:
+            self._start(ip, func, args, kwargs)
+        return ip
+
+
+    def _abort_waiting(self, exc, job):
+        try:
+            self.waiting.remove(job)
+        except ValueError:
+            pass
+
+
+    def _start(self, ip, func, args, kwargs):
+        self.running += 1
+        try:
+            if self.pool is None:
+                result = func(*args, **kwargs)
+            elif hasattr(self.pool, 'apply_async'):
+                # multiprocessing pool; its callback is invoked from a thread.
+                # The call is pickled here, so that it fails right away if it
+                # can't be (e.g. a method), rather than in the pool, which
+                # would never answer it.
+                data = cPickle.dumps((func, args, kwargs), PICKLE_PROTOCOL)
+                result = kaa.InProgress()
+                self.pool.apply_async(_call_in_process, (data,),
+                                      callback=kaa.MainThreadCallable(self._process_done, result))
+            else:
+                result = kaa.ThreadPoolCallable(self.pool, func)(*args, **kwargs)
+        except Exception:
+            self._done()
+            ip.throw(*sys.exc_info())
+            return
+
+        if not isinstance(result, kaa.InProgress):
+            self._done()
+            ip.finish(result)
+            return
+
+        def finished(value):
+            self._done()
+            if not ip.finished:
+                ip.finish(value)
+
+        def failed(tp, exc, tb):
+            self._done()
+            if not ip.finished:
+                ip.throw(tp, exc, tb)
+            return False
+
+        def abort(exc):
+            if result.abortable and not result.finished:
+                try:
+                    result.abort(exc)
+                except (RuntimeError, InProgressAborted):
+                    pass
+
+        if result.finished:
+            # e.g. a coroutine that didn't need to yield
+            try:
+                value = result.result
+            except Exception:
+                failed(*sys.exc_info())
+            else:
+                finished(value)
+            return
+        result.connect_both(finished, failed)
+        ip.signals['abort'].connect(abort)
+
+
+    def _process_done(self, answer, result):
+        success, value = answer
+        if success:
+            try:
+                value = cPickle.loads(value)
+            except Exception:
+                return result.throw(*sys.exc_info())
+            result.finish(value)
+        else:
+            result.throw(value.__class__, value, None)
+
+
+    def _done(self):
+        self.running -= 1
+        while self.waiting and (not self.concurrency or self.running < self.concurrency):
+            ip, func, args, kwargs = self.waiting.popleft()
+            ip.signals['abort'].disconnect(self._abort_waiting)
+            self._start(ip, func, args, kwargs)
+
+
+def expose(command=None, add_client=False, coroutine=False, pool=None, concurrency=None, stream=False):
     """
     Decorator to expose a function. If add_client is True, the client
     object will be added to the command list as first argument.
+
+    If stream is True and the function returns an iterator (e.g. a generator)
+    or a file object, possibly through an InProgress, the items are streamed
+    to the caller, who receives a :class:`~kaa.rpc.Stream`.  Callers that
+    don't support streams receive a list of all items (for files, their
+    contents) instead.
+
+    If pool is given, the function is invoked in that pool rather than in
+    the main loop, and the answer is sent once it returns.  pool is a
+    :class:`~kaa.ThreadPool` or the name of a registered thread pool, or a
+    multiprocessing pool, in which case the function, its arguments and its
+    result must be picklable (so it must not be a method); otherwise the
+    call fails.
+
+    If concurrency is given, at most that many invocations of the function
+    are running at a time; further calls wait until one finishes.  This
+    keeps a busy function from occupying all threads of a shared pool.
     """
+    if pool is not None and coroutine:
+        raise ValueError('coroutines cannot be dispatched to a pool')
+    if pool is not None and add_client and hasattr(pool, 'apply_async'):
+        raise ValueError('the client cannot be passed to a process pool')
+    if pool is not None and stream and hasattr(pool, 'apply_async'):
+        raise ValueError('iterators cannot be returned from a process pool')
+
     def decorator(func):
         if coroutine:
             func = kaa.coroutine()(func)
         func._kaa_rpc = command or func.func_name
-        func._kaa_rpc_param = ( add_client, )
+        func._kaa_rpc_param = ( add_client, stream )
+        if pool is not None or concurrency:
+            func._kaa_rpc_dispatcher = _Dispatcher(pool, concurrency)
         return func
     return decorator
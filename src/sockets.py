@@ -47,6 +47,9 @@ log = logging.getLogger('kaa.base.sockets')
 
 TIMEOUT_SENTINEL = getattr(socket, '_GLOBAL_DEFAULT_TIMEOUT', object())
 
+# Python 2 doesn't define SO_REUSEPORT, although Linux supports it since 3.9.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
 
 # Implement functions for converting between interface names and indexes.
 # Unfortunately these functions are not provided by the standard Python
@@ -215,7 +218,9 @@ class Socket(IOChannel):
 
     @staticmethod
     def create_connection(addr=None, timeout=TIMEOUT_SENTINEL, source_address=None,
-                          overwrite=False, ipv6=True):
+                          overwrite=False, ipv6=True, reuse_port=False):
+        if reuse_port and SO_REUSEPORT is None:
+            raise ValueError('SO_REUSEPORT is not supported on this platform')
         addr = Socket.normalize_address(addr) if addr else None
         source_address = Socket.normalize_address(source_address) if source_address else None
 
@@ -282,6 +287,8 @@ class Socket(IOChannel):
                 try:
                     sock = socket.socket(b_af, b_socktype, b_proto)
                     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    if reuse_port:
+                        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
                     b_sa = b_sa[:2] + source_address[2:]
                     sock.bind(b_sa if b_af == socket.AF_INET6 else b_sa[:2])
                 except socket.error:
@@ -555,7 +562,7 @@ class Socket(IOChannel):
 
 
 
-    def listen(self, addr, backlog=5, ipv6=True):
+    def listen(self, addr, backlog=5, ipv6=True, reuse_port=False):
         """
         Set the socket to accept incoming connections.
 
@@ -572,6 +579,13 @@ class Socket(IOChannel):
                      a hostname that contains both AAAA and A records.  If addr
                      is specified as an IP address, this argument does nothing.
         :type ipv6: bool
+        :param reuse_port: if True, sets SO_REUSEPORT on the socket, so that
+                           several sockets (e.g. in the processes started by
+                           :func:`kaa.utils.fork_workers`) can listen on the
+                           same TCP address, and the kernel balances incoming
+                           connections between them.  Only supported on Linux
+                           3.9 and later.
+        :type reuse_port: bool
         :raises: ValueError if *addr* is invalid, or socket.error if the bind fails.
 
         If *addr* is given as a 4-tuple, it is in the form ``(host, service,
@@ -607,7 +621,7 @@ class Socket(IOChannel):
         connection.  Callbacks connecting to the signal will receive a new
         Socket object representing the client connection.
         """
-        sock = Socket.create_connection(source_address=addr, overwrite=True)
+        sock = Socket.create_connection(source_address=addr, overwrite=True, reuse_port=reuse_port)
         sock.listen(backlog)
         self._listening = True
         self.wrap(sock, IO_READ | IO_WRITE)
@@ -708,10 +722,25 @@ class Socket(IOChannel):
         return self._channel.recv(size)
 
 
+    def _read_into(self, buf):
+        return self._channel.recv_into(buf)
+
+
     def _write(self, data):
         return self._channel.send(data)
 
 
+    def _writev(self, buffers):
+        if hasattr(self._channel, 'sendmsg'):
+            return self._channel.sendmsg(buffers)
+        return super(Socket, self)._writev(buffers)
+
+
+    def _can_writev(self):
+        return self._can_use('_writev', '_write') and \
+               (hasattr(self._channel, 'sendmsg') or hasattr(os, 'writev'))
+
+
     def _accept(self):
         """
         Accept a new connection and return a new Socket object.
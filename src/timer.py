@@ -25,8 +25,8 @@
 from __future__ import absolute_import
 
 __all__ = [ 'timed', 'Timer', 'WeakTimer', 'OneShotTimer', 'WeakOneShotTimer',
-            'AtTimer', 'OneShotAtTimer', 'delay', 'POLICY_ONCE', 'POLICY_MANY',
-            'POLICY_RESTART' ]
+            'AtTimer', 'OneShotAtTimer', 'delay', 'set_timer_slack',
+            'POLICY_ONCE', 'POLICY_MANY', 'POLICY_RESTART' ]
 
 import logging
 import datetime
@@ -118,6 +118,29 @@ def delay(seconds):
     return ip
 
 
+def set_timer_slack(seconds):
+    """
+    Allow timers to be delayed by up to the given number of seconds, so
+    that timers expiring close to each other are handled in a single wakeup
+    of the main loop.
+
+    :param seconds: the maximum delay; 0 (the default) disables coalescing.
+    :type seconds: float
+
+    This reduces the number of wakeups on mostly idle systems with many
+    timers, at the expense of timer precision.  Timers never fire earlier
+    than their interval.
+    """
+    notifier.timer_slack(seconds * 1000.0)
+
+
+def _timedelta_seconds(delta):
+    """
+    Returns the given timedelta as seconds (float).
+    """
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+
+
 class Timer(notifier.NotifierCallback):
     """
     Invokes the supplied callback after the supplied interval (passed to
@@ -159,6 +182,8 @@ class Timer(notifier.NotifierCallback):
         tasks running in the main loop.  For example, if another task
         (a different timer, or I/O callback) blocks the mainloop for longer
         than the given timer interval, the callback will be invoked late.
+        Timers are based on a monotonic clock with sub-millisecond
+        resolution, so they are not affected by changes of the system time.
 
         This method may safely be called from a thread, however the timer
         callback will be invoked from the main thread.
@@ -169,7 +194,7 @@ class Timer(notifier.NotifierCallback):
             self.unregister()
         if now:
             self()
-        self._id = notifier.timer_add(int(interval * 1000), self)
+        self._id = notifier.timer_add(interval * 1000.0, self)
         self.__interval = interval
 
 
@@ -311,11 +336,34 @@ class OneShotAtTimer(OneShotTimer):
             tmrw = t + datetime.timedelta(days = 1)
             next = tmrw.replace(hour = hour[0], minute = min[0], second = sec[0])
 
-        delta = next - now
-        super(OneShotAtTimer, self).start(delta.seconds + delta.microseconds / 1000000.0)
+        super(OneShotAtTimer, self).start(_timedelta_seconds(next - now))
         self._last_time = next
 
 
+    def _fired_early(self):
+        """
+        Internal function to check if the timer fired before the scheduled
+        time of day.  Timers run on a monotonic clock, so this happens when
+        the system time was set back after the timer was started.  In that
+        case the timer is restarted for the remaining time and True is
+        returned.
+        """
+        if not getattr(self, '_last_time', None):
+            return False
+        remaining = _timedelta_seconds(self._last_time - datetime.datetime.now())
+        if remaining < 0.5:
+            # Allow for some imprecision between the two clocks.
+            return False
+        super(OneShotAtTimer, self).start(remaining)
+        return True
+
+
+    def __call__(self, *args, **kwargs):
+        if self._fired_early():
+            return True
+        return super(OneShotAtTimer, self).__call__(*args, **kwargs)
+
+
     @property
     def hours(self):
         """
@@ -354,5 +402,7 @@ class AtTimer(OneShotAtTimer):
     A timer that is triggered at a specific time or times of day.
     """
     def __call__(self, *args, **kwargs):
+        if self._fired_early():
+            return True
         if super(Timer, self).__call__(*args, **kwargs) != False:
             self._schedule_next()
@@ -24,12 +24,15 @@
 from __future__ import absolute_import
 
 __all__ = [
-    'tempfile', 'which', 'Lock', 'daemonize', 'is_running', 'set_running',
+    'tempfile', 'which', 'Lock', 'daemonize', 'fork_workers', 'worker_index',
+    'is_running', 'set_running',
     'set_process_name', 'get_num_cpus', 'get_machine_uuid', 'get_plugins',
     'Singleton', 'wraps', 'DecoratorDataStore', ]
 
 import sys
 import os
+import errno
+import signal
 import stat
 import time
 import imp
@@ -47,6 +50,9 @@ from .weakref import weakref
 # get logging object
 log = logging.getLogger('kaa.base.utils')
 
+# Index of this process if it is a worker started by fork_workers()
+_worker_index = None
+
 # create tmp directory for the user
 TEMP = '/tmp/kaa-%s' % os.getuid()
 if os.environ.get('TMPDIR'):
@@ -218,6 +224,111 @@ def fork():
     return pid
 
 
+def fork_workers(count=None, respawn=True):
+    """
+    Forks worker processes that each run their own main loop, in order to
+    spread I/O handling over multiple CPU cores.
+
+    :param count: the number of workers; defaults to the number of CPUs.
+    :type count: int
+    :param respawn: if True, workers that terminate are replaced by a new
+                    worker with the same index.
+    :type respawn: bool
+    :returns: the worker index (0 to count-1) in the worker processes, and
+              None in the parent once all workers have terminated.
+
+    The parent does not run a main loop but supervises the workers.  It
+    terminates the workers when it receives SIGTERM or SIGINT and returns
+    once all workers have exited.
+
+    Listening sockets created before calling this function are shared by all
+    workers, and the kernel hands each incoming connection to one of them.
+    For a more even distribution on Linux, each worker may instead listen on
+    its own socket after the fork, passing ``reuse_port=True`` to
+    :meth:`kaa.Socket.listen`.  Each worker has its own main thread, so
+    :class:`~kaa.MainThreadCallable` and friends always target the main loop
+    of the process owning the object::
+
+        index = kaa.utils.fork_workers(4)
+        if index is None:
+            sys.exit(0)
+        server = kaa.Socket()
+        server.listen(8080, reuse_port=True)
+        server.signals['new-client'].connect(handle_client)
+        kaa.main.run()
+    """
+    global _worker_index
+    if _worker_index is not None:
+        raise RuntimeError('fork_workers() cannot be called from a worker')
+    count = count or get_num_cpus()
+    # pid -> (index, start time)
+    workers = {}
+    sigterm_handler = signal.getsignal(signal.SIGTERM) or signal.SIG_DFL
+
+    def spawn(index):
+        pid = fork()
+        if not pid:
+            global _worker_index
+            _worker_index = index
+            signal.signal(signal.SIGTERM, sigterm_handler)
+            return True
+        workers[pid] = index, time.time()
+
+    def terminate(signum, frame):
+        raise SystemExit
+
+    for index in range(count):
+        if spawn(index):
+            return index
+
+    # Make sure we get to terminate the workers when we are terminated.
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        while workers:
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                elif e.errno == errno.ECHILD:
+                    break
+                raise
+            if pid not in workers:
+                continue
+            index, started = workers.pop(pid)
+            log.warning('Worker %d (pid %d) exited with status %d', index, pid, status)
+            if respawn:
+                if time.time() - started < 1:
+                    # Don't fork in a tight loop if workers die at startup.
+                    time.sleep(1)
+                if spawn(index):
+                    return index
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if _worker_index is None:
+            # Parent: terminate and reap any remaining workers.
+            signal.signal(signal.SIGTERM, sigterm_handler)
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for pid in workers:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+
+
+def worker_index():
+    """
+    Returns the index of the current process if it is a worker started by
+    :func:`fork_workers`, or None otherwise.
+    """
+    return _worker_index
+
+
 def is_running(name):
     """
     Check if the program with the given name is running. The program
@@ -0,0 +1,86 @@
+import os
+import kaa
+import kaa.nf_asyncio
+
+# kaa.nf_asyncio uses trollius with Python 2.
+asyncio = kaa.nf_asyncio.asyncio
+From, Return = asyncio.From, asyncio.Return
+
+loop = kaa.nf_asyncio.init()
+events = []
+
+@asyncio.coroutine
+def add(a, b):
+    yield From(asyncio.sleep(0.01))
+    raise Return(a + b)
+
+@asyncio.coroutine
+def fail():
+    yield From(asyncio.sleep(0.01))
+    raise ValueError('expected')
+
+@kaa.coroutine()
+def kaa_side():
+    # kaa coroutines may yield asyncio futures ...
+    result = yield asyncio.ensure_future(add(1, 2))
+    assert(result == 3)
+    try:
+        yield kaa.nf_asyncio.from_future(fail())
+    except ValueError:
+        events.append('exception')
+    yield kaa.delay(0.01)
+    yield result * 2
+
+@asyncio.coroutine
+def asyncio_side():
+    # ... and asyncio coroutines InProgress objects, as futures.
+    result = yield From(kaa.nf_asyncio.to_future(kaa_side()))
+    assert(result == 6)
+
+    # Cancelling a future aborts the InProgress.
+    ip = kaa.delay(10)
+    ip.signals['abort'].connect(lambda exc: events.append('aborted'))
+    future = kaa.nf_asyncio.to_future(ip)
+    loop.call_later(0.01, future.cancel)
+    try:
+        yield From(future)
+    except asyncio.CancelledError:
+        events.append('cancelled')
+
+    # IO monitors and timers are run by the asyncio loop.
+    r, w = os.pipe()
+    data = []
+    def readable():
+        data.append(os.read(r, 10))
+        return False
+    kaa.IOMonitor(readable).register(r)
+    kaa.OneShotTimer(os.write, w, 'kaa').start(0.01)
+    yield From(asyncio.sleep(0.1))
+    assert(data == ['kaa'])
+    raise Return(result)
+
+# Run the asyncio loop directly ...
+assert(loop.run_until_complete(asyncio_side()) == 6)
+assert(events == ['exception', 'aborted', 'cancelled'])
+
+# ... or through kaa.  Timer slack and main loop statistics work with the
+# asyncio notifier as well.
+kaa.set_timer_slack(0.05)
+stats = kaa.main.enable_stats()
+timer = kaa.Timer(lambda: events.append('timer'))
+timer.start(0.01)
+fired = []
+for i in range(5):
+    kaa.OneShotTimer(lambda: fired.append(loop.time())).start(0.001 + i * 0.005)
+kaa.OneShotTimer(kaa.main.stop).start(0.2)
+kaa.main.run()
+timer.stop()
+kaa.main.disable_stats()
+kaa.set_timer_slack(0)
+assert(events.count('timer') >= 3)
+# The one-shot timers were coalesced: they are aligned to multiples of the
+# slack, so they ran in one or, if they straddle one, two loop iterations.
+assert(len(fired) == 5)
+assert(len([t for a, t in zip(fired, fired[1:]) if t - a > 0.002]) <= 1)
+assert(stats.callbacks['timer'].count >= 8 and stats.steps > 0)
+print 'ok'
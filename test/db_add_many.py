@@ -0,0 +1,71 @@
+import os
+import random
+import tempfile
+import kaa.db
+from kaa.db import *
+
+random.seed(1)
+words = [u'alpha', u'beta', u'gamma', u'delta', u'Epsilon', u"o'neil"] + \
+        [u''.join(random.sample(u'bcdfghjklmnpqrstvwxz', 6)) for i in range(300)]
+objects = []
+for i in range(2500):
+    obj = {'name': u' '.join(random.sample(words, 4)), 'size': i, 'title': u'Title %d' % (i % 7)}
+    if i % 3:
+        obj['mtime'] = i * 1.5
+    if i % 5 == 0:
+        obj['keywords'] = u'extra Words'
+    objects.append(obj)
+
+
+def create(add_many):
+    db = Database(os.path.join(tempfile.mkdtemp(), 'add_many.db'))
+    db.register_inverted_index('keywords', min=2, max=30)
+    db.register_object_type_attrs('file',
+        name = (unicode, ATTR_SEARCHABLE | ATTR_INVERTED_INDEX, 'keywords'),
+        size = (int, ATTR_SEARCHABLE),
+        mtime = (float, ATTR_SIMPLE),
+        title = (unicode, ATTR_SEARCHABLE | ATTR_INDEXED_IGNORE_CASE),
+        keywords = (list, ATTR_SIMPLE | ATTR_INVERTED_INDEX, 'keywords'))
+    db.register_object_type_attrs('dir', name = (unicode, ATTR_SEARCHABLE))
+    root = db.add('dir', name=u'/')
+    db.add('file', name=u'alpha preexisting', size=-1)
+    if add_many:
+        # A generator is consumed in chunks.
+        assert(db.add_many('file', (dict(obj, parent=root) for obj in objects), chunk_size=700) == len(objects))
+        assert(db.add_many('file', []) == 0)
+    else:
+        for obj in objects:
+            db.add('file', parent=root, **obj)
+    db.commit()
+    return db
+
+
+def dump(db):
+    """
+    Returns everything add() and add_many() write to the database.
+    """
+    objs = sorted(sorted(dict(o).items()) for o in db.query(type='file'))
+    terms = sorted(db._db_query('SELECT term, count FROM ivtidx_keywords_terms'))
+    postings = sorted(db._db_query('SELECT t.term, m.object_id, m.rank, m.frequency '
+                                   'FROM ivtidx_keywords_terms_map m, ivtidx_keywords_terms t '
+                                   'WHERE t.id=m.term_id'))
+    ivtidx = db._db_query('SELECT * FROM inverted_indexes')
+    matches = sorted(o['id'] for o in db.query(keywords=u'alpha', limit=100000))
+    title = sorted(o['id'] for o in db.query(title=u'TITLE 3'))
+    return objs, terms, postings, ivtidx, db._inverted_indexes['keywords']['objectcount'], matches, title
+
+
+added, added_many = create(False), create(True)
+for a, b in zip(dump(added), dump(added_many)):
+    assert(a == b)
+assert(len(dump(added_many)[0]) == len(objects) + 1)
+# Objects added later get the same ids.
+assert(added.add('file', name=u'later')['id'] == added_many.add('file', name=u'later')['id'])
+# Unknown types fail as with add().
+try:
+    added_many.add_many('nosuchtype', [{}])
+except KeyError:
+    pass
+else:
+    assert(False)
+print 'ok'
@@ -0,0 +1,91 @@
+import os
+import threading
+import tempfile
+import kaa
+import kaa.db
+from kaa.db import *
+
+tmp = tempfile.mkdtemp()
+
+def stop_threads(db):
+    """
+    Stops the idle threads of the database, which would otherwise wake up
+    during interpreter shutdown.
+    """
+    members = db._pool._members[:]
+    db._pool.size = 0
+    for member in members:
+        member.join()
+
+@kaa.coroutine()
+def test(wal):
+    db = Database(os.path.join(tmp, 'db%d' % wal), wal=wal)
+    db.register_inverted_index('keywords', min=2, max=30)
+    db.register_object_type_attrs('msg', name=(unicode, ATTR_SEARCHABLE), n=(int, ATTR_SEARCHABLE),
+                                  body=(str, ATTR_SIMPLE | ATTR_INVERTED_INDEX, 'keywords'))
+    adds = [db.add_async('msg', name=u'n%d' % (i % 5), n=i, body='alpha beta') for i in range(100)]
+    yield kaa.InProgressAll(*adds)
+    assert((yield db.add_many_async('msg', [{'name': u'many', 'n': i} for i in range(10)])) == 10)
+    yield db.commit_async()
+    assert(len(db.query(type='msg')) == 110)
+
+    # Identical queries are coalesced, but each caller gets its own list.
+    q1 = db.query_async(name=u'n1')
+    q2 = db.query_async(name=u'n1')
+    q3 = db.query_async(name=u'n2')
+    assert(len(db._async_queries) == 2)
+    r1, r2, r3 = [ip.result for ip in (yield kaa.InProgressAll(q1, q2, q3))]
+    assert(len(r1) == 20 and r1 == r2 and r1 is not r2 and len(r3) == 20)
+    assert(not db._async_queries)
+
+    # Aborting one caller of a coalesced query doesn't affect the other,
+    # aborting all of them stops the query.
+    a = db.query_async(keywords='alpha', limit=5)
+    b = db.query_async(keywords='alpha', limit=5)
+    a.abort()
+    assert(len((yield b)) == 5)
+    c = db.query_async(name=u'n3')
+    c.abort()
+    assert(not db._async_queries)
+
+    # Errors are thrown to the callers, also of queries that can't be
+    # coalesced.
+    for attrs in ({'n': u'x'}, {'name': {}}):
+        try:
+            yield db.query_async(**attrs)
+        except TypeError:
+            pass
+        else:
+            assert(False)
+
+    row = yield db.get_async(('msg', 1))
+    assert(row['n'] == 0)
+    yield db.update_async(row, n=1000)
+    assert((yield db.delete_by_query_async(name=u'n4')) == 20)
+    yield db.delete_async(('msg', 2))
+    yield db.commit_async()
+    assert(db.query(n=1000)[0]['id'] == 1 and len(db.query(type='msg')) == 89)
+
+    if not wal:
+        # With the single thread busy, queries are done before changes, and
+        # calls aborted while waiting are not done.
+        order = []
+        event = threading.Event()
+        blocker = db.run_async(100, event.wait)
+        change = db.run_async(PRIORITY_CHANGE, order.append, 'change')
+        aborted = db.run_async(PRIORITY_QUERY, order.append, 'aborted')
+        query = db.run_async(PRIORITY_QUERY, order.append, 'query')
+        aborted.abort()
+        event.set()
+        yield kaa.InProgressAll(blocker, change, query)
+        assert(order == ['query', 'change'])
+    stop_threads(db)
+
+
+@kaa.coroutine()
+def main():
+    yield test(False)
+    yield test(True)
+    print 'ok'
+
+main().wait()
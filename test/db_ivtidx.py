@@ -0,0 +1,63 @@
+import os
+import random
+import tempfile
+import kaa.db
+from kaa.db import *
+
+random.seed(1)
+# Digits are split off terms, so rare words are made up of letters.
+words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon'] + \
+        [''.join(random.sample('bcdfghjklmnpqrstvwxz', 6)) for i in range(200)]
+
+def matches(db, query, **kwargs):
+    return set(o['id'] for o in db.query(keywords=query, limit=100000, **kwargs))
+
+for wal in (False, True):
+    path = os.path.join(tempfile.mkdtemp(), 'ivtidx.db')
+    db = Database(path, wal=wal)
+    db.register_inverted_index('keywords', min=2, max=30)
+    db.register_object_type_attrs('msg', body=(str, ATTR_SIMPLE | ATTR_INVERTED_INDEX, 'keywords'))
+    db.register_object_type_attrs('doc', body=(str, ATTR_SIMPLE | ATTR_INVERTED_INDEX, 'keywords'))
+    bodies = {}
+    for i in range(2000):
+        body = ' '.join(random.sample(words[:5], 2) + random.sample(words[5:], 3))
+        bodies[db.add('msg', body=body)['id']] = set(body.split())
+    db.add('doc', body='alpha beta')
+    db.commit()
+
+    # Searches starting from the rarest term find all objects containing all
+    # terms, however common the other terms are.
+    for query in ('alpha', 'alpha beta', '%s alpha' % words[7], '%s %s' % (words[7], words[8]),
+                  'beta %s alpha' % words[150], 'nosuchword alpha', 'alpha beta gamma'):
+        expected = set(id for id, terms in bodies.items() if terms.issuperset(query.split()))
+        assert(matches(db, query, type='msg') == expected)
+    # Limits return the best ranked objects.
+    assert(len(db.query(keywords='alpha', type='msg', limit=10)) == 10)
+    assert(len(matches(db, 'alpha beta')) == len(matches(db, 'alpha beta', type='msg')) + 1)
+
+    # Cached postings are dropped when the index changes.
+    before = matches(db, 'alpha gamma', type='msg')
+    obj = db.add('msg', body='alpha gamma')
+    assert(matches(db, 'alpha gamma', type='msg') == before | set([obj['id']]))
+    db.update(obj, body='alpha')
+    assert(matches(db, 'alpha gamma', type='msg') == before)
+    db.delete(obj)
+    assert(obj['id'] not in matches(db, 'alpha', type='msg'))
+    db.commit()
+
+    # The database is dirty before postings are dropped, so that queries
+    # from then on don't use a reader with an older snapshot, whose
+    # postings would be cached under the new generation.
+    dirty = []
+    clear = db._postings.clear
+    def check_clear():
+        dirty.append(db._dirty)
+        clear()
+    db._postings.clear = check_clear
+    obj = db.add('msg', body='alpha')
+    db.update(obj, body='beta')
+    db.add_many('msg', [{'body': 'gamma'}])
+    db.delete(obj)
+    assert(dirty and all(dirty))
+    db.commit()
+print 'ok'
@@ -0,0 +1,98 @@
+import os
+import time
+import tempfile
+import kaa.db
+from kaa.db import *
+
+tmp = tempfile.mkdtemp()
+
+for wal in (False, True):
+    db = Database(os.path.join(tmp, 'db%d' % wal), wal=wal)
+    db.register_inverted_index('keywords', min=2, max=30)
+    db.register_object_type_attrs('msg', name=(unicode, ATTR_SEARCHABLE), n=(int, ATTR_SEARCHABLE),
+                                  body=(str, ATTR_SIMPLE | ATTR_INVERTED_INDEX, 'keywords'))
+    db.register_object_type_attrs('other', title=(unicode, ATTR_SEARCHABLE))
+    db.register_object_type_attrs('doc', body=(str, ATTR_SIMPLE | ATTR_INVERTED_INDEX, 'keywords'))
+    db.add_many('msg', ({'name': u'n%d' % (i % 5), 'n': i, 'body': 'alpha beta w%s' % 'abcdefg'[i % 7]}
+                        for i in range(500)))
+    db.commit()
+
+    def query(**attrs):
+        return [(o['type'], o['id']) for o in db.query(**attrs)]
+
+    queries = [dict(type='msg', name=u'n1'), dict(keywords='alpha wd', limit=10), dict(keywords='wd', type='msg'),
+               dict(n=QExpr('range', (10, 20))), dict(type='msg', parent=('msg', 3)), dict(object=('msg', 7))]
+    uncached = [query(**q) for q in queries]
+    cache = db.enable_query_cache(size=100)
+    assert([query(**q) for q in queries] == uncached)
+    assert([query(**q) for q in queries] == uncached)
+    assert(cache.hits == len(queries) and cache.misses == len(queries))
+
+    # Changes to other types don't invalidate queries on a type, but do
+    # invalidate queries without type.
+    db.add('other', title=u'x')
+    hits = cache.hits
+    query(type='msg', name=u'n1')
+    assert(cache.hits == hits + 1)
+    query(n=QExpr('range', (10, 20)))
+    assert(cache.hits == hits + 1)
+
+    # Changes to types sharing an inverted index invalidate keyword queries,
+    # as they affect the ranking.
+    db.add('doc', body='wd wd wd alpha')
+    hits = cache.hits
+    cached = query(keywords='alpha wd', limit=10)
+    assert(cache.hits == hits)
+    db.disable_query_cache()
+    assert(query(keywords='alpha wd', limit=10) == cached)
+    cache = db.enable_query_cache(size=100)
+
+    # Adding, updating and deleting objects invalidates queries on their type.
+    for q in queries:
+        query(**q)
+    obj = db.add('msg', name=u'n1', n=999, parent=('msg', 3))
+    assert(len(query(type='msg', name=u'n1')) == 101)
+    assert(len(query(type='msg', parent=('msg', 3))) == 1)
+    db.update(obj, name=u'zz')
+    assert(len(query(type='msg', name=u'n1')) == 100)
+    db.delete(obj)
+    assert(query(type='msg', name=u'zz') == [])
+    db.delete(('msg', 7))
+    assert(query(object=('msg', 7)) == [])
+    assert(cache.invalidations > 0)
+
+    # Callers get their own lists.
+    result = db.query(type='msg', name=u'n2')
+    n = len(result)
+    del result[:]
+    assert(len(db.query(type='msg', name=u'n2')) == n)
+
+    # Queries that can't be used as cache key aren't cached.
+    misses = cache.misses
+    try:
+        db.query(name={})
+    except TypeError:
+        pass
+    assert(cache.misses == misses)
+
+    # Least recently used results are evicted, and results expire.
+    cache = db.enable_query_cache(size=2, ttl=0.05)
+    query(name=u'n1')
+    query(name=u'n2')
+    query(name=u'n3')
+    assert(cache.evictions == 1)
+    query(name=u'n3')
+    query(name=u'n1')
+    assert(cache.hits == 1 and cache.misses == 4)
+    time.sleep(0.06)
+    query(name=u'n3')
+    assert(cache.hits == 1)
+    # Registering types invalidates all results.
+    db.register_object_type_attrs('new', x=(int, ATTR_SEARCHABLE))
+    query(name=u'n3')
+    assert(cache.hits == 1)
+    snapshot = cache.snapshot()
+    assert(snapshot['hits'] == 1 and snapshot['misses'] == 6)
+    assert(abs(cache.hit_rate - 1 / 7.0) < 0.001)
+    db.commit()
+print 'ok'
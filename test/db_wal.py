@@ -0,0 +1,84 @@
+import os
+import threading
+import tempfile
+import kaa.db
+from kaa.db import *
+
+tmp = tempfile.mkdtemp()
+words = 'alpha beta gamma delta epsilon zeta eta theta iota kappa'.split()
+
+def create(name, wal, **kwargs):
+    db = Database(os.path.join(tmp, name), wal=wal, **kwargs)
+    db.register_inverted_index('keywords', min=2, max=30)
+    db.register_object_type_attrs('msg', name=(unicode, ATTR_SEARCHABLE), n=(int, ATTR_SEARCHABLE),
+                                  body=(str, ATTR_SIMPLE | ATTR_INVERTED_INDEX, 'keywords'))
+    return db
+
+# Queries return the same in both modes.
+results = {}
+for wal in (False, True):
+    db = create('db%d' % wal, wal)
+    for i in range(2000):
+        db.add('msg', name=u'n%d' % (i % 50), n=i, body=' '.join(words[j] for j in range(10) if i % (j + 2) == 0))
+    db.commit()
+    # Uncommitted changes are seen by queries.
+    db.add('msg', name=u'uncommitted', n=-1)
+    assert(len(db.query(name=u'uncommitted')) == 1)
+    db.commit()
+    results[wal] = [
+        [(o['id'], o['n']) for o in db.query(name=u'n7')],
+        [(o['id'], o['n']) for o in db.query(keywords='beta gamma', limit=20)],
+        [(o['id'], o['n']) for o in db.query(keywords='zeta', type='msg')],
+        db.get(('msg', 5))['n']
+    ]
+    # Committed queries are done by readers in WAL mode only.
+    assert((db._readers_open > 0) == wal)
+    assert(os.path.exists(db.filename + '-wal') == wal)
+    if not wal:
+        assert(db.checkpoint() is None)
+assert(results[False] == results[True])
+
+# Threads query while changes are written and committed.
+db = create('threads', True, readers=3)
+db.add_many('msg', ({'name': u'x', 'n': i, 'body': 'beta'} for i in range(100)))
+db.commit()
+errors = []
+counts = []
+def query():
+    try:
+        for i in range(100):
+            counts.append(len(db.query(keywords='beta', limit=1000)))
+    except Exception, e:
+        errors.append(e)
+threads = [threading.Thread(target=query) for i in range(6)]
+for t in threads:
+    t.start()
+for i in range(300):
+    db.add('msg', name=u'w', n=i, body='beta more')
+    if i % 20 == 0:
+        db.commit()
+db.commit()
+for t in threads:
+    t.join()
+assert(not errors and len(counts) == 600)
+assert(min(counts) >= 100 and max(counts) <= 400)
+assert(db._readers_open <= 3)
+assert(len(db.query(keywords='beta', limit=1000)) == 400)
+
+# Without automatic checkpoints, the log grows until checkpointed.
+db = create('checkpoint', True, autocheckpoint=0)
+for i in range(10):
+    db.add_many('msg', ({'name': u'x' * 100, 'n': n} for n in range(100)))
+    db.commit()
+pages, checkpointed = db.checkpoint()
+assert(pages > 0 and checkpointed == pages)
+assert(db.checkpoint('truncate') == (0, 0))
+assert(os.path.getsize(db.filename + '-wal') == 0)
+try:
+    db.checkpoint('bogus')
+except ValueError:
+    pass
+else:
+    assert(False)
+assert(len(Database(db.filename).query(type='msg')) == 1000)
+print 'ok'
@@ -0,0 +1,101 @@
+import os
+import socket
+import fcntl
+import kaa
+from kaa.base import io
+
+# Count the bytes joined for writes on channels without writev/sendmsg.
+joined = [0]
+join_buffers = io._join_buffers
+def count_join(buffers):
+    data = join_buffers(buffers)
+    joined[0] += len(data)
+    return data
+io._join_buffers = count_join
+
+
+def make_pipe():
+    r, w = os.pipe()
+    flags = fcntl.fcntl(w, fcntl.F_GETFL)
+    fcntl.fcntl(w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    return r, kaa.IOChannel(os.fdopen(w, 'w'), mode=kaa.IO_WRITE)
+
+
+@kaa.coroutine()
+def test_coalesce():
+    r, channel = make_pipe()
+    # Many small writes that fill the pipe several times over, so that
+    # writes of joined buffers are partial.
+    chunks = ['%06d' % i * 100 for i in range(1500)]
+    ips = [channel.write(chunk) for chunk in chunks]
+    assert(channel.write_queue_used == sum(len(c) for c in chunks))
+    results = []
+    for chunk, ip in zip(chunks, ips):
+        ip.connect(results.append)
+    received = []
+    expected = ''.join(chunks)
+    while sum(len(d) for d in received) < len(expected):
+        yield kaa.delay(0.001)
+        received.append(os.read(r, 65536))
+    yield kaa.InProgressAll(*ips)
+    assert(''.join(received) == expected)
+    assert(channel.write_queue_used == 0)
+    # Each InProgress is finished with the size of the data written by the
+    # last write (the remainder of partially written data).
+    assert(len(results) == len(chunks))
+    assert(all(0 < size <= 600 for size in results))
+    assert(results.count(600) > len(chunks) - 100)
+    if not hasattr(os, 'writev'):
+        # Joined data is written from an offset rather than joined again.
+        assert(joined[0] <= len(expected))
+    channel.close()
+    os.close(r)
+
+
+@kaa.coroutine()
+def test_abort():
+    r, channel = make_pipe()
+    blocker = channel.write('x' * 512 * 1024)
+    a = channel.write('a' * 100)
+    b = channel.write('b' * 100)
+    c = channel.write('c' * 100)
+    b.abort()
+    data = ''
+    while len(data) < 512 * 1024 + 200:
+        yield kaa.delay(0.001)
+        data += os.read(r, 65536)
+    yield kaa.InProgressAll(a, c)
+    assert(data.endswith('a' * 100 + 'c' * 100))
+    channel.close()
+    os.close(r)
+
+
+@kaa.coroutine()
+def test_zero_copy():
+    a, b = socket.socketpair()
+    reader = kaa.Socket()
+    reader.wrap(a)
+    reader.zero_copy = True
+    lines = []
+    reader.signals['readline'].connect(lambda line: lines.append(line.tobytes()))
+    b.sendall('foo\nbar\nba')
+    yield kaa.delay(0.05)
+    b.sendall('z\n')
+    yield kaa.delay(0.05)
+    assert(lines == ['foo\n', 'bar\n', 'baz\n'])
+    reader.signals['readline'].disconnect_all()
+    b.sendall('hello\n')
+    line = yield reader.readline()
+    assert(line == 'hello\n' and isinstance(line, str))
+    reader.close()
+    b.close()
+
+
+@kaa.coroutine()
+def main():
+    yield test_coalesce()
+    yield test_abort()
+    yield test_zero_copy()
+    print 'ok'
+
+main().wait()
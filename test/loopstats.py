@@ -0,0 +1,54 @@
+import os
+import time
+import threading
+import kaa
+
+stats = kaa.main.enable_stats(slow_threshold=0.01, history=5)
+assert(kaa.main.get_stats() is stats)
+
+def slow_timer():
+    time.sleep(0.02)
+
+r, w = os.pipe()
+def readable():
+    os.read(r, 1)
+    return False
+kaa.IOMonitor(readable).register(r)
+os.write(w, 'x')
+
+steps = []
+kaa.main.signals['step'].connect(lambda: steps.append(1))
+
+def thread():
+    for i in range(10):
+        kaa.MainThreadCallable(lambda: None)()
+    kaa.MainThreadCallable(kaa.main.stop)()
+
+kaa.OneShotTimer(slow_timer).start(0.01)
+kaa.OneShotTimer(threading.Thread(target=thread).start).start(0.05)
+kaa.main.run()
+os.close(r)
+os.close(w)
+
+snapshot = stats.snapshot()
+callbacks = snapshot['callbacks']
+assert(callbacks['timer']['count'] >= 2 and callbacks['timer']['max'] >= 0.02)
+assert(callbacks['io']['count'] >= 1)
+assert(callbacks['thread']['count'] == 11)
+# The step signal isn't emitted after the step stopping the loop.
+assert(callbacks['step']['count'] == len(steps) >= snapshot['steps'] - 1)
+assert(snapshot['wait']['count'] == snapshot['steps'] and snapshot['wait']['total'] > 0)
+assert(snapshot['queue_depth']['max'] >= 1 and snapshot['queue_wait']['count'] == 11)
+assert(0 < snapshot['utilization'] < 1)
+# Slow callbacks are remembered.
+assert([s[1] for s in snapshot['slow']] == ['timer'] and 'slow_timer' in snapshot['slow'][0][2])
+summary = stats.summary()
+assert(summary.startswith('main loop: %d steps' % snapshot['steps']) and 'slow timer' in summary)
+
+stats.reset()
+assert(stats.steps == 0 and not stats.slow and stats.callbacks['timer'].count == 0)
+kaa.main.disable_stats()
+assert(kaa.main.get_stats() is None)
+kaa.main.step(False)
+assert(stats.steps == 0)
+print 'ok'
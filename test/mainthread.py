@@ -0,0 +1,119 @@
+import os
+import threading
+import kaa
+from kaa.base.core import CoreThreading
+
+kaa.main.init()
+# Keeps steps short while waiting for threads to finish.
+kaa.Timer(lambda: None).start(0.01)
+
+# Count the wakeups of the main loop by threads.
+wakeups = [0]
+wakeup = CoreThreading._wakeup
+def count_wakeup():
+    wakeups[0] += 1
+    wakeup()
+CoreThreading._wakeup = staticmethod(count_wakeup)
+
+# Callbacks queued by threads run in the order they were queued.
+results = dict((n, []) for n in range(4))
+def producer(n):
+    for i in range(2000):
+        kaa.MainThreadCallable(results[n].append)(i)
+
+threads = [threading.Thread(target=producer, args=(n,)) for n in range(4)]
+for thread in threads:
+    thread.start()
+while any(t.is_alive() for t in threads) or CoreThreading._queue:
+    kaa.main.step()
+assert(all(results[n] == range(2000) for n in results))
+# A burst of callbacks needs far fewer wakeups than callbacks.
+assert(wakeups[0] < 8000 / 10)
+
+# Each step runs at most mainthread_callback_max_items callbacks, and
+# wakes itself up for the rest.
+done = []
+CoreThreading.mainthread_callback_max_items = 10
+try:
+    def burst():
+        for i in range(35):
+            kaa.MainThreadCallable(done.append)(i)
+    thread = threading.Thread(target=burst)
+    thread.start()
+    thread.join()
+    steps = 0
+    while len(done) < 35:
+        kaa.main.step()
+        steps += 1
+    assert(steps >= 4 and done == range(35))
+finally:
+    CoreThreading.mainthread_callback_max_items = 1000
+
+# Producers block while the queue is full, rather than growing it.
+CoreThreading.mainthread_queue_max = 50
+try:
+    done = []
+    def flood():
+        for i in range(500):
+            kaa.MainThreadCallable(done.append)(i)
+    thread = threading.Thread(target=flood)
+    thread.start()
+    longest = 0
+    while thread.is_alive() or CoreThreading._queue:
+        longest = max(longest, len(CoreThreading._queue))
+        kaa.main.step()
+    assert(done == range(500) and longest <= 51)
+finally:
+    CoreThreading.mainthread_queue_max = 10000
+
+# Exceptions are thrown to the InProgress of the caller.  (Waiting for it in
+# the thread would make that thread run the main loop, as it isn't running.)
+def fail():
+    raise ValueError('expected')
+calls = []
+thread = threading.Thread(target=lambda: calls.append(kaa.MainThreadCallable(fail)()))
+thread.start()
+while not calls or not calls[0].finished:
+    kaa.main.step()
+try:
+    calls[0].result
+except ValueError:
+    pass
+else:
+    assert(False)
+
+# Threads wake up the main loop through an eventfd where available, or a
+# pipe otherwise.  Reinitializing closes the old fds.
+def wake_from_thread():
+    done = []
+    thread = threading.Thread(target=kaa.MainThreadCallable(done.append), args=(True,))
+    thread.start()
+    while not done:
+        kaa.main.step()
+
+for use_eventfd in (True, False):
+    old = CoreThreading._pipe
+    CoreThreading.use_eventfd = use_eventfd
+    CoreThreading.init(kaa.main.signals)
+    fds = CoreThreading._pipe
+    if use_eventfd and kaa.base.core._eventfd:
+        assert(fds[0] == fds[1])
+    else:
+        assert(fds[0] != fds[1])
+    for fd in set(old) - set(fds):
+        try:
+            os.fstat(fd)
+        except OSError:
+            pass
+        else:
+            assert(False)
+    wake_from_thread()
+    if fds[0] == fds[1]:
+        # Any number of wakeups are consumed at once, as an eventfd is a
+        # counter rather than a buffer which could fill up.
+        for i in range(100000):
+            CoreThreading._wakeup()
+        kaa.main.step()
+        wake_from_thread()
+CoreThreading.use_eventfd = True
+print 'ok'
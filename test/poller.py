@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import kaa
+from kaa.base import nf_generic
+
+def poller():
+    return nf_generic.__dict__['__poller']
+
+def pipe_readable(r):
+    ready = poller().poll(0)[0]
+    return r in ready
+
+for name in ('epoll', 'select'):
+    try:
+        kaa.main.set_poller(name)
+    except ValueError:
+        print 'poller %s not available' % name
+        continue
+    print 'poller', kaa.main.get_poller()
+
+    # An fd registered in a child forked before kaa.main.init() must not be
+    # reported to the parent.
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        kaa.IOMonitor(lambda: False).register(r)
+        os.write(w, 'x')
+        time.sleep(0.5)
+        os._exit(0)
+    time.sleep(0.2)
+    assert(not pipe_readable(r))
+    os.waitpid(pid, 0)
+
+    # Both processes must get their own events after a fork, and the child
+    # unregistering an inherited fd must not affect the parent.
+    m = kaa.IOMonitor(lambda: False)
+    m.register(r)
+    pid = os.fork()
+    if not pid:
+        ok = pipe_readable(r)
+        m.unregister()
+        os._exit(0 if ok else 1)
+    assert(os.waitpid(pid, 0)[1] == 0)
+    assert(pipe_readable(r))
+    m.unregister()
+    os.read(r, 1)
+    os.close(r)
+    os.close(w)
+
+    # Regular files are always readable and writable, as with select.
+    f = tempfile.TemporaryFile()
+    calls = []
+    def ready(condition):
+        calls.append(condition)
+        return False
+    kaa.IOMonitor(ready, 'r').register(f, kaa.IO_READ)
+    kaa.IOMonitor(ready, 'w').register(f, kaa.IO_WRITE)
+    kaa.main.step()
+    assert(sorted(calls) == ['r', 'w'])
+    assert(poller().poll(0) == ([], [], []))
+    f.close()
+
+    # Write monitors are reported only while the fd is writable, also with
+    # a read monitor registered for the same fd.
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    rmon = kaa.IOMonitor(lambda: False)
+    rmon.register(a, kaa.IO_READ)
+    wmon = kaa.IOMonitor(lambda: False)
+    wmon.register(a, kaa.IO_WRITE)
+    assert(poller().poll(0) == ([], [a], []))
+    try:
+        while True:
+            a.send('x' * 65536)
+    except socket.error:
+        pass
+    assert(poller().poll(0) == ([], [], []))
+    b.send('x')
+    assert(poller().poll(0) == ([a], [], []))
+    wmon.unregister()
+    rmon.unregister()
+    a.close()
+    b.close()
+
+    if name == 'epoll':
+        # A write monitor of an fd closed without unregistering it is
+        # reported once, rather than failing every step.
+        r, w = os.pipe()
+        wmon.register(w, kaa.IO_WRITE)
+        os.close(w)
+        assert(poller().poll(0)[1] == [w])
+        assert(poller().poll(0) == ([], [], []))
+        wmon.unregister()
+        os.close(r)
+    print 'ok'
@@ -0,0 +1,157 @@
+import os
+import socket
+import struct
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    calls = 0
+
+    @kaa.rpc.expose()
+    def echo(self, value):
+        self.calls += 1
+        return value
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_auth.sock')
+
+# Packets sent by clients, by type.
+sent = []
+send_packet = kaa.rpc.Channel._send_packet
+def count_packet(self, seq, type, payload):
+    if self.channel_type == 'client':
+        sent.append(type)
+    return send_packet(self, seq, type, payload)
+kaa.rpc.Channel._send_packet = count_packet
+
+
+@kaa.coroutine()
+def connect(*args, **kwargs):
+    client = kaa.rpc.Client(path, 'secret', *args, **kwargs)
+    yield kaa.inprogress(client)
+    yield client
+
+
+@kaa.coroutine()
+def call_pipelined(service, values):
+    """
+    Issues calls while the connection is set up and returns the packets the
+    client sent.
+    """
+    del sent[:]
+    service.calls = 0
+    client = kaa.rpc.Client(path, 'secret', pipeline=True)
+    results = yield kaa.InProgressAll(*[client.rpc('echo', value) for value in values])
+    assert([r.result for r in results] == values)
+    # Each call is invoked once, even if it had to be sent again.
+    assert(service.calls == len(values))
+    client.close()
+    yield sent[:]
+
+
+@kaa.coroutine()
+def test_tickets():
+    service = Service()
+    server = kaa.rpc.Server(path, 'secret', ticket_lifetime=60, codecs=['marshal', 'pickle'],
+                            compressors=['zlib'])
+    server.register(service)
+
+    # The full handshake gives the client a ticket.
+    del sent[:]
+    client = yield connect()
+    assert(sent == ['RESP'] and len(server._tickets) == 1)
+    assert(client.codec == 'marshal' and client.compressor == 'zlib')
+    client.close()
+
+    # Which resumes the session with the options negotiated before, without
+    # waiting for the server's challenge.
+    packets = yield call_pipelined(service, [1, 2, 'x' * 20000, 3])
+    assert(packets[0] == 'RSUM' and 'RESP' not in packets)
+    # Tickets are single use; the resumed session got a new one.
+    assert(len(server._tickets) == 1)
+
+    # The server's challenge may be read before the socket's connect
+    # callback runs.
+    handle_connected = kaa.rpc.Client._handle_socket_connected
+    kaa.rpc.Client._handle_socket_connected = lambda self, result: None
+    packets = yield call_pipelined(service, [5, 6])
+    kaa.rpc.Client._handle_socket_connected = handle_connected
+    assert(packets[0] == 'RSUM' and 'RESP' not in packets)
+
+    # A rejected ticket falls back to the challenge, and pipelined calls
+    # are sent again.
+    server._tickets.clear()
+    packets = yield call_pipelined(service, [1, 2, 3])
+    assert(packets[0] == 'RSUM' and 'RESP' in packets)
+    assert(packets.count('CALL') == 6)
+    client = yield connect()
+    assert(client.codec == 'marshal' and (yield client.rpc('echo', 4)) == 4)
+    client.close()
+
+    # Clients with another secret don't use the ticket, and aren't
+    # authenticated.
+    del sent[:]
+    client = kaa.rpc.Client(path, 'wrong')
+    yield kaa.delay(0.2)
+    assert(not client.connected and sent == ['RESP'])
+    client.close()
+
+    # Without tickets, pipelined calls follow the response.
+    kaa.rpc._session_tickets.clear()
+    packets = yield call_pipelined(service, [1])
+    assert(packets == ['RESP', 'CALL'])
+    server.close()
+    os.unlink(path)
+
+
+def raw_resume(size):
+    """
+    Sends an invalid ticket followed by size bytes of calls, and returns
+    whether the server closed the connection.
+    """
+    sock = socket.socket(socket.AF_UNIX)
+    sock.connect(path)
+    sock.settimeout(0.2)
+    sock.sendall(kaa.rpc.RPC_PACKET_HEADER.pack(0, 'RSUM', 60) + struct.pack('20s20s20s', 't', 'r', 'n'))
+    payload = 'x' * (1024 - kaa.rpc.RPC_PACKET_HEADER_SIZE)
+    for seq in range(size / 1024):
+        sock.sendall(kaa.rpc.RPC_PACKET_HEADER.pack(seq + 1, 'CALL', len(payload)) + payload)
+    return sock
+
+
+@kaa.coroutine()
+def test_discard_budget():
+    server = kaa.rpc.Server(path, 'secret', ticket_lifetime=60)
+    server.register(Service())
+    # Calls pipelined before the ticket was rejected are discarded, as long
+    # as they fit in RPC_PIPELINE_MAX bytes ...
+    results = []
+    for size in (kaa.rpc.RPC_PIPELINE_MAX, kaa.rpc.RPC_PIPELINE_MAX + 1024):
+        sock = raw_resume(size)
+        yield kaa.delay(0.2)
+        data = ''
+        try:
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    results.append('closed')
+                    break
+                data += chunk
+        except socket.timeout:
+            results.append('open')
+        # The server's challenge, and the rejection of the ticket.
+        assert(data[4:8] == 'AUTH' and 'RSUM' in data)
+        sock.close()
+    # ... and the connection is closed if there are more.
+    assert(results == ['open', 'closed'])
+    server.close()
+    os.unlink(path)
+
+
+@kaa.coroutine()
+def main():
+    yield test_tickets()
+    yield test_discard_budget()
+    print 'ok'
+
+main().wait()
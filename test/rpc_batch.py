@@ -0,0 +1,97 @@
+import os
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    @kaa.rpc.expose()
+    def square(self, n):
+        return n * n
+
+    @kaa.rpc.expose()
+    def fail(self):
+        raise ValueError('expected')
+
+    @kaa.rpc.expose()
+    @kaa.coroutine()
+    def delayed(self, n):
+        yield kaa.delay(0.01)
+        yield n
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_batch.sock')
+
+# Count the packets sent by type.
+packets = []
+send_packet = kaa.rpc.Channel._send_packet
+def count_packet(self, seq, type, payload):
+    packets.append(type)
+    return send_packet(self, seq, type, payload)
+kaa.rpc.Channel._send_packet = count_packet
+
+
+@kaa.coroutine()
+def test(batched):
+    server = kaa.rpc.Server(path, 'secret', features=batched)
+    server.register(Service())
+    client = kaa.rpc.Client(path, 'secret')
+    yield kaa.inprogress(client)
+    del packets[:]
+
+    with client.batch() as batch:
+        results = [batch.rpc('square', n) for n in range(10)]
+        failed = batch.rpc('fail')
+        delayed = batch.rpc('delayed', 'x')
+    assert((yield kaa.InProgressAll(*results)) and [r.result for r in results] == [n * n for n in range(10)])
+    try:
+        yield failed
+    except ValueError:
+        pass
+    else:
+        assert(False)
+    assert((yield delayed) == 'x')
+    if batched:
+        # One batch, answered with one BRTN, and the delayed call by RETN.
+        assert(sorted(packets) == ['BRTN', 'BTCH', 'RETN'])
+    else:
+        assert(packets.count('CALL') == 12 and 'BTCH' not in packets)
+
+    results = client.rpc_many([('square', (2,)), ('delayed', (), {'n': 3})])
+    assert([(yield r) for r in results] == [4, 3])
+
+    # Calls are not sent if the with block fails, and are aborted.
+    del packets[:]
+    try:
+        with client.batch() as batch:
+            aborted = batch.rpc('square', 1)
+            raise KeyError('expected')
+    except KeyError:
+        pass
+    else:
+        assert(False)
+    assert(aborted.finished and len(batch) == 0)
+    try:
+        aborted.result
+    except kaa.InProgressAborted:
+        pass
+    else:
+        assert(False)
+    # Calls aborted before the batch is sent are not sent.
+    with client.batch() as batch:
+        batch.rpc('square', 1).abort()
+        result = batch.rpc('square', 2)
+    assert((yield result) == 4)
+    assert('BTCH' in packets if batched else packets.count('CALL') == 1)
+
+    client.close()
+    server.close()
+    os.unlink(path)
+
+
+@kaa.coroutine()
+def main():
+    yield test(True)
+    # Servers not offering extensions receive batched calls one by one.
+    yield test(False)
+    print 'ok'
+
+main().wait()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import collections
+import kaa
+import kaa.rpc
+
+Point = collections.namedtuple('Point', 'x y')
+class Name(str):
+    pass
+
+class Service(object):
+    @kaa.rpc.expose()
+    def echo(self, value):
+        return value
+
+    @kaa.rpc.expose()
+    def fail(self):
+        raise ValueError('expected')
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_codecs.sock')
+
+@kaa.coroutine()
+def test(server_codecs, client_codecs, expected):
+    server = kaa.rpc.Server(path, 'secret', codecs=server_codecs)
+    server.register(Service())
+    client = kaa.rpc.Client(path, 'secret', codecs=client_codecs)
+    yield kaa.inprogress(client)
+    assert(client.codec == expected)
+    for value in (None, True, 1, 2**70, 1.5, 'abc', u'\xe4', (1, 'a'), [1, (2,)],
+                  {'a': [1, 2]}, set([1]), frozenset([2]), Point(1, 2),
+                  collections.OrderedDict(a=1), ValueError('x')):
+        result = yield client.rpc('echo', value)
+        assert(type(result) is type(value))
+        if not isinstance(value, Exception):
+            assert(result == value)
+    # Documented: marshal sends str subclasses as str.
+    result = yield client.rpc('echo', Name('n'))
+    assert(result == 'n' and type(result) is (str if expected == 'marshal' else Name))
+    try:
+        yield client.rpc('fail')
+    except ValueError, e:
+        assert(e.args == ('expected',))
+    else:
+        assert(False)
+    client.close()
+    server.close()
+    os.unlink(path)
+
+
+@kaa.coroutine()
+def main():
+    yield test(None, None, 'pickle')
+    yield test(['marshal', 'pickle'], None, 'marshal')
+    yield test(['marshal', 'pickle'], ['pickle'], 'pickle')
+    # No common codec: pickle.
+    yield test(['marshal'], ['pickle'], 'pickle')
+    print 'ok'
+
+main().wait()
@@ -0,0 +1,85 @@
+import os
+import socket
+import zlib
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    @kaa.rpc.expose()
+    def echo(self, value):
+        return value
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_compress.sock')
+
+
+@kaa.coroutine()
+def test(server_compressors, client_compressors, expected):
+    server = kaa.rpc.Server(path, 'secret', compressors=server_compressors)
+    server.register(Service())
+    client = kaa.rpc.Client(path, 'secret', compressors=client_compressors)
+    yield kaa.inprogress(client)
+    assert(client.compressor == expected)
+    small, big = 'x' * 100, 'abc' * 100000
+    assert((yield client.rpc('echo', small)) == small)
+    assert((yield client.rpc('echo', big)) == big)
+    stats = client.compression_stats
+    if expected:
+        assert(stats['sent'] > len(big) and stats['received'] > len(big))
+        assert(stats['sent_ratio'] > 10 and stats['received_ratio'] > 10)
+    else:
+        assert(stats['sent'] == stats['received'] == 0)
+    client.close()
+    server.close()
+    os.unlink(path)
+
+
+@kaa.coroutine()
+def test_limits():
+    server = kaa.rpc.Server(path, 'secret', compressors=['zlib'])
+    server.register(Service())
+
+    # Compressed packets before authentication are refused.
+    sock = socket.socket(socket.AF_UNIX)
+    sock.connect(path)
+    payload = zlib.compress('\0' * 100)
+    sock.sendall(kaa.rpc.RPC_PACKET_HEADER.pack(0, 'RESP', len(payload) | kaa.rpc.RPC_PACKET_COMPRESSED) + payload)
+    yield kaa.delay(0.1)
+    sock.settimeout(1)
+    # The server's challenge, and then EOF.
+    data = sock.recv(4096)
+    assert(data and sock.recv(4096) == '')
+    sock.close()
+
+    # Payloads decompressing to more than RPC_DECOMPRESS_MAX are refused,
+    # and larger payloads are sent uncompressed.
+    max_len = kaa.rpc.RPC_DECOMPRESS_MAX
+    kaa.rpc.RPC_DECOMPRESS_MAX = 256 * 1024
+    try:
+        client = kaa.rpc.Client(path, 'secret')
+        yield kaa.inprogress(client)
+        big = '\0' * (512 * 1024)
+        assert((yield client.rpc('echo', big)) == big)
+        assert(client.compression_stats['sent'] == 0)
+        closed = client.signals.subset('closed').any()
+        payload = zlib.compress(big)
+        client._socket.write(kaa.rpc.RPC_PACKET_HEADER.pack(1, 'CALL', len(payload) | kaa.rpc.RPC_PACKET_COMPRESSED) + payload)
+        yield closed.timeout(2)
+        assert(not client.connected)
+    finally:
+        kaa.rpc.RPC_DECOMPRESS_MAX = max_len
+    server.close()
+    os.unlink(path)
+
+
+@kaa.coroutine()
+def main():
+    yield test(None, None, None)
+    yield test(['zlib_fast', 'zlib'], None, 'zlib_fast')
+    yield test(['zlib_fast', 'zlib'], ['zlib'], 'zlib')
+    # Clients may decline compression.
+    yield test(['zlib'], [], None)
+    yield test_limits()
+    print 'ok'
+
+main().wait()
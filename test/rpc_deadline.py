@@ -0,0 +1,89 @@
+import os
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    aborted = 0
+
+    @kaa.rpc.expose()
+    @kaa.coroutine()
+    def sleep(self, seconds):
+        try:
+            yield kaa.delay(seconds)
+        except kaa.InProgressAborted:
+            self.aborted += 1
+            raise
+        yield seconds
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_deadline.sock')
+
+packets = []
+send_packet = kaa.rpc.Channel._send_packet
+def count_packet(self, seq, type, payload):
+    packets.append(type)
+    return send_packet(self, seq, type, payload)
+kaa.rpc.Channel._send_packet = count_packet
+
+
+@kaa.coroutine()
+def test(deadlines):
+    service = Service()
+    server = kaa.rpc.Server(path, 'secret', features=deadlines)
+    server.register(service)
+    client = kaa.rpc.Client(path, 'secret')
+    yield kaa.inprogress(client)
+    channel = list(server._channels)[0]
+    del packets[:]
+
+    # Deadlines of calls answered in time are stopped.
+    results = [client.rpc_timeout(5, 'sleep', 0.01) for i in range(10)]
+    yield kaa.InProgressAll(*results)
+    assert(channel._deadline_timers == {} and channel._rpc_running == {})
+
+    # Expired deadlines abort the call on the remote end, if it supports
+    # deadlines.
+    try:
+        yield client.rpc_timeout(0.05, 'sleep', 0.3)
+    except kaa.TimeoutException:
+        pass
+    else:
+        assert(False)
+    yield kaa.delay(0.05)
+    assert(service.aborted == (1 if deadlines else 0))
+
+    # So does cancelling the call.
+    call = client.rpc('sleep', 0.3)
+    yield kaa.delay(0.05)
+    call.abort()
+    yield kaa.delay(0.05)
+    assert(service.aborted == (2 if deadlines else 0))
+    assert(('CNCL' in packets) == deadlines)
+
+    # Calls exceeding max_in_flight are queued.
+    client.max_in_flight = 2
+    client.max_queued = 3
+    calls = [client.rpc('sleep', 0.01) for i in range(5)]
+    assert(len(client._rpc_in_progress) == 2 and len(client._call_queue) == 3)
+    try:
+        client.rpc('sleep', 0)
+    except kaa.rpc.TooManyCallsError:
+        pass
+    else:
+        assert(False)
+    yield kaa.InProgressAll(*calls)
+    yield kaa.delay(0.3)
+
+    client.close()
+    server.close()
+    os.unlink(path)
+
+
+@kaa.coroutine()
+def main():
+    yield test(True)
+    # Servers not offering extensions don't learn about deadlines.
+    yield test(False)
+    print 'ok'
+
+main().wait()
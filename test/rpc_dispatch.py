@@ -0,0 +1,126 @@
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+import kaa
+import kaa.rpc
+
+class LazyPool(object):
+    """
+    Creates the pool on first use, so that its workers know the functions
+    defined in this script.
+    """
+    pool = None
+    def apply_async(self, *args, **kwargs):
+        if not self.pool:
+            self.pool = multiprocessing.Pool(2)
+        return self.pool.apply_async(*args, **kwargs)
+
+processes = LazyPool()
+
+@kaa.rpc.expose(pool=processes)
+def square(n):
+    return n * n
+
+@kaa.rpc.expose(pool=processes, concurrency=1)
+def pid(delay):
+    time.sleep(delay)
+    return os.getpid()
+
+@kaa.rpc.expose(pool=processes)
+def fail():
+    raise ValueError('expected')
+
+@kaa.rpc.expose(pool=processes)
+def unpicklable():
+    return threading.Lock()
+
+class Service(object):
+    running = 0
+    max_running = 0
+
+    @kaa.rpc.expose(pool='rpc', concurrency=2)
+    def blocking(self, delay):
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        time.sleep(delay)
+        self.running -= 1
+        return threading.current_thread().name
+
+    @kaa.rpc.expose(pool=processes)
+    def method(self):
+        return 1
+
+    @kaa.rpc.expose(concurrency=1)
+    @kaa.coroutine()
+    def limited(self, delay):
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        yield kaa.delay(delay)
+        self.running -= 1
+        yield delay
+
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_dispatch.sock')
+
+@kaa.coroutine()
+def expect(exc, ip):
+    try:
+        yield ip
+    except exc:
+        pass
+    else:
+        assert(False)
+
+
+@kaa.coroutine()
+def main():
+    threads = kaa.register_thread_pool('rpc', kaa.ThreadPool(4))
+    service = Service()
+    server = kaa.rpc.Server(path, 'secret')
+    server.register(service)
+    for func in (square, pid, fail, unpicklable):
+        server.register(func)
+    client = kaa.rpc.Client(path, 'secret')
+    yield kaa.inprogress(client)
+
+    # Thread pool, with concurrency limit.
+    names = yield kaa.InProgressAll(*[client.rpc('blocking', 0.05) for i in range(6)])
+    assert(service.max_running == 2)
+    assert(all(name.result != threading.current_thread().name for name in names))
+
+    # Concurrency limit of functions in the main loop.
+    service.max_running = 0
+    yield kaa.InProgressAll(*[client.rpc('limited', 0.01) for i in range(3)])
+    assert(service.max_running == 1)
+
+    # Process pool.
+    assert((yield client.rpc('square', 7)) == 49)
+    pids = yield kaa.InProgressAll(*[client.rpc('pid', 0.01) for i in range(4)])
+    assert(os.getpid() not in [p.result for p in pids])
+    assert(pid._kaa_rpc_dispatcher.running == 0)
+    yield expect(ValueError, client.rpc('fail'))
+
+    # Calls or results which can't be pickled fail rather than never being
+    # answered, and free their concurrency slot.
+    yield expect(Exception, client.rpc('method').timeout(5))
+    yield expect(Exception, client.rpc('unpicklable').timeout(5))
+    for func in (square, fail, unpicklable, Service.method.im_func):
+        assert(func._kaa_rpc_dispatcher.running == 0)
+    assert((yield client.rpc('square', 3)) == 9)
+
+    client.close()
+    server.close()
+    os.unlink(path)
+    processes.pool.terminate()
+    processes.pool.join()
+    # Stop the pool threads, which would otherwise wake up during interpreter
+    # shutdown.
+    members = threads._members[:]
+    threads.size = 0
+    for member in members:
+        member.join()
+    print 'ok'
+
+main().wait()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    aborted = 0
+
+    @kaa.rpc.expose()
+    def square(self, n):
+        return n * n
+
+    @kaa.rpc.expose(stream=True)
+    def numbers(self, n):
+        return iter(range(n))
+
+    @kaa.rpc.expose()
+    @kaa.coroutine()
+    def sleep(self, seconds):
+        try:
+            yield kaa.delay(seconds)
+        except kaa.InProgressAborted:
+            self.aborted += 1
+            raise
+        yield seconds
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_features.sock')
+
+packets = []
+send_packet = kaa.rpc.Channel._send_packet
+def count_packet(self, seq, type, payload):
+    packets.append(type)
+    return send_packet(self, seq, type, payload)
+kaa.rpc.Channel._send_packet = count_packet
+
+
+@kaa.coroutine()
+def main():
+    # Protocol extensions are negotiated without any server options.
+    service = Service()
+    server = kaa.rpc.Server(path, 'secret')
+    server.register(service)
+    client = kaa.rpc.Client(path, 'secret')
+    yield kaa.inprogress(client)
+    assert(client._features == frozenset(kaa.rpc.RPC_FEATURES))
+    assert(list(server._channels)[0]._features == client._features)
+
+    # Batches are sent as one packet.
+    del packets[:]
+    with client.batch() as batch:
+        results = [batch.rpc('square', n) for n in range(5)]
+    assert([(yield r) for r in results] == [0, 1, 4, 9, 16])
+    assert(sorted(packets) == ['BRTN', 'BTCH'])
+
+    # Results are streamed.
+    stream = yield client.rpc('numbers', 3)
+    assert(isinstance(stream, kaa.rpc.Stream))
+    items = []
+    while True:
+        item = yield stream.read()
+        if item is None:
+            break
+        items.append(item)
+    assert(items == [0, 1, 2])
+
+    # Aborted calls are cancelled on the remote end.
+    call = client.rpc('sleep', 0.3)
+    yield kaa.delay(0.05)
+    call.abort()
+    yield kaa.delay(0.05)
+    assert('CNCL' in packets and service.aborted == 1)
+
+    client.close()
+    server.close()
+    os.unlink(path)
+    print 'ok'
+
+main().wait()
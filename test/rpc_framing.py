@@ -0,0 +1,50 @@
+import os
+import random
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    @kaa.rpc.expose()
+    def echo(self, value):
+        return value
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_framing.sock')
+random.seed(1)
+
+@kaa.coroutine()
+def main():
+    server = kaa.rpc.Server(path, 'secret')
+    server.register(Service())
+    client = kaa.rpc.Client(path, 'secret')
+    yield kaa.inprogress(client)
+
+    # Packets split at any point, or several in one chunk, are received
+    # whole and in order.
+    packets = [(i, 'TEST', os.urandom(random.choice((0, 1, 11, 12, 13, 1000, 70000)))) for i in range(300)]
+    data = ''.join(kaa.rpc.RPC_PACKET_HEADER.pack(*packet[:2] + (len(packet[2]),)) + packet[2]
+                   for packet in packets)
+    received = []
+    client._handle_packet_after_auth = lambda *packet: received.append(packet)
+    pos = 0
+    while pos < len(data):
+        n = random.choice((1, 5, 12, 100, 4096, 65536, 200000))
+        # Chunks are memoryviews, only valid during the call.
+        chunk = bytearray(data[pos:pos + n])
+        client._handle_read(memoryview(chunk))
+        chunk[:] = 'x' * len(chunk)
+        pos += n
+    assert(received == packets)
+    del client._handle_packet_after_auth
+
+    # Large payloads in both directions.
+    for size in (100, 300 * 1024, 900 * 1024):
+        value = os.urandom(size)
+        assert((yield client.rpc('echo', value)) == value)
+
+    client.close()
+    server.close()
+    os.unlink(path)
+    print 'ok'
+
+main().wait()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    def __init__(self, name):
+        self.name = name
+
+    @kaa.rpc.expose()
+    def whoami(self):
+        return self.name
+
+    @kaa.rpc.expose()
+    @kaa.coroutine()
+    def slow(self):
+        yield kaa.delay(0.1)
+        yield self.name
+
+tmp = tempfile.mkdtemp()
+paths = [os.path.join(tmp, 'rpc_pool%d.sock' % i) for i in range(2)]
+
+channels = {0: [], 1: []}
+def start_server(i):
+    server = kaa.rpc.Server(paths[i], 'secret')
+    server.register(Service(i))
+    server.signals['client-connected'].connect(channels[i].append)
+    return server
+
+
+@kaa.coroutine()
+def main():
+    servers = [start_server(i) for i in range(2)]
+    pool = kaa.rpc.ClientPool(paths, 'secret', size=2, retry=0.1,
+                              health_interval=0.2, health_timeout=0.1)
+    assert(len(pool.clients) == 4)
+    yield kaa.inprogress(pool)
+    yield kaa.delay(0.1)
+    assert(all(client.connected for client in pool.clients))
+
+    # Concurrent calls are spread over all connections.
+    calls = [pool.rpc('slow') for i in range(8)]
+    assert(all(len(client._rpc_in_progress) == 2 for client in pool.clients))
+    results = yield kaa.InProgressAll(*calls)
+    assert(sorted(ip.result for ip in results) == [0, 0, 0, 0, 1, 1, 1, 1])
+    assert((yield pool.rpc_timeout(1, 'whoami')) in (0, 1))
+
+    # Lost connections are excluded, and reestablished.
+    servers[1].close()
+    os.unlink(paths[1])
+    for channel in channels[1]:
+        channel.close()
+    del channels[1][:]
+    yield kaa.delay(0.05)
+    assert(pool.connected)
+    names = yield kaa.InProgressAll(*[pool.rpc('whoami') for i in range(4)])
+    assert([ip.result for ip in names] == [0, 0, 0, 0])
+    assert(len([client for client in pool.clients if client.connected]) == 2)
+    servers[1] = start_server(1)
+    yield kaa.delay(0.5)
+    assert(all(client.connected for client in pool.clients))
+
+    # A connection not answering pings is closed and reconnected.
+    client = pool.clients[0]
+    client.ping = lambda: kaa.InProgress()
+    closed = []
+    client.signals['closed'].connect(lambda *args: closed.append(True))
+    yield kaa.delay(0.4)
+    assert(closed)
+    del client.ping
+    yield kaa.delay(0.3)
+    assert(client.connected)
+
+    pool.close()
+    assert(not pool.connected)
+    try:
+        pool.rpc('whoami')
+    except kaa.rpc.NotConnectedError:
+        pass
+    else:
+        assert(False)
+    for server in servers:
+        server.close()
+    print 'ok'
+
+main().wait()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import kaa
+import kaa.rpc
+
+class Service(object):
+    @kaa.rpc.expose()
+    @kaa.coroutine()
+    def sleep(self, t):
+        yield kaa.delay(t)
+        yield 'x' * 1000
+
+    @kaa.rpc.expose()
+    def fail(self):
+        raise ValueError('expected')
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_stats.sock')
+
+@kaa.coroutine()
+def main():
+    server = kaa.rpc.Server(path, 'secret')
+    server.register(Service())
+    assert(server.stats is None)
+    server_stats = server.enable_stats(introspection=True)
+    client = kaa.rpc.Client(path, 'secret')
+    client_stats = client.enable_stats()
+    yield kaa.inprogress(client)
+
+    for i in range(10):
+        yield client.rpc('sleep', 0.01)
+    yield client.rpc('sleep', 0.1)
+    for i in range(2):
+        try:
+            yield client.rpc('fail')
+        except ValueError:
+            pass
+
+    served = server_stats.served['sleep']
+    issued = client_stats.issued['sleep']
+    for stats in (served, issued):
+        assert(stats.calls == 11 and stats.errors == 0)
+        assert(0.2 <= stats.time.total < 0.5)
+        # Percentiles are the upper bounds of histogram buckets.
+        assert(stats.time.percentile(50) in (0.05, 0.1))
+        assert(stats.time.max >= 0.1)
+    # The answers are counted as received by the client and sent by the server.
+    assert(served.bytes_out > 11000 and issued.bytes_in == served.bytes_out)
+    assert(issued.bytes_out == served.bytes_in > 0)
+    assert(server_stats.served['fail'].calls == 2 and server_stats.served['fail'].errors == 2)
+    assert(client_stats.issued['fail'].errors == 2)
+    assert(not client_stats.served and not server_stats.issued)
+    assert(server_stats.serialization.count > 0 and client_stats.serialization.count > 0)
+
+    # Introspection returns a snapshot of the server statistics.
+    snapshot = yield client.rpc('kaa.rpc.stats')
+    assert(snapshot['served']['sleep']['calls'] == 11)
+    assert(snapshot['served']['fail']['errors'] == 2)
+    assert(snapshot['served']['sleep']['p99'] >= 0.1)
+    summary = client_stats.summary()
+    assert('issued sleep' in summary and '11 calls' in summary)
+
+    # Clients connecting later share the server statistics.
+    client2 = kaa.rpc.Client(path, 'secret')
+    yield kaa.inprogress(client2)
+    yield client2.rpc('sleep', 0)
+    assert(server_stats.served['sleep'].calls == 12)
+    assert(client2.stats is None)
+
+    server_stats.reset()
+    assert(not server_stats.served)
+    server.disable_stats()
+    client.disable_stats()
+    yield client.rpc('sleep', 0)
+    assert(not server_stats.served and client.stats is None)
+    assert(client_stats.issued['sleep'].calls == 11)
+
+    client.close()
+    client2.close()
+    server.close()
+    os.unlink(path)
+    print 'ok'
+
+main().wait()
@@ -0,0 +1,160 @@
+import os
+import tempfile
+import kaa
+import kaa.rpc
+
+class Countdown(object):
+    """
+    Picklable iterator, which is returned as is by functions not exposed
+    with stream=True.
+    """
+    def __init__(self, n):
+        self.n = n
+    def __iter__(self):
+        return self
+    def next(self):
+        if not self.n:
+            raise StopIteration
+        self.n -= 1
+        return self.n
+
+class Service(object):
+    produced = 0
+    closed = False
+
+    @kaa.rpc.expose(stream=True)
+    def numbers(self, n):
+        return iter(range(n))
+
+    @kaa.rpc.expose(stream=True)
+    def big(self, n):
+        self.produced = 0
+        self.closed = False
+        try:
+            for i in range(n):
+                self.produced += 1
+                yield 'x' * 64 * 1024
+        finally:
+            self.closed = True
+
+    @kaa.rpc.expose(stream=True)
+    def fail(self):
+        yield 1
+        raise ValueError('expected')
+
+    @kaa.rpc.expose(stream=True)
+    @kaa.coroutine()
+    def delayed(self):
+        yield kaa.NotFinished
+        yield iter('abc')
+
+    @kaa.rpc.expose(stream=True)
+    def file(self, path):
+        return open(path, 'rb')
+
+    @kaa.rpc.expose()
+    def countdown(self, n):
+        return Countdown(n)
+
+
+@kaa.coroutine()
+def read_all(stream):
+    items = []
+    while True:
+        item = yield stream.read()
+        if item is None:
+            break
+        items.append(item)
+    assert(stream.finished)
+    yield items
+
+
+path = os.path.join(tempfile.mkdtemp(), 'rpc_stream.sock')
+data = os.urandom(200 * 1024)
+datafile = tempfile.NamedTemporaryFile()
+datafile.write(data)
+datafile.flush()
+
+@kaa.coroutine()
+def test(streams):
+    service = Service()
+    server = kaa.rpc.Server(path, 'secret', features=streams)
+    server.register(service)
+    client = kaa.rpc.Client(path, 'secret')
+    yield kaa.inprogress(client)
+
+    result = yield client.rpc('countdown', 3)
+    assert(isinstance(result, Countdown) and list(result) == [2, 1, 0])
+
+    result = yield client.rpc('numbers', 5)
+    if streams:
+        assert(isinstance(result, kaa.rpc.Stream))
+        result = yield read_all(result)
+    assert(result == [0, 1, 2, 3, 4])
+
+    result = yield client.rpc('delayed')
+    if streams:
+        result = yield read_all(result)
+    assert(result == ['a', 'b', 'c'])
+
+    result = yield client.rpc('file', datafile.name)
+    if streams:
+        result = ''.join((yield read_all(result)))
+    assert(result == data)
+
+    if not streams:
+        # The whole result is sent at once.
+        try:
+            yield client.rpc('fail')
+        except ValueError:
+            pass
+        else:
+            assert(False)
+    else:
+        yield test_streams(client, service)
+
+    client.close()
+    server.close()
+    os.unlink(path)
+
+
+@kaa.coroutine()
+def test_streams(client, service):
+    stream = yield client.rpc('fail')
+    assert((yield stream.read()) == 1)
+    try:
+        yield stream.read()
+    except ValueError:
+        pass
+    else:
+        assert(False)
+
+    # The server stops producing while the items aren't read.
+    stream = yield client.rpc('big', 100)
+    yield kaa.delay(0.3)
+    window = kaa.rpc.RPC_STREAM_WINDOW / (64 * 1024)
+    assert(window <= service.produced <= window + 2)
+    for i in range(20):
+        yield stream.read()
+    yield kaa.delay(0.3)
+    assert(service.produced <= 20 + window + 2)
+    # Closing the stream stops the generator.
+    stream.close()
+    assert((yield stream.read()) is None)
+    yield kaa.delay(0.3)
+    assert(service.closed and service.produced < 100)
+
+    # Reading everything works with flow control.
+    stream = yield client.rpc('big', 30)
+    items = yield read_all(stream)
+    assert(len(items) == 30 and service.closed)
+
+
+@kaa.coroutine()
+def main():
+    yield test(True)
+    # Servers not offering extensions return results as a whole.
+    yield test(False)
+    print 'ok'
+
+main().wait()
@@ -0,0 +1,264 @@
+# -----------------------------------------------------------------------------
+# rpcbench.py - kaa.rpc benchmarks
+# -----------------------------------------------------------------------------
+# Measures throughput and latency percentiles of kaa.rpc calls over TCP
+# loopback and unix sockets, with the server running in a separate process.
+#
+# Run the benchmarks:
+#     python rpcbench.py [-t tcp,unix] [-s small,large] [--json result.json]
+#
+# Compare two runs, e.g. of different revisions; the exit status is 1 if
+# throughput dropped by more than the threshold in any benchmark:
+#     python rpcbench.py --compare old.json new.json [--threshold 10]
+#
+# Only the basic kaa.rpc API is used, so older revisions can be measured
+# with the same script.
+# -----------------------------------------------------------------------------
+import os
+import sys
+import time
+import json
+import socket
+import tempfile
+import optparse
+import subprocess
+
+import kaa
+import kaa.rpc
+
+SECRET = 'rpcbench'
+
+# name, exposed method, argument, number of calls, clients, outstanding
+# calls per client
+SCENARIOS = [
+    ('small', 'echo', 42, 20000, 1, 1),
+    ('small_window', 'echo', 42, 50000, 1, 50),
+    ('large', 'echo', 'x' * 256 * 1024, 1000, 1, 1),
+    ('clients', 'echo', 42, 50000, 20, 5),
+    ('coroutine', 'echo_coroutine', 42, 20000, 1, 10),
+]
+
+
+class Service(object):
+    @kaa.rpc.expose()
+    def echo(self, value):
+        return value
+
+    @kaa.rpc.expose(coroutine=True)
+    def echo_coroutine(self, value):
+        # Resume once from the main loop, like a coroutine waiting for IO.
+        yield kaa.NotFinished
+        yield value
+
+
+def serve(address):
+    """
+    Runs the benchmark server (in the child process).
+    """
+    server = kaa.rpc.Server(address, SECRET)
+    server.register(Service())
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    # Stop when the parent closes our stdin.
+    kaa.IOMonitor(lambda: sys.exit(0)).register(sys.stdin)
+    kaa.main.run()
+
+
+def start_server(transport):
+    """
+    Starts the benchmark server process and returns it along with the
+    address clients connect to.
+    """
+    if transport == 'tcp':
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+        spec, address = 'tcp:%d' % port, ('127.0.0.1', port)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'rpcbench.sock')
+        spec, address = 'unix:%s' % path, path
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', spec],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    if process.stdout.readline().strip() != 'ready':
+        raise SystemExit('benchmark server failed to start')
+    return process, address
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+@kaa.coroutine()
+def run(address, scenario, scale):
+    """
+    Runs one benchmark and returns its results.
+    """
+    name, method, arg, calls, nclients, concurrency = scenario
+    clients = [kaa.rpc.Client(address, SECRET) for i in range(nclients)]
+    for client in clients:
+        yield kaa.inprogress(client)
+    latencies = []
+
+    @kaa.coroutine()
+    def worker(client, remaining):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            t0 = time.time()
+            yield client.rpc(method, arg)
+            latencies.append(time.time() - t0)
+
+    # Warm up, then measure.
+    calls = max(int(calls * scale), 1)
+    for calls in (max(calls // 10, 1), calls):
+        remaining = [calls]
+        del latencies[:]
+        t0 = time.time()
+        yield kaa.InProgressAll(*[worker(client, remaining) for client in clients for i in range(concurrency)])
+        elapsed = time.time() - t0
+    for client in clients:
+        client.close()
+    latencies.sort()
+    size = len(arg) if isinstance(arg, str) else 0
+    yield {
+        'scenario': name,
+        'calls': calls,
+        'clients': nclients,
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'calls_per_sec': calls / elapsed,
+        # Payload bytes sent in both directions
+        'mb_per_sec': size * 2 * calls / elapsed / 1024 / 1024,
+        'p50': percentile(latencies, 50) * 1000,
+        'p90': percentile(latencies, 90) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': latencies[-1] * 1000
+    }
+
+
+@kaa.coroutine()
+def run_all(transports, scenarios, scale, repeat):
+    results = []
+    for transport in transports:
+        process, address = start_server(transport)
+        try:
+            for scenario in scenarios:
+                # Keep the fastest of several runs, which is least disturbed
+                # by other activity on the machine.
+                best = None
+                for i in range(repeat):
+                    result = yield run(address, scenario, scale)
+                    if not best or result['calls_per_sec'] > best['calls_per_sec']:
+                        best = result
+                best['transport'] = transport
+                print_result(best)
+                results.append(best)
+        finally:
+            process.stdin.close()
+            process.wait()
+    yield results
+
+
+def revision():
+    """
+    Returns the git revision of the kaa.base checkout being measured.
+    """
+    path = os.path.dirname(os.path.realpath(kaa.rpc.__file__))
+    try:
+        git = subprocess.Popen(['git', 'describe', '--always', '--dirty'], cwd=path,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        rev = git.communicate()[0].strip()
+        if git.returncode == 0 and rev:
+            return rev
+    except OSError:
+        pass
+    return 'unknown'
+
+
+def print_header():
+    print '%-5s %-14s %10s %8s %8s %8s %8s %8s' % \
+          ('', 'benchmark', 'calls/s', 'MB/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+
+
+def print_result(r):
+    print '%-5s %-14s %10.0f %8.1f %8.3f %8.3f %8.3f %8.3f' % \
+          (r['transport'], r['scenario'], r['calls_per_sec'], r['mb_per_sec'],
+           r['p50'], r['p90'], r['p99'], r['max'])
+
+
+def compare(old, new, threshold):
+    """
+    Prints the differences between two result files and returns the number
+    of benchmarks whose throughput dropped by more than threshold percent.
+    """
+    print '%s -> %s' % (old['revision'], new['revision'])
+    print '%-5s %-14s %10s %10s %8s %8s %8s' % \
+          ('', 'benchmark', 'calls/s', 'calls/s', 'change', 'p99 ms', 'p99 ms')
+    before = dict(((r['transport'], r['scenario']), r) for r in old['results'])
+    regressions = 0
+    for r in new['results']:
+        o = before.get((r['transport'], r['scenario']))
+        if not o:
+            continue
+        change = (r['calls_per_sec'] / o['calls_per_sec'] - 1) * 100
+        flag = ''
+        if change < -threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print '%-5s %-14s %10.0f %10.0f %+7.1f%% %8.3f %8.3f%s' % \
+              (r['transport'], r['scenario'], o['calls_per_sec'], r['calls_per_sec'], change,
+               o['p99'], r['p99'], flag)
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] | --compare OLD.json NEW.json')
+    parser.add_option('-t', '--transports', default='tcp,unix',
+                      help='comma separated transports to benchmark: tcp, unix [%default]')
+    parser.add_option('-s', '--scenarios', default=','.join(s[0] for s in SCENARIOS),
+                      help='comma separated benchmarks to run [%default]')
+    parser.add_option('-n', '--scale', type='float', default=1.0,
+                      help='multiply the number of calls by this factor [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='run each benchmark this many times and keep the fastest run [%default]')
+    parser.add_option('-j', '--json', metavar='FILE',
+                      help='write results to FILE as JSON (- for stdout)')
+    parser.add_option('-c', '--compare', action='store_true',
+                      help='compare two JSON result files')
+    parser.add_option('--threshold', type='float', default=10.0,
+                      help='throughput drop in percent considered a regression [%default]')
+    parser.add_option('--serve', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.serve:
+        transport, address = options.serve.split(':', 1)
+        return serve(('127.0.0.1', int(address)) if transport == 'tcp' else address)
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error('--compare needs two result files')
+        old, new = [json.load(open(path)) for path in args]
+        sys.exit(1 if compare(old, new, options.threshold) else 0)
+
+    scenarios = [s for s in SCENARIOS if s[0] in options.scenarios.split(',')]
+    transports = options.transports.split(',')
+    print_header()
+    ip = run_all(transports, scenarios, options.scale, options.repeat)
+    ip.connect_both(lambda result: kaa.main.stop(), lambda *exc: kaa.main.stop())
+    kaa.main.run()
+    results = ip.result
+    if options.json:
+        data = json.dumps({
+            'revision': revision(),
+            'python': sys.version.split()[0],
+            'time': time.time(),
+            'results': results
+        }, indent=2, sort_keys=True)
+        if options.json == '-':
+            print data
+        else:
+            open(options.json, 'w').write(data + '\n')
+
+
+if __name__ == '__main__':
+    main()
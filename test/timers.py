@@ -0,0 +1,102 @@
+import time
+import random
+import datetime
+import kaa
+from kaa.base import nf_generic
+
+random.seed(1)
+now = nf_generic.monotonic
+
+# Timers fire in the order of their expiry, and never early.
+fired = []
+def fire(n):
+    fired.append((n, now()))
+timers, expiry = [], {}
+for n in range(200):
+    interval = random.randint(1, 100) / 1000.0
+    timer = kaa.OneShotTimer(fire, n)
+    timer.start(interval)
+    expiry[n] = now() + interval
+    timers.append(timer)
+
+# Stopped and restarted timers are skipped at their old expiry.
+for timer in timers[::3]:
+    timer.stop()
+for n in range(1, 200, 3):
+    timers[n].start(0.15)
+    expiry[n] = now() + 0.15
+
+kaa.OneShotTimer(kaa.main.stop).start(0.3)
+kaa.main.run()
+assert(sorted(n for n, t in fired) == [n for n in range(200) if n % 3])
+# The expiry times noted here are a little later than the notifier's.
+assert(all(expiry[a] <= expiry[b] + 0.001 for (a, ta), (b, tb) in zip(fired, fired[1:])))
+assert(all(t >= expiry[n] - 0.001 for n, t in fired))
+
+# Repeating timers, and timers started from timer callbacks.
+ticks = []
+def tick():
+    ticks.append(now())
+    if len(ticks) == 5:
+        kaa.OneShotTimer(kaa.main.stop).start(0.02)
+        return False
+timer = kaa.Timer(tick)
+start = now()
+timer.start(0.01)
+kaa.main.run()
+assert(len(ticks) == 5 and not timer.active)
+# Repeating timers keep their phase, so a late tick doesn't delay the next.
+assert(all(n * 0.01 - 0.001 <= t - start < n * 0.01 + 0.02 for n, t in enumerate(ticks, 1)))
+
+# Timers that are restarted over and over don't make the heap grow.
+timer = kaa.OneShotTimer(lambda: None)
+for i in range(10000):
+    timer.start(10)
+assert(len(nf_generic.__dict__['__timer_heap']) < 5000)
+timer.stop()
+
+# Sub-millisecond intervals are honoured.
+fired = []
+start = now()
+kaa.OneShotTimer(lambda: fired.append(now())).start(0.0005)
+while not fired:
+    kaa.main.step()
+assert(fired[0] - start >= 0.0005)
+
+# With slack, timers due close together fire in one wakeup, but not early.
+kaa.set_timer_slack(0.05)
+steps, fired = [0], []
+def step():
+    steps[0] += 1
+kaa.main.signals['step'].connect(step)
+start = now()
+for interval in (0.01, 0.02, 0.03):
+    kaa.OneShotTimer(lambda i=interval: fired.append((i, now()))).start(interval)
+while len(fired) < 3:
+    kaa.main.step()
+kaa.main.signals['step'].disconnect(step)
+kaa.set_timer_slack(0)
+assert(steps[0] == 1)
+assert(all(t - start >= interval for interval, t in fired))
+
+# Timers don't depend on the system time.
+fired = []
+time_time = time.time
+time.time = lambda: time_time() - 3600
+try:
+    kaa.OneShotTimer(fired.append, True).start(0.01)
+    kaa.OneShotTimer(kaa.main.stop).start(0.05)
+    kaa.main.run()
+finally:
+    time.time = time_time
+assert(fired == [True])
+
+# At timers fired before their time of day because the system time was set
+# back are restarted for the remaining time.
+fired = []
+timer = kaa.OneShotAtTimer(fired.append, True)
+timer._last_time = datetime.datetime.now() + datetime.timedelta(seconds=60)
+timer()
+assert(not fired and timer.active)
+timer.stop()
+print 'ok'
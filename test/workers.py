@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import tempfile
+import kaa
+import kaa.utils
+
+# Workers report "index pid" through this pipe.
+r, w = os.pipe()
+marker = os.path.join(tempfile.mkdtemp(), 'died')
+
+supervisor = os.fork()
+if not supervisor:
+    os.close(r)
+    index = kaa.utils.fork_workers(3)
+    if index is None:
+        # All workers have been terminated.
+        os._exit(0)
+    assert(kaa.utils.worker_index() == index)
+    try:
+        kaa.utils.fork_workers(2)
+    except RuntimeError:
+        pass
+    else:
+        os._exit(2)
+    os.write(w, '%d %d\n' % (index, os.getpid()))
+    if index == 0 and not os.path.exists(marker):
+        # Dies once, and is respawned with the same index.
+        open(marker, 'w').close()
+        os._exit(1)
+    kaa.main.run()
+    os._exit(0)
+
+os.close(w)
+assert(kaa.utils.worker_index() is None)
+reports = ''
+deadline = time.time() + 10
+while reports.count('\n') < 4 and time.time() < deadline:
+    reports += os.read(r, 1024)
+workers = [tuple(int(v) for v in line.split()) for line in reports.splitlines()]
+assert(sorted(index for index, pid in workers) == [0, 0, 1, 2])
+assert(len(set(pid for index, pid in workers)) == 4)
+
+# Terminating the supervisor terminates all workers.
+os.kill(supervisor, signal.SIGTERM)
+assert(os.waitpid(supervisor, 0)[1] == 0)
+for index, pid in workers:
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        assert(e.errno == errno.ESRCH)
+    else:
+        assert(False)
+
+# Sockets listening with reuse_port share the address.
+sock = socket.socket()
+sock.bind(('127.0.0.1', 0))
+port = sock.getsockname()[1]
+sock.close()
+sockets = [kaa.Socket(), kaa.Socket()]
+for sock in sockets:
+    sock.listen(('127.0.0.1', port), reuse_port=True)
+try:
+    kaa.Socket().listen(('127.0.0.1', port))
+except socket.error:
+    pass
+else:
+    assert(False)
+for sock in sockets:
+    sock.close()
+print 'ok'